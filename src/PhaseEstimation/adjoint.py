@@ -0,0 +1,239 @@
+""" This module implements the adjoint-method gradients of the VQE energies """
+import pennylane as qml
+import numpy as np
+import jax
+import jax.numpy as jnp
+
+from PhaseEstimation import simulator
+
+from typing import Callable, List, Tuple, Union
+
+##############
+
+# The derivative of E(params) = <psi|H|psi>, |psi> = U_n ... U_1|0>, with respect to the
+# parameter of the gate U_k is
+#       dE/dtheta_k = 2 Re <lambda_k| dU_k/dtheta_k |phi_(k-1)>
+# where phi_(k-1) = U_(k-1) ... U_1|0> and lambda_k = U_(k+1)^dag ... U_n^dag H|psi>.
+# Both are obtained walking the circuit backwards from |psi> and H|psi>, hence only a few
+# states are kept in memory whatever the depth of the circuit (reverse-mode differentiation
+# of the simulation stores the state after every gate).
+# The walk goes through the fused layers of the simulator (see simulator.fuse):
+#   > wall W = ⊗_w M_w: with phi, lambda taken after the wall, the derivative of the gate
+#     U_j of the wire w (M_w = A_j U_j B_j) is 2 Re Tr(D_j T_w), where
+#     D_j = A_j dU_j U_j^dag A_j^dag and T_w = Tr_(other wires)(|phi><lambda|) is 2x2
+#   > permutation: no parameters, the inverse gather is applied to phi and lambda
+#   > gate: gate by gate, as in the formula above
+
+
+def circuit_gates(circuit_fun: Callable, N: int) -> Tuple[List[Tuple[qml.operation.Operator, Union[int, None]]], int]:
+    """
+    Gates of a VQE circuit together with the index of their parameter.
+    The circuit is recorded with params = [0, 1, 2, ...], hence each rotation
+    carries the index of its own parameter
+
+    Parameters
+    ----------
+    circuit_fun : function
+        Function of the VQE circuit, circuit_fun(N, params)
+    N : int
+        Number of qubits
+
+    Returns
+    -------
+    List[Tuple[qml.operation.Operator, int]]
+        List of (gate, index of its parameter or None)
+    int
+        Number of parameters of the circuit
+    """
+    with qml.tape.QuantumTape() as tape:
+        n_params = circuit_fun(N, np.arange(10000, dtype=float))
+
+    gates = []
+    for op in tape.operations:
+        if isinstance(op, qml.Barrier):
+            continue
+        if op.num_params == 0:
+            gates.append((op, None))
+        elif op.num_params == 1 and float(op.data[0]).is_integer():
+            gates.append((op, int(op.data[0])))
+        else:
+            raise ValueError("Adjoint gradients need gates with a single parameter of the circuit ({0})".format(op.name))
+
+    return gates, n_params
+
+
+def apply_matrix(matrix: jnp.ndarray, wires: List[int], state: jnp.ndarray) -> jnp.ndarray:
+    """
+    Apply the matrix of a gate to some wires of a (2,)*N state tensor
+
+    Parameters
+    ----------
+    matrix : jnp.ndarray
+        Matrix (2^k, 2^k) of the gate
+    wires : List[int]
+        The k wires of the gate
+    state : jnp.ndarray
+        State tensor
+
+    Returns
+    -------
+    jnp.ndarray
+        New state tensor
+    """
+    k = len(wires)
+    matrix = jnp.reshape(matrix, (2,) * 2 * k)
+    state = jnp.tensordot(matrix, state, axes=(list(range(k, 2 * k)), list(wires)))
+
+    return jnp.moveaxis(state, list(range(k)), list(wires))
+
+
+def _inverse_permutation(operations: List[qml.operation.Operator], state: jnp.ndarray) -> jnp.ndarray:
+    """
+    Inverse of simulator.apply_permutation: psi_old = (conj(phases) * psi_new)[source^-1]
+    """
+    source, phases = simulator.permutation(operations, state.ndim)
+    new_state = jnp.reshape(state, (-1,))
+    if not np.all(phases == 1):
+        new_state = jnp.asarray(np.conj(phases.real if np.all(phases.imag == 0) else phases)) * new_state
+
+    return jnp.reshape(new_state[np.argsort(source)], state.shape)
+
+
+def _generator(op: qml.operation.Operator) -> Union[np.ndarray, None]:
+    """
+    Matrix i*G of a gate U(theta) = exp(i theta G), so that dU/dtheta U^dag = i*G
+    (None if the gate has no generator)
+    """
+    try:
+        return 1j * qml.matrix(qml.generator(op, format="observable"), wire_order=op.wires)
+    except (qml.operation.GeneratorUndefinedError, ValueError, TypeError):
+        return None
+
+
+def _dagger(matrix):
+    return jnp.conj(jnp.transpose(jnp.asarray(matrix)))
+
+
+def get_energy_fn(circuit_fun: Callable, N: int, expval_fn: Callable, apply_fn: Callable) -> Callable:
+    """
+    Energy of the state of a VQE circuit, E(params, coefficients) = <psi(params)|H|psi(params)>,
+    whose gradient is computed by the adjoint method. Both the forward and the backward
+    pass go through the fused layers of the simulator
+
+    Parameters
+    ----------
+    circuit_fun : function
+        Function of the VQE circuit, circuit_fun(N, params)
+    N : int
+        Number of qubits
+    expval_fn : function
+        Matrix-free expectation values of the operator basis (see operators.get_expval_fn)
+    apply_fn : function
+        Matrix-free action of the Hamiltonian (see operators.get_apply_fn)
+
+    Returns
+    -------
+    function
+        Function (params, coefficients) -> energy, differentiable by JAX (single site, vmap for batches)
+    """
+    gates, _ = circuit_gates(circuit_fun, N)
+    indexes = {id(op): index for op, index in gates}
+    layers = simulator.fuse([op for op, _ in gates])
+    # dU/dtheta U^dag of the parametrized gates, constant for the rotations
+    generators = {id(op): _generator(op) for op, index in gates if index is not None}
+    # Real-amplitude mode (see simulator.fused_final_state)
+    real = simulator.is_real([op for op, _ in gates])
+
+    def cast(matrix):
+        matrix = jnp.asarray(matrix)
+
+        return jnp.real(matrix) if real else matrix
+
+    def derivative(op, U, params):
+        # dU/dtheta U^dag
+        if generators[id(op)] is not None:
+            return cast(generators[id(op)])
+        dU = jax.jacfwd(lambda theta: qml.matrix(op.__class__(theta, wires=op.wires)))(params[indexes[id(op)]])
+
+        return cast(dU) @ _dagger(U)
+
+    def bind(op, params):
+        # Gate with the actual value of its parameter
+        index = indexes[id(op)]
+
+        return op if index is None else op.__class__(params[index], wires=op.wires)
+
+    def state(params):
+        psi = jnp.zeros((2,) * N, dtype=float if real else complex).at[(0,) * N].set(1)
+        psi = simulator.apply_operations([bind(op, params) for op, _ in gates], psi)
+
+        return jnp.reshape(psi, (-1,))
+
+    @jax.custom_vjp
+    def energy(params, coefficients):
+        return jnp.dot(expval_fn(state(params)), coefficients)
+
+    def energy_fwd(params, coefficients):
+        psi = state(params)
+        expvals = expval_fn(psi)
+
+        # Only the final state is kept for the backward pass
+        return jnp.dot(expvals, coefficients), (params, coefficients, psi, expvals)
+
+    def energy_bwd(residuals, g):
+        params, coefficients, psi, expvals = residuals
+        # > phi: state after the current layer
+        # > lam: H|psi> walked back to after the current layer
+        phi = jnp.reshape(psi, (2,) * N)
+        lam = jnp.reshape(apply_fn(psi, coefficients), (2,) * N)
+
+        # Contributions to the gradient, summed by a single scatter at the end
+        contributions, contribution_indexes = [], []
+        for kind, layer in reversed(layers):
+            if kind == "wall":
+                wall = {wire: [bind(op, params) for op in ops] for wire, ops in layer.items()}
+                wires, matrices = simulator.wall_matrices(wall)
+                matrices = [cast(matrix) for matrix in matrices]
+                for wire in wires:
+                    ops = layer[wire]
+                    if all(indexes[id(op)] is None for op in ops):
+                        continue
+                    others = [w for w in range(N) if w != wire]
+                    T = jnp.tensordot(jnp.conj(lam), phi, axes=(others, others))
+
+                    after = jnp.eye(2)  # Product of the gates following the j-th one
+                    for op, bound in zip(reversed(ops), reversed(wall[wire])):
+                        index = indexes[id(op)]
+                        U = cast(qml.matrix(bound))
+                        if index is not None:
+                            D = after @ derivative(op, U, params) @ _dagger(after)
+                            contributions.append(2 * jnp.real(jnp.sum(D * T)))
+                            contribution_indexes.append(index)
+                        after = after @ U
+
+                daggers = [_dagger(matrix) for matrix in matrices]
+                phi = simulator.apply_single_qubit(wires, daggers, phi)
+                lam = simulator.apply_single_qubit(wires, daggers, lam)
+            elif kind == "permutation":
+                phi = _inverse_permutation(layer, phi)
+                lam = _inverse_permutation(layer, lam)
+            else:
+                op, index = layer, indexes[id(layer)]
+                op_wires = [int(w) for w in op.wires]
+                U = cast(qml.matrix(bind(op, params)))
+                if index is not None:
+                    D = derivative(op, U, params)
+                    contributions.append(2 * jnp.real(jnp.vdot(lam, apply_matrix(D, op_wires, phi))))
+                    contribution_indexes.append(index)
+                phi = apply_matrix(_dagger(U), op_wires, phi)
+                lam = apply_matrix(_dagger(U), op_wires, lam)
+
+        grads = jnp.zeros_like(params)
+        if contributions:
+            grads = grads.at[np.array(contribution_indexes)].add(jnp.stack(contributions))
+
+        return g * grads, g * expvals
+
+    energy.defvjp(energy_fwd, energy_bwd)
+
+    return energy
@@ -2,6 +2,8 @@
 import pennylane as qml
 from pennylane import numpy as np
 
+from PhaseEstimation import operators
+
 from typing import Tuple, List
 
 ##############
@@ -89,8 +91,8 @@ def build_Hs(
 
     Returns
     -------
-    np.array
-        Array of pennylane Hamiltonians
+    operators.operator_grid
+        Grid of the Hamiltonians (pennylane Hamiltonians are built on access)
     np.array
         Array of labels for analytical solutions
     np.array
@@ -103,33 +105,36 @@ def build_Hs(
     kappa_values = np.linspace(0, -np.abs(kappa_max), n_kappas)
     h_values     = np.linspace(0,  h_max, n_hs)
 
-    Hs = []  # Array of the Pennylane hamiltonians
-    labels = []  # Array of the labels:
+    # Array of parameters [N, L, K], kappa is the slow index
+    kappas, hs = [grid.flatten() for grid in np.meshgrid(kappa_values, h_values, indexing="ij")]
+    anni_params = np.stack((N * np.ones(len(hs)), hs, kappas), axis=1)
+
+    # Array of the labels:
     #   > [1,1] for paramagnetic states
     #   > [0,1] for ferromagnetic states
     #   > [1,0] for antiphase states
-    #   > [None,None] for states with no analytical solutions
-    anni_params = []  # Array of parameters [N, L, K]
-
-    for kappa in kappa_values:
-        for h in h_values:
-            anni_params.append([N, h, kappa])
-            Hs.append(get_H(int(N), float(h), float(kappa), ring))
-
-            # Append the known labels (phases of the model)
-            if kappa == 0:
-                if h < 1:
-                    labels.append([0, 1])  # Ferromagnetic
-                else:
-                    labels.append([1, 1])  # Paramagnetic
-            elif h == 0:
-                if kappa < -0.5:
-                    labels.append([1, 0])  # Antiphase
-                else:
-                    labels.append([0, 1])  # Ferromagnetic
-
-            else:
-                labels.append([-1, -1])
+    #   > [-1,-1] for states with no analytical solutions
+    labels = -np.ones((len(hs), 2), dtype=int)
+    # Known labels (phases of the model) on the axes
+    on_h_axis, on_kappa_axis = (kappas == 0), (hs == 0) & (kappas != 0)
+    labels[on_h_axis & (hs < 1)] = [0, 1]  # Ferromagnetic
+    labels[on_h_axis & (hs >= 1)] = [1, 1]  # Paramagnetic
+    labels[on_kappa_axis & (kappas < -0.5)] = [1, 0]  # Antiphase
+    labels[on_kappa_axis & (kappas >= -0.5)] = [0, 1]  # Ferromagnetic
+
+    # Every Hamiltonian is a linear combination of the same operators:
+    #     H = -h * Σsigma^i_z - Σsigma^i_x*sigma_x^{i+1} - kappa * Σsigma^i_x*sigma_x^{i+2}
+    # the Pennylane Hamiltonians will be built only when accessed
+    Hs = operators.operator_grid(
+        N,
+        ring,
+        distances=(1, 2),
+        coefficients=np.stack(
+            (-anni_params[:, 1], -np.ones(len(anni_params)), -anni_params[:, 2]), axis=1
+        ),
+        qml_func=get_H,
+        qml_params=anni_params[:, 1:],
+    )
 
     # Array of indices for the order of states to train through VQE
     #     INDICES                RECYCLE RULE
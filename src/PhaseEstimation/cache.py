@@ -0,0 +1,267 @@
+""" This module implements the on-disk cache of the exact spectra of the Hamiltonians """
+import numpy as np
+import scipy.sparse as sparse
+import hashlib
+import os
+import tempfile
+
+from typing import List, Tuple, Union
+from numbers import Number
+
+##############
+
+
+class spectra_cache:
+    def __init__(self, path: str, max_bytes: int = 2 ** 32):
+        """
+        Content-addressed cache of eigenvalues and eigenvectors.
+        Every entry is stored as two .npy files (<key>.e.npy, <key>.psi.npy) so that the
+        eigenvectors can be memory-mapped. When the cache grows over max_bytes, the
+        least recently used entries are deleted
+
+        Parameters
+        ----------
+        path : str
+            Directory of the cache
+        max_bytes : int
+            Maximum size of the cache on disk
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        # Size on disk, computed lazily
+        self._size = None
+
+        os.makedirs(self.path, exist_ok=True)
+
+    def _files(self, key: str) -> Tuple[str, str]:
+        return (
+            os.path.join(self.path, key + ".e.npy"),
+            os.path.join(self.path, key + ".psi.npy"),
+        )
+
+    def get(
+        self, key: str, n_levels: int, mmap: bool = True
+    ) -> Union[Tuple[List[Number], List[List[Number]]], None]:
+        """
+        Look up the n_levels lowest eigenvalues and eigenvectors of an entry
+
+        Parameters
+        ----------
+        key : str
+            Key of the entry (see grid_key, matrix_key)
+        n_levels : int
+            Number of (lowest) energy levels desired
+        mmap : bool
+            if True the eigenvectors are memory-mapped instead of being read
+
+        Returns
+        -------
+        np.ndarray
+            Array of the n_levels lowest eigenvalues, None if the entry is missing
+            or it holds less levels
+        np.ndarray
+            Array (dim, n_levels) of the eigenvectors
+        """
+        file_e, file_psi = self._files(key)
+        try:
+            e = np.load(file_e)
+            if len(e) < n_levels:
+                return None
+            psi = np.load(file_psi, mmap_mode="r" if mmap else None)
+        except (OSError, ValueError):
+            return None
+
+        # Mark the entry as recently used
+        for filename in (file_e, file_psi):
+            try:
+                os.utime(filename)
+            except OSError:
+                pass
+
+        return e[:n_levels], psi[:, :n_levels]
+
+    def put(self, key: str, eigvals: List[Number], eigvecs: List[List[Number]]):
+        """
+        Store eigenvalues and eigenvectors of an entry, the files are written atomically
+
+        Parameters
+        ----------
+        key : str
+            Key of the entry (see grid_key, matrix_key)
+        eigvals : np.ndarray
+            Array of the eigenvalues
+        eigvecs : np.ndarray
+            Array (dim, n_levels) of the eigenvectors
+        """
+        for filename, array in zip(self._files(key), (eigvals, eigvecs)):
+            fd, tmp = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                np.save(f, np.asarray(array))
+            os.replace(tmp, filename)
+            if self._size is not None:
+                self._size += os.path.getsize(filename)
+
+        if self.size() > self.max_bytes:
+            self.evict()
+
+    def size(self) -> int:
+        """
+        Size of the cache on disk (bytes)
+        """
+        if self._size is None:
+            self._size = sum(
+                entry.stat().st_size for entry in os.scandir(self.path) if entry.is_file()
+            )
+
+        return self._size
+
+    def evict(self):
+        """
+        Delete the least recently used entries until the cache size is below max_bytes
+        """
+        # Files being written (.tmp) are left alone
+        entries = sorted(
+            (entry.stat().st_mtime, entry.stat().st_size, entry.path)
+            for entry in os.scandir(self.path)
+            if entry.name.endswith(".npy")
+        )
+        self._size = sum(size for _, size, _ in entries)
+        for _, size, filename in entries:
+            if self._size <= self.max_bytes:
+                break
+            try:
+                os.remove(filename)
+                self._size -= size
+            except OSError:
+                pass
+
+    def clear(self):
+        """
+        Delete every entry of the cache
+        """
+        for entry in os.scandir(self.path):
+            if not entry.is_file():
+                continue
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+        self._size = 0
+
+
+def grid_key(grid, idx: int) -> str:
+    """
+    Key of the idx-th Hamiltonian of a grid (see operators.operator_grid), built from
+    the parameters of the model: (N, ring, distances, coefficients)
+
+    Parameters
+    ----------
+    grid : operators.operator_grid
+        Grid of the Hamiltonians
+    idx : int
+        Index of the point of the grid
+
+    Returns
+    -------
+    str
+        Key of the Hamiltonian
+    """
+    h = hashlib.sha256()
+    h.update(repr(("grid", grid.N, grid.ring, grid.distances)).encode())
+    h.update(np.ascontiguousarray(grid.coefficients[idx], dtype=np.float64).tobytes())
+
+    return h.hexdigest()
+
+
+def matrix_key(mat_H: sparse.spmatrix) -> str:
+    """
+    Key of a Hamiltonian built from the content of its sparse matrix
+
+    Parameters
+    ----------
+    mat_H : scipy.sparse.spmatrix
+        Sparse matrix of the Hamiltonian
+
+    Returns
+    -------
+    str
+        Key of the Hamiltonian
+    """
+    mat_H = sparse.csr_matrix(mat_H)
+    mat_H.sum_duplicates()
+    mat_H.sort_indices()
+
+    h = hashlib.sha256()
+    h.update(repr(("matrix", mat_H.shape, str(mat_H.dtype))).encode())
+    for array in (mat_H.indptr, mat_H.indices, mat_H.data):
+        h.update(np.ascontiguousarray(array).tobytes())
+
+    return h.hexdigest()
+
+
+# Cache used by the exact diagonalization functions, it can be
+# moved with set_cache(path) or disabled with set_cache(None)
+_UNSET = object()
+active_cache = _UNSET
+
+
+def set_cache(path: Union[str, None], max_bytes: int = 2 ** 32) -> Union[spectra_cache, None]:
+    """
+    Set the directory of the cache of the exact spectra
+
+    Parameters
+    ----------
+    path : str or None
+        Directory of the cache, if None the cache is disabled
+    max_bytes : int
+        Maximum size of the cache on disk
+
+    Returns
+    -------
+    spectra_cache or None
+        The active cache
+    """
+    global active_cache
+    active_cache = spectra_cache(path, max_bytes) if path is not None else None
+
+    return active_cache
+
+
+def default_path() -> Union[str, None]:
+    """
+    Default directory of the caches of the package: $PHASEESTIMATION_CACHE, or
+    ~/.cache/PhaseEstimation. Setting PHASEESTIMATION_CACHE to an empty string disables them
+
+    Returns
+    -------
+    str or None
+        Directory of the caches (None if disabled)
+    """
+    path = os.environ.get(
+        "PHASEESTIMATION_CACHE",
+        os.path.join(os.path.expanduser("~"), ".cache", "PhaseEstimation"),
+    )
+
+    return path if path else None
+
+
+def get_cache() -> Union[spectra_cache, None]:
+    """
+    Active cache of the exact spectra (None if disabled).
+    By default it is located in default_path()
+
+    Returns
+    -------
+    spectra_cache or None
+        The active cache
+    """
+    global active_cache
+    if active_cache is _UNSET:
+        path = default_path()
+        try:
+            set_cache(path)
+        except OSError:
+            # Not writable, run without cache
+            active_cache = None
+
+    return active_cache
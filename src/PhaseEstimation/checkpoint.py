@@ -0,0 +1,127 @@
+""" This module implements the append-only checkpoints of the VQE sweeps """
+import numpy as np
+import os
+import pickle
+import struct
+import tempfile
+import zlib
+
+from typing import List, Tuple, Union
+
+##############
+
+# Layout of the checkpoint file: a sequence of frames
+#       [length (8 bytes) | crc32 (4 bytes) | pickled record]
+# the first record is the header of the sweep (see vqe.train), every other one holds the
+# results of a step of the sweep. New steps are only appended to the file, hence a
+# checkpoint costs as much as the sites it adds, whatever the size of the grid.
+# A frame interrupted by a crash fails its length or its checksum: it is discarded
+# (together with whatever follows it) when the file is read
+_FRAME = struct.Struct("<QI")
+
+
+def _frame(record: dict) -> bytes:
+    payload = pickle.dumps(record, protocol=pickle.HIGHEST_PROTOCOL)
+
+    return _FRAME.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+class checkpoint:
+    def __init__(self, path: str, every: int = 1):
+        """
+        Append-only log of the steps of a sweep. The steps are buffered and written to disk
+        every `every` steps: each write appends whole frames and is synced, so the file always
+        ends with the last completed write (see read)
+
+        Parameters
+        ----------
+        path : str
+            File of the checkpoint
+        every : int
+            Number of steps between two writes
+        """
+        self.path = path
+        self.every = max(1, every)
+        self._buffer = []
+
+    def start(self, header: dict):
+        """
+        Start a new sweep: the file is atomically replaced by one holding only the header
+
+        Parameters
+        ----------
+        header : dict
+            Description of the sweep (to check that a resumed sweep is the same)
+        """
+        self._buffer = []
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(_frame(header))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+
+    def read(self) -> Tuple[Union[dict, None], List[dict]]:
+        """
+        Header and steps of the checkpoint. A torn frame at the end of the file
+        (write interrupted by a crash) is cut away
+
+        Returns
+        -------
+        dict or None
+            Header of the sweep, None if the file is missing or empty
+        List[dict]
+            Records of the steps, in order
+        """
+        try:
+            with open(self.path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None, []
+
+        records, offset = [], 0
+        while offset + _FRAME.size <= len(data):
+            length, crc = _FRAME.unpack_from(data, offset)
+            payload = data[offset + _FRAME.size : offset + _FRAME.size + length]
+            if len(payload) < length or zlib.crc32(payload) != crc:
+                break
+            records.append(pickle.loads(payload))
+            offset += _FRAME.size + length
+
+        if offset < len(data):
+            # Following appends must start after the last valid frame
+            with open(self.path, "r+b") as f:
+                f.truncate(offset)
+
+        if not records:
+            return None, []
+
+        return records[0], records[1:]
+
+    def append(self, **record):
+        """
+        Add a step of the sweep, written to disk with the following every - 1 ones
+
+        Parameters
+        ----------
+        **record : arguments
+            Content of the step (arrays are stored as numpy arrays)
+        """
+        self._buffer.append(
+            {key: np.asarray(value) if hasattr(value, "shape") else value for key, value in record.items()}
+        )
+        if len(self._buffer) >= self.every:
+            self.flush()
+
+    def flush(self):
+        """
+        Write the buffered steps (a single synced append)
+        """
+        if not self._buffer:
+            return
+        with open(self.path, "ab") as f:
+            f.write(b"".join(_frame(record) for record in self._buffer))
+            f.flush()
+            os.fsync(f.fileno())
+        self._buffer = []
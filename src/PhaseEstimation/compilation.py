@@ -0,0 +1,136 @@
+""" This module implements the shared registry of compiled functions and the persistent XLA compilation cache """
+import jax
+import os
+import threading
+import warnings
+
+from PhaseEstimation import cache
+
+from typing import Callable, Hashable, List, Tuple, Union
+
+##############
+
+# Compiled functions shared by the instances of the classes, see get_compiled
+registry: dict = {}
+_lock = threading.RLock()
+
+# Directory of the persistent compilation cache (None if not enabled)
+persistent_path: Union[str, None] = None
+
+
+def enable_persistent_cache(path: Union[str, None] = None) -> Union[str, None]:
+    """
+    Store the compiled XLA programs on disk, so that they are not compiled again
+    by other processes (e.g. after vqe.load_vqe). By default the cache is located in
+    the xla subdirectory of cache.default_path().
+    The cache is opt-in: it changes the configuration of JAX for the whole process,
+    hence it is never enabled by the classes of the package.
+    JAX 0.4.20 stores only the programs compiled for GPU and TPU: on CPU the cache
+    stays empty (the XLA runtime flag that enables it makes the compilation much slower)
+
+    Parameters
+    ----------
+    path : str
+        Directory of the compilation cache
+
+    Returns
+    -------
+    str or None
+        Directory of the compilation cache, None if it could not be enabled
+    """
+    global persistent_path
+    if path is None:
+        root = cache.default_path()
+        if root is None:
+            return None
+        path = os.path.join(root, "xla")
+
+    if jax.default_backend() == "cpu":
+        warnings.warn("The persistent compilation cache stores only GPU and TPU programs")
+
+    try:
+        os.makedirs(path, exist_ok=True)
+        try:
+            jax.config.update("jax_compilation_cache_dir", path)
+        except AttributeError:
+            # Older versions of JAX
+            from jax.experimental.compilation_cache import compilation_cache
+
+            compilation_cache.initialize_cache(path)
+    except Exception as error:
+        warnings.warn("Persistent compilation cache not enabled: {0}".format(error))
+        path = None
+
+    persistent_path = path
+
+    return path
+
+
+def get_compiled(key: Hashable, build: Callable) -> dict:
+    """
+    Functions registered under key, build() is called only the first time.
+    Keys are (name, circuit function, N, ..., device) so that every instance with the
+    same circuit shares the same jitted functions, and their caches of compiled programs
+    (one for each batch shape)
+
+    Parameters
+    ----------
+    key : tuple
+        Key of the functions
+    build : function
+        Function building the functions
+
+    Returns
+    -------
+    dict
+        Dictionary of the functions
+    """
+    with _lock:
+        if key not in registry:
+            registry[key] = build()
+
+        return registry[key]
+
+
+def warm_up(
+    calls: List[Tuple[Callable, tuple]], background: bool = True
+) -> Union[threading.Thread, None]:
+    """
+    Compile jitted functions ahead of their use by calling them on example arguments
+    (of the same shapes and types of the actual ones).
+    In background, the compilation runs while the main thread does something else
+    (e.g. the exact diagonalization of the Hamiltonians)
+
+    Parameters
+    ----------
+    calls : List[Tuple[function, tuple]]
+        List of (jitted function, example arguments)
+    background : bool
+        if True the functions are compiled by a separate thread
+
+    Returns
+    -------
+    threading.Thread or None
+        Thread of the compilation (if background)
+    """
+
+    def run():
+        for function, args in calls:
+            jax.block_until_ready(function(*args))
+
+    if not background:
+        run()
+        return None
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+
+    return thread
+
+
+def clear():
+    """
+    Empty the registry of compiled functions
+    """
+    with _lock:
+        registry.clear()
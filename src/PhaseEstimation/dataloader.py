@@ -0,0 +1,127 @@
+""" This module implements the mini-batch loader of the training data of the QCNN """
+import numpy as np
+import jax
+import jax.numpy as jnp
+import queue
+import threading
+
+from typing import Any, Iterator, List, Tuple, Union
+
+##############
+
+
+class batch_loader:
+    def __init__(
+        self,
+        source: Any,
+        labels: np.ndarray,
+        rows: List[int],
+        batch_size: int,
+        shuffle: bool = True,
+        prefetch: int = 2,
+        seed: Union[int, None] = None,
+    ):
+        """
+        Stream of shuffled mini-batches (X, Y) of a dataset. Only the rows of a batch are read from
+        the source (e.g. the memory-mapped VQE states of state_bank.state_bank) and moved to the
+        device, by a background thread that keeps up to `prefetch` batches ready.
+        Every batch has batch_size rows, hence the training step is compiled once: the last
+        incomplete batch of each pass is dropped, the following pass is shuffled again.
+        The rows are sorted (together with their labels), hence the rows of each batch are
+        read in increasing order
+
+        Parameters
+        ----------
+        source : array-like
+            Inputs, indexed by rows (np.ndarray, np.memmap, state_bank.state_bank, ...)
+        labels : np.ndarray
+            Labels of the rows (same order of rows)
+        rows : List[int]
+            Rows of the source in the dataset
+        batch_size : int
+            Number of rows of each batch (at most the number of rows)
+        shuffle : bool
+            if True the rows are shuffled at every pass over the dataset
+        prefetch : int
+            Number of batches prepared in advance
+        seed : int
+            Seed of the random generator
+        """
+        if len(rows) < max(1, batch_size):
+            raise ValueError(f"{len(rows)} rows are fewer than a batch of {batch_size}")
+
+        # Sorted rows: contiguous reads of memory-mapped sources
+        order = np.argsort(rows, kind="stable")
+        self.source = source
+        self.labels = np.asarray(labels)[order]
+        self.rows = np.asarray(rows, dtype=int)[order]
+        self.batch_size = max(1, batch_size)
+        self.shuffle = shuffle
+        self.prefetch = max(1, prefetch)
+        self.rng = np.random.default_rng(seed)
+
+    def __len__(self) -> int:
+        """
+        Number of batches of a pass over the dataset
+        """
+        return len(self.rows) // self.batch_size
+
+    def _batches(self) -> Iterator[np.ndarray]:
+        # Positions (in rows) of the batches, pass after pass
+        while True:
+            order = self.rng.permutation(len(self.rows)) if self.shuffle else np.arange(len(self.rows))
+            for start in range(0, len(self) * self.batch_size, self.batch_size):
+                # Sorted positions of sorted rows: increasing reads of the source
+                yield np.sort(order[start : start + self.batch_size])
+
+    def _load(self, positions: np.ndarray) -> Tuple[jnp.ndarray, jnp.ndarray]:
+        X = np.asarray(self.source[self.rows[positions]])
+
+        return jax.device_put(X), jax.device_put(self.labels[positions])
+
+    def stream(self, n_batches: int) -> Iterator[Tuple[jnp.ndarray, jnp.ndarray]]:
+        """
+        Iterate over n_batches batches, loaded in the background
+
+        Parameters
+        ----------
+        n_batches : int
+            Number of batches
+
+        Returns
+        -------
+        Iterator[Tuple[jnp.ndarray, jnp.ndarray]]
+            Batches (X, Y) of inputs and labels
+        """
+        ready = queue.Queue(maxsize=self.prefetch)
+        stop = threading.Event()
+
+        def put(item) -> bool:
+            # Wait for room in the queue unless the consumer stopped
+            while not stop.is_set():
+                try:
+                    ready.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def worker():
+            try:
+                for _, positions in zip(range(n_batches), self._batches()):
+                    if not put(self._load(positions)):
+                        return
+            except Exception as error:
+                put(error)
+
+        thread = threading.Thread(target=worker, daemon=True)
+        thread.start()
+        try:
+            for _ in range(n_batches):
+                item = ready.get()
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            stop.set()
+            thread.join()
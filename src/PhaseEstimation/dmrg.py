@@ -0,0 +1,342 @@
+""" This module implements a matrix-product-state DMRG solver for the ground states of large open chains """
+import numpy as np
+import scipy.sparse.linalg as sparse_linalg
+from tqdm.auto import tqdm
+
+from PhaseEstimation import operators
+
+from typing import List, Tuple, Union
+from numbers import Number
+
+##############
+
+# Tensors conventions:
+#   > MPS tensor          A[a_left, s, a_right]
+#   > MPO tensor          W[w_left, w_right, s_out, s_in]
+#   > Left environment    L[a_out, w, a_in]
+#   > Right environment   R[b_out, w, b_in]
+# where s = 0 is spin up, as for the wires of Pennylane
+
+PAULI_I = np.eye(2)
+PAULI_X = np.array([[0.0, 1.0], [1.0, 0.0]])
+PAULI_Z = np.array([[1.0, 0.0], [0.0, -1.0]])
+
+
+def get_mpo(grid: operators.operator_grid, idx: int) -> List[np.ndarray]:
+    """
+    Matrix product operator of the idx-th Hamiltonian of a grid (open chains only):
+            H = c_0 * Σsigma^i_z + Σ_d c_d * Σsigma^i_x*sigma^(i+d)_x
+    The bond index counts how many sites ago a sigma_x was placed (0: none yet,
+    1..max(distances): pending interaction, last: interaction completed), hence the
+    bond dimension is max(distances) + 2
+
+    Parameters
+    ----------
+    grid : operators.operator_grid
+        Grid of the Hamiltonians
+    idx : int
+        Index of the point of the grid
+
+    Returns
+    -------
+    List[np.ndarray]
+        List of the N tensors of the MPO
+    """
+    if grid.ring:
+        raise ValueError("The DMRG solver supports only open-boundaries chains")
+
+    D = max(grid.distances) + 2
+    W = np.zeros((D, D, 2, 2))
+    W[0, 0] = W[D - 1, D - 1] = PAULI_I
+    W[0, 1] = PAULI_X
+    for k in range(1, D - 2):
+        W[k, k + 1] = PAULI_I
+    W[0, D - 1] = grid.coefficients[idx, 0] * PAULI_Z
+    for distance, coeff in zip(grid.distances, grid.coefficients[idx, 1:]):
+        W[distance, D - 1] += coeff * PAULI_X
+
+    # The first tensor starts from the row 0, the last one ends on the column D - 1
+    return [W[:1]] + [W] * (grid.N - 2) + [W[:, D - 1 :]]
+
+
+def random_mps(N: int, chi: int = 1, seed: Union[int, None] = None) -> List[np.ndarray]:
+    """
+    Random real MPS of N spins
+
+    Parameters
+    ----------
+    N : int
+        Number of spins of the chain
+    chi : int
+        Bond dimension
+    seed : int
+        Seed of the random generator
+
+    Returns
+    -------
+    List[np.ndarray]
+        List of the N tensors of the MPS
+    """
+    rng = np.random.default_rng(seed)
+    dims = [min(chi, 2 ** i, 2 ** (N - i)) for i in range(N + 1)]
+
+    return [rng.normal(size=(dims[i], 2, dims[i + 1])) for i in range(N)]
+
+
+def right_canonical(mps: List[np.ndarray]) -> List[np.ndarray]:
+    """
+    Bring a MPS in right-canonical form (and normalize it) through a sweep of QR decompositions
+
+    Parameters
+    ----------
+    mps : List[np.ndarray]
+        List of the tensors of the MPS
+
+    Returns
+    -------
+    List[np.ndarray]
+        List of the right-canonical tensors
+    """
+    mps = [A.copy() for A in mps]
+    for i in range(len(mps) - 1, 0, -1):
+        a, s, b = mps[i].shape
+        Q, R = np.linalg.qr(mps[i].reshape(a, s * b).T)
+        mps[i] = Q.T.reshape(-1, s, b)
+        mps[i - 1] = np.tensordot(mps[i - 1], R.T, axes=(2, 0))
+    mps[0] = mps[0] / np.linalg.norm(mps[0])
+
+    return mps
+
+
+def perturb_mps(
+    mps: List[np.ndarray], chi: int, noise: Number = 1e-3, seed: Union[int, None] = None
+) -> List[np.ndarray]:
+    """
+    Enlarge the bonds of a MPS up to chi and add random noise to its tensors.
+    A warm start which is exactly an eigenstate of a (classical) neighbouring Hamiltonian
+    can trap the local updates of DMRG, the extra bond space lets them leave it
+
+    Parameters
+    ----------
+    mps : List[np.ndarray]
+        List of the tensors of the MPS
+    chi : int
+        Bond dimension of the enlarged MPS
+    noise : float
+        Amplitude of the noise (relative to the normalized tensors)
+    seed : int
+        Seed of the random generator
+
+    Returns
+    -------
+    List[np.ndarray]
+        List of the tensors of the perturbed MPS
+    """
+    rng = np.random.default_rng(seed)
+    N = len(mps)
+    dims = [min(chi, 2 ** i, 2 ** (N - i)) for i in range(N + 1)]
+
+    perturbed = []
+    for i, A in enumerate(mps):
+        a, s, b = A.shape
+        P = noise * rng.normal(size=(max(a, dims[i]), s, max(b, dims[i + 1])))
+        P[:a, :, :b] += A / np.linalg.norm(A)
+        perturbed.append(P)
+
+    return perturbed
+
+
+def _update_left(L, A, W):
+    t = np.tensordot(L, A, axes=(2, 0))
+    t = np.tensordot(t, W, axes=([1, 2], [0, 3]))
+
+    return np.tensordot(A.conj(), t, axes=([0, 1], [0, 3])).transpose(0, 2, 1)
+
+
+def _update_right(R, B, W):
+    t = np.tensordot(B, R, axes=(2, 2))
+    t = np.tensordot(t, W, axes=([1, 3], [3, 1]))
+
+    return np.tensordot(B.conj(), t, axes=([1, 2], [3, 1])).transpose(0, 2, 1)
+
+
+def _apply_two_sites(theta, L, W1, W2, R):
+    t = np.tensordot(L, theta, axes=(2, 0))
+    t = np.tensordot(t, W1, axes=([1, 2], [0, 3]))
+    t = np.tensordot(t, W2, axes=([3, 1], [0, 3]))
+
+    return np.tensordot(t, R, axes=([1, 3], [2, 1]))
+
+
+def _local_ground_state(theta, L, W1, W2, R, tol):
+    """
+    Lowest eigenpair of the effective two-sites Hamiltonian, starting from theta
+    """
+    shape = theta.shape
+    dim = theta.size
+
+    def matvec(x):
+        return _apply_two_sites(x.reshape(shape), L, W1, W2, R).ravel()
+
+    if dim <= 64:
+        mat_H = np.array([matvec(x) for x in np.eye(dim)]).T
+        eigvals, eigvecs = np.linalg.eigh((mat_H + mat_H.T) / 2)
+    else:
+        op = sparse_linalg.LinearOperator((dim, dim), matvec=matvec, dtype=theta.dtype)
+        eigvals, eigvecs = sparse_linalg.eigsh(op, k=1, which="SA", v0=theta.ravel(), tol=tol)
+
+    return eigvals[0], eigvecs[:, 0].reshape(shape)
+
+
+def _split(theta, chi_max, svd_min):
+    """
+    SVD of a two-sites tensor truncated to the chi_max largest singular values
+    """
+    a, s1, s2, b = theta.shape
+    U, S, Vt = np.linalg.svd(theta.reshape(a * s1, s2 * b), full_matrices=False)
+    chi = max(1, min(chi_max, np.sum(S > svd_min)))
+    S = S[:chi] / np.linalg.norm(S[:chi])
+
+    return U[:, :chi].reshape(a, s1, chi), S, Vt[:chi].reshape(chi, s2, b)
+
+
+def dmrg(
+    mpo: List[np.ndarray],
+    mps: Union[List[np.ndarray], None] = None,
+    chi_max: int = 32,
+    n_sweeps: int = 10,
+    tol: Number = 1e-8,
+    svd_min: Number = 1e-10,
+    noise: Number = 1e-3,
+) -> Tuple[float, List[np.ndarray]]:
+    """
+    Two-sites DMRG: minimize the energy of a MPS by optimizing two neighbouring tensors at a time,
+    sweeping back and forth along the chain
+
+    Parameters
+    ----------
+    mpo : List[np.ndarray]
+        Matrix product operator of the Hamiltonian (see get_mpo)
+    mps : List[np.ndarray]
+        Initial MPS (e.g. the ground state of a close Hamiltonian), random if None
+    chi_max : int
+        Maximum bond dimension of the MPS
+    n_sweeps : int
+        Maximum number of sweeps (left to right and back)
+    tol : float
+        The sweeps are stopped when the energy changes less than tol
+    svd_min : float
+        Singular values below svd_min are discarded
+    noise : float
+        Amplitude of the perturbation of the initial MPS (see perturb_mps)
+
+    Returns
+    -------
+    float
+        Ground-state energy
+    List[np.ndarray]
+        MPS of the ground state (right-canonical)
+    """
+    N = len(mpo)
+    if mps is None:
+        mps = random_mps(N, chi_max)
+    else:
+        mps = perturb_mps(mps, chi_max, noise)
+    mps = right_canonical(mps)
+
+    # Environments of the boundaries
+    Ls = [np.zeros((1, 1, 1))] + [None] * N
+    Rs = [None] * N + [np.zeros((1, 1, 1))]
+    Ls[0][0, 0, 0] = Rs[N][0, 0, 0] = 1
+    for i in range(N - 1, 1, -1):
+        Rs[i] = _update_right(Rs[i + 1], mps[i], mpo[i])
+
+    energy = np.inf
+    for _ in range(n_sweeps):
+        previous = energy
+        # Left to right
+        for i in range(N - 1):
+            theta = np.tensordot(mps[i], mps[i + 1], axes=(2, 0))
+            energy, theta = _local_ground_state(theta, Ls[i], mpo[i], mpo[i + 1], Rs[i + 2], tol)
+            A, S, B = _split(theta, chi_max, svd_min)
+            mps[i], mps[i + 1] = A, S[:, None, None] * B
+            Ls[i + 1] = _update_left(Ls[i], mps[i], mpo[i])
+        # Right to left
+        for i in range(N - 2, -1, -1):
+            theta = np.tensordot(mps[i], mps[i + 1], axes=(2, 0))
+            energy, theta = _local_ground_state(theta, Ls[i], mpo[i], mpo[i + 1], Rs[i + 2], tol)
+            A, S, B = _split(theta, chi_max, svd_min)
+            mps[i], mps[i + 1] = A * S[None, None, :], B
+            Rs[i + 1] = _update_right(Rs[i + 2], mps[i + 1], mpo[i + 1])
+
+        if abs(previous - energy) < tol:
+            break
+
+    return energy, mps
+
+
+def mps_state(mps: List[np.ndarray]) -> np.ndarray:
+    """
+    State vector (2^N) of a MPS, in the computational basis of Pennylane
+
+    Parameters
+    ----------
+    mps : List[np.ndarray]
+        List of the tensors of the MPS
+
+    Returns
+    -------
+    np.ndarray
+        State vector
+    """
+    psi = mps[0]
+    for A in mps[1:]:
+        psi = np.tensordot(psi, A, axes=(-1, 0))
+
+    return psi.reshape(-1)
+
+
+def grid_dmrg(
+    grid: operators.operator_grid,
+    recycle_rule: List[int],
+    chi_max: int = 32,
+    n_sweeps: int = 10,
+    tol: Number = 1e-8,
+    states: bool = False,
+) -> Tuple[np.ndarray, Union[List[List[np.ndarray]], None]]:
+    """
+    Ground-state energies of every Hamiltonian of a grid. The points are solved following
+    recycle_rule, each one starting from the MPS of the previous point
+
+    Parameters
+    ----------
+    grid : operators.operator_grid
+        Grid of the Hamiltonians
+    recycle_rule : np.ndarray
+        Order of the points
+    chi_max : int
+        Maximum bond dimension of the MPS
+    n_sweeps : int
+        Maximum number of sweeps for each point
+    tol : float
+        Tolerance on the energy
+    states : bool
+        if True the MPS of the ground states are returned as well
+
+    Returns
+    -------
+    np.ndarray
+        Array of the ground-state energies
+    List[List[np.ndarray]] or None
+        MPS of the ground states (if states)
+    """
+    energies = np.zeros(len(grid))
+    mps_list = [None] * len(grid) if states else None
+
+    mps = None
+    for idx in tqdm(recycle_rule):
+        energies[idx], mps = dmrg(get_mpo(grid, idx), mps, chi_max, n_sweeps, tol)
+        if states:
+            mps_list[idx] = [A.copy() for A in mps]
+
+    return energies, mps_list
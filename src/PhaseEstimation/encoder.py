@@ -15,7 +15,7 @@ from PhaseEstimation import circuits, vqe
 from PhaseEstimation import visualization as qplt
 from PhaseEstimation import general as qmlgen
 
-from typing import List, Callable
+from typing import List, Callable, Union
 from numbers import Number
 
 ##############
@@ -56,7 +56,7 @@ def encoder_circuit(N: int, params: List[Number]) -> int:
 
 
 class encoder:
-    def __init__(self, vqe: vqe.vqe, encoder_circuit: Callable):
+    def __init__(self, vqe: vqe.vqe, encoder_circuit: Callable, states_path: Union[str, None] = None):
         """
         Class for the Anomaly Detection algorithm
 
@@ -66,6 +66,8 @@ class encoder:
             VQE class
         encoder_circuit : function
             Function of the Encoder circuit
+        states_path : str
+            Directory of the memory-mapped VQE states (None: states kept in memory), see vqe.state_bank
         """
         self.vqe = vqe
         self.encoder_circuit_fun = lambda enc_p: encoder_circuit(self.vqe.Hs.N, enc_p)
@@ -74,6 +76,8 @@ class encoder:
         self.device = vqe.device
 
         self.vqe_params0 = np.array(vqe.vqe_params0)
+        # Input of the encoder: the VQE states, simulated only once (see vqe.state_bank)
+        self.states = vqe.state_bank(states_path)
 
         self.n_wires = self.vqe.Hs.N // 2 + self.vqe.Hs.N % 2
         self.n_trash = self.vqe.Hs.N // 2
@@ -94,8 +98,9 @@ class encoder:
 
         return qml.draw(circuit_drawer)(self)
 
-    def _vqe_enc_circuit(self, vqe_p: List[Number], qcnn_p: List[Number]):
-        self.vqe.circuit(vqe_p)
+    def _vqe_enc_circuit(self, psi: List[Number], qcnn_p: List[Number]):
+        # The VQE state psi (see vqe.state_bank) is prepared directly
+        qml.StatePrep(psi, wires=range(self.vqe.Hs.N))
         self.encoder_circuit_fun(qcnn_p)
 
     def train(
@@ -120,22 +125,23 @@ class encoder:
             print("+--- CIRCUIT ---+")
             print(self)
 
-        # Get the index of the training VQE states
-        X_train = jnp.array(self.vqe_params0[train_index])
+        # Get the training VQE states
+        X_train = self.states[train_index]
 
         @qml.qnode(self.device, interface="jax")
-        def q_encoder_circuit(vqe_params, params):
-            self._vqe_enc_circuit(vqe_params, params)
+        def q_encoder_circuit(psi, params):
+            self._vqe_enc_circuit(psi, params)
 
             return [qml.expval(qml.PauliZ(int(k))) for k in self.wires_trash]
 
+        # The qnode returns a list of expectation values, stacked as (n_trash,)
         v_q_encoder_circuit = jax.vmap(
-            lambda p, x: q_encoder_circuit(x, p), in_axes=(None, 0)
+            lambda p, x: jnp.stack(q_encoder_circuit(x, p)), in_axes=(None, 0)
         )
 
-        def compress(params, vqe_params):
-            return jnp.sum(1 - v_q_encoder_circuit(params, vqe_params)) / (
-                2 * len(vqe_params)
+        def compress(params, psi):
+            return jnp.sum(1 - v_q_encoder_circuit(params, psi)) / (
+                2 * len(psi)
             )
 
         jd_compress = jax.jit(jax.grad(lambda p: compress(p, X_train)))
@@ -214,11 +220,11 @@ def enc_classification_ANNNI(
     # We define a throwaway encoder just to use its device to define the quantum circuit
     encclass = encoder(vqeclass, encoder_circuit)
 
-    X = jnp.array(encclass.vqe_params0)
+    X = encclass.states[:]
 
     @qml.qnode(encclass.device, interface="jax")
-    def encoder_circuit_class(vqe_params, params):
-        encclass._vqe_enc_circuit(vqe_params, params)
+    def encoder_circuit_class(psi, params):
+        encclass._vqe_enc_circuit(psi, params)
 
         return [qml.expval(qml.PauliZ(int(k))) for k in encclass.wires_trash]
 
@@ -228,7 +234,7 @@ def enc_classification_ANNNI(
         encclass = encoder(vqeclass, encoder_circuit)
         encclass.train(lr, epochs, np.array([phase]), circuit=False)
         v_encoder_circuit = jax.vmap(
-            lambda x: encoder_circuit_class(x, encclass.params)
+            lambda x: jnp.stack(encoder_circuit_class(x, encclass.params))
         )
         exps = (1 - np.sum(v_encoder_circuit(X), axis=1) / 4) / 2
         exps = np.rot90(np.reshape(exps, (sidex, sidey)))
@@ -0,0 +1,299 @@
+""" This module implements the free-fermion (Jordan-Wigner) exact solution of the Ising chain with transverse field """
+import numpy as np
+
+from PhaseEstimation import operators
+
+from typing import List, Tuple, Union
+from numbers import Number
+
+##############
+
+# Through the Jordan-Wigner transformation
+#       sigma^i_z = 1 - 2 c^dag_i c_i,    sigma^i_x = Π_{j<i} sigma^j_z (c_i + c^dag_i)
+# the chain
+#       H = -Σ h_i sigma^i_z - Σ J_i sigma^i_x*sigma^(i+1)_x
+# becomes the quadratic Hamiltonian
+#       H = Σ A_ij c^dag_i c_j + 1/2 Σ (B_ij c^dag_i c^dag_j + h.c.) - Σ h_i
+# which is diagonalized by a Bogoliubov transformation (Lieb, Schultz, Mattis 1961):
+#       H = Σ_k eps_k (eta^dag_k eta_k - 1/2)
+# Every quantity below is obtained from N x N matrices, hence in O(N^3) time.
+# Correlators are written in terms of the Majorana operators
+#       a_i = c^dag_i + c_i,    b_i = c^dag_i - c_i
+# so that sigma^i_z = -b_i a_i and sigma^i_x*sigma^(i+1)_x = b_i a_(i+1)
+
+
+def bdg_matrices(
+    h: List[Number], J: List[Number], ring: bool = False, parity: int = 1
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Matrices A (symmetric) and B (antisymmetric) of the quadratic fermionic Hamiltonian
+    of the chain. If ring, the boundary interaction depends on the parity P = Π sigma^i_z
+    of the sector: antiperiodic fermions for P = +1, periodic for P = -1
+
+    Parameters
+    ----------
+    h : np.ndarray
+        Transverse magnetic field of each spin (length N)
+    J : np.ndarray
+        Interaction of each pair (i, i+1) (length N - 1, or N if ring)
+    ring : bool
+        If False, system has open-boundaries condition
+    parity : int
+        (IF ring) Parity of the sector (+1 or -1)
+
+    Returns
+    -------
+    np.ndarray
+        Matrix A
+    np.ndarray
+        Matrix B
+    """
+    N = len(h)
+    A = np.diag(2 * np.asarray(h, dtype=np.float64))
+    B = np.zeros((N, N))
+
+    bonds = [(i, i + 1, 1) for i in range(N - 1)]
+    if ring:
+        # sigma^(N-1)_x*sigma^0_x = -P b_(N-1) a_0
+        bonds.append((N - 1, 0, -parity))
+    for (i, j, sign), J_ij in zip(bonds, J):
+        # -J b_i a_j = -J (c^dag_i c_j + c^dag_j c_i + c^dag_i c^dag_j + c_j c_i)
+        A[i, j] -= sign * J_ij
+        A[j, i] -= sign * J_ij
+        B[i, j] -= sign * J_ij
+        B[j, i] += sign * J_ij
+
+    return A, B
+
+
+def bdg_modes(A: np.ndarray, B: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray, int]:
+    """
+    Normal modes of the quadratic Hamiltonian: (A - B) phi_k = eps_k psi_k,
+    (A + B) psi_k = eps_k phi_k
+
+    Parameters
+    ----------
+    A : np.ndarray
+        Symmetric matrix of the hopping terms
+    B : np.ndarray
+        Antisymmetric matrix of the pairing terms
+
+    Returns
+    -------
+    np.ndarray
+        Energies eps_k >= 0 of the modes (ascending)
+    np.ndarray
+        Array (N, N) of the vectors phi_k (rows)
+    np.ndarray
+        Array (N, N) of the vectors psi_k (rows)
+    int
+        Parity of the Bogoliubov vacuum (+1 or -1)
+    """
+    U, eps, Vt = np.linalg.svd(A - B)
+    # The vacuum of c (all spins up) has P = +1, every negative singular direction of
+    # A - B fills a mode
+    vacuum_parity = 1 if np.linalg.det(U) * np.linalg.det(Vt) > 0 else -1
+    order = np.argsort(eps)
+
+    return eps[order], Vt[order], U.T[order], vacuum_parity
+
+
+def correlation_matrix(phi: np.ndarray, psi: np.ndarray, occupied: List[int] = ()) -> np.ndarray:
+    """
+    Correlation matrix G_ij = <b_i a_j> of a Fock state of the normal modes
+
+    Parameters
+    ----------
+    phi : np.ndarray
+        Array (N, N) of the vectors phi_k (see bdg_modes)
+    psi : np.ndarray
+        Array (N, N) of the vectors psi_k (see bdg_modes)
+    occupied : List[int]
+        Indexes of the occupied modes (empty for the vacuum)
+
+    Returns
+    -------
+    np.ndarray
+        Correlation matrix (N, N)
+    """
+    signs = np.ones(len(phi))
+    signs[list(occupied)] = -1
+
+    return -(phi.T * signs) @ psi
+
+
+def chain_spectrum(
+    h: List[Number], J: List[Number], ring: bool = False
+) -> Tuple[float, float, np.ndarray]:
+    """
+    Ground-state energy, first excited energy and correlation matrix of the ground state
+    of the chain H = -Σ h_i sigma^i_z - Σ J_i sigma^i_x*sigma^(i+1)_x.
+    If ring, both parity sectors are solved and only the states with the parity of
+    their own sector are kept
+
+    Parameters
+    ----------
+    h : np.ndarray
+        Transverse magnetic field of each spin (length N)
+    J : np.ndarray
+        Interaction of each pair (i, i+1) (length N - 1, or N if ring)
+    ring : bool
+        If False, system has open-boundaries condition
+
+    Returns
+    -------
+    float
+        Ground-state energy
+    float
+        First excited energy
+    np.ndarray
+        Correlation matrix G_ij = <b_i a_j> of the ground state (see correlation_matrix)
+    """
+    candidates = []  # (energy, phi, psi, occupied modes)
+    for parity in [1, -1] if ring else [None]:
+        eps, phi, psi, vacuum_parity = bdg_modes(*bdg_matrices(h, J, ring, parity))
+        e_vacuum = -np.sum(eps) / 2
+
+        if parity is None or vacuum_parity == parity:
+            # Open chain: every Fock state is physical
+            candidates.append((e_vacuum, phi, psi, []))
+            candidates.append((e_vacuum + eps[0], phi, psi, [0]))
+            if parity is not None:
+                # Ring: states of the sector have an even number of excitations
+                candidates[-1] = (e_vacuum + eps[0] + eps[1], phi, psi, [0, 1])
+        else:
+            # Only states with an odd number of excitations
+            candidates.append((e_vacuum + eps[0], phi, psi, [0]))
+            candidates.append((e_vacuum + eps[1], phi, psi, [1]))
+
+    candidates.sort(key=lambda candidate: candidate[0])
+    e0, phi, psi, occupied = candidates[0]
+
+    return e0, candidates[1][0], correlation_matrix(phi, psi, occupied)
+
+
+def is_free(grid: operators.operator_grid) -> np.ndarray:
+    """
+    Points of a grid that are free-fermionic: no interaction beyond the nearest neighbours
+    (e.g. the Ising chain and the kappa = 0 line of the ANNNI model)
+
+    Parameters
+    ----------
+    grid : operators.operator_grid
+        Grid of the Hamiltonians
+
+    Returns
+    -------
+    np.ndarray
+        Boolean mask of the free-fermionic points
+    """
+    if 1 not in grid.distances:
+        return np.zeros(len(grid), dtype=bool)
+
+    others = [k + 1 for k, distance in enumerate(grid.distances) if distance != 1]
+
+    return np.all(grid.coefficients[:, others] == 0, axis=1)
+
+
+def grid_spectrum(
+    grid: operators.operator_grid, indexes: Union[List[int], None] = None
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Exact ground-state and first excited energies and ground-state correlation matrices
+    of free-fermionic points of a grid (see is_free)
+
+    Parameters
+    ----------
+    grid : operators.operator_grid
+        Grid of the Hamiltonians
+    indexes : List[int]
+        Points of the grid (all the free-fermionic ones if None)
+
+    Returns
+    -------
+    np.ndarray
+        Array (len(indexes), 2) of the energies
+    np.ndarray
+        Array (len(indexes), N, N) of the correlation matrices
+    """
+    free = is_free(grid)
+    indexes = np.arange(len(grid))[free] if indexes is None else np.asarray(indexes, dtype=int)
+    if not np.all(free[indexes]):
+        raise ValueError("Some of the points are not free-fermionic")
+
+    N = grid.N
+    n_bonds = N if grid.ring else N - 1
+    # Coefficients of Σsigma^i_z and Σsigma^i_x*sigma^(i+1)_x
+    c_z, c_xx = grid.coefficients[:, 0], grid.coefficients[:, 1 + grid.distances.index(1)]
+
+    e_list, G_list = [], []
+    for idx in indexes:
+        e0, e1, G = chain_spectrum(
+            -c_z[idx] * np.ones(N), -c_xx[idx] * np.ones(n_bonds), grid.ring
+        )
+        e_list.append([e0, e1]), G_list.append(G)
+
+    return np.array(e_list).reshape(-1, 2), np.array(G_list).reshape(-1, N, N)
+
+
+def fidelity(G_a: np.ndarray, G_b: np.ndarray) -> float:
+    """
+    Fidelity |<a|b>| of two Gaussian states of the same parity from their correlation matrices:
+            |<a|b>|^2 = |det((G_a + G_b) / 2)|
+
+    Parameters
+    ----------
+    G_a : np.ndarray
+        Correlation matrix of the first state
+    G_b : np.ndarray
+        Correlation matrix of the second state
+
+    Returns
+    -------
+    float
+        Fidelity of the states
+    """
+    return np.sqrt(np.abs(np.linalg.det((G_a + G_b) / 2)))
+
+
+def z_magnetization(G: np.ndarray) -> np.ndarray:
+    """
+    Magnetization <sigma^i_z> of each spin
+
+    Parameters
+    ----------
+    G : np.ndarray
+        Correlation matrix of the state
+
+    Returns
+    -------
+    np.ndarray
+        Array of the magnetizations
+    """
+    return -np.diag(G)
+
+
+def xx_correlation(G: np.ndarray, i: int, j: int) -> float:
+    """
+    Correlator <sigma^i_x*sigma^j_x> (i < j), by Wick's theorem:
+            sigma^i_x*sigma^j_x = b_i a_(i+1) b_(i+1) ... a_j  ->  det(G[i:j, i+1:j+1])
+
+    Parameters
+    ----------
+    G : np.ndarray
+        Correlation matrix of the state
+    i : int
+        First spin
+    j : int
+        Second spin
+
+    Returns
+    -------
+    float
+        Correlator of the spins
+    """
+    i, j = min(i, j), max(i, j)
+    if i == j:
+        return 1.0
+
+    return np.linalg.det(G[i:j, i + 1 : j + 1])
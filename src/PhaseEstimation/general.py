@@ -3,6 +3,10 @@ import pennylane as qml
 from pennylane import numpy as np
 import jax
 import jax.numpy as jnp
+import scipy.sparse as sparse
+import scipy.sparse.linalg as sparse_linalg
+
+from PhaseEstimation import cache
 
 from typing import List, Tuple, Union
 from numbers import Number
@@ -34,73 +38,279 @@ def linalgeigh(mat_H: List[List[Number]]) -> Tuple[int, List[Number]]:
 j_linalgeigh = jax.jit(linalgeigh)
 
 
+def is_complex(H: sparse.spmatrix) -> bool:
+    """
+    Check if a sparse matrix has any non-zero imaginary entry
+
+    Parameters
+    ----------
+    H : scipy.sparse.spmatrix
+        Sparse matrix
+
+    Returns
+    -------
+    bool
+        True if the matrix is not real
+    """
+    return np.iscomplexobj(H.data) and bool(np.any(H.imag.data != 0))
+
+
+def get_mat_H(
+    H: Union[qml.ops.qubit.hamiltonian.Hamiltonian, sparse.spmatrix]
+) -> List[List[Number]]:
+    """
+    Dense float32 (complex64 if not real) matrix of a Hamiltonian, either from a Pennylane Hamiltonian
+    or from a sparse matrix (see operators.operator_grid.sparse)
+
+    Parameters
+    ----------
+    H : pennylane.ops.qubit.hamiltonian.Hamiltonian or scipy.sparse.spmatrix
+        Hamiltonian of the state
+
+    Returns
+    -------
+    np.ndarray
+        Matricial encoding of the Hamiltonian
+    """
+    # This type of hamiltonians are always real, only their blocks
+    # in the momentum sectors (see symmetries) can be complex
+    if sparse.issparse(H):
+        if is_complex(H):
+            return H.toarray().astype(np.csingle)
+        return np.real(H.toarray()).astype(np.single)
+
+    return np.real(qml.matrix(H)).astype(np.single)
+
+
+def get_sparse_H(
+    H: Union[qml.ops.qubit.hamiltonian.Hamiltonian, sparse.spmatrix]
+) -> sparse.csr_matrix:
+    """
+    Sparse (CSR) matrix of a Hamiltonian, either from a Pennylane Hamiltonian
+    or from a sparse matrix (see operators.operator_grid.sparse)
+
+    Parameters
+    ----------
+    H : pennylane.ops.qubit.hamiltonian.Hamiltonian or scipy.sparse.spmatrix
+        Hamiltonian of the state
+
+    Returns
+    -------
+    scipy.sparse.csr_matrix
+        Sparse encoding of the Hamiltonian
+    """
+    # This type of hamiltonians are always real, only their blocks
+    # in the momentum sectors (see symmetries) can be complex
+    if sparse.issparse(H):
+        if is_complex(H):
+            return sparse.csr_matrix(H, dtype=np.complex128)
+        return sparse.csr_matrix(H.real, dtype=np.float64)
+
+    return sparse.csr_matrix(np.real(qml.matrix(H)), dtype=np.float64)
+
+
+# Matrices up to this dimension are diagonalized with the dense solver
+# when solver = 'auto'
+DENSE_MAX_DIM = 2 ** 10
+
+# Maximum number of LOBPCG iterations, Lanczos is used if they are not enough
+LOBPCG_MAX_ITER = 500
+
+
+def sparse_eigh(
+    H: Union[qml.ops.qubit.hamiltonian.Hamiltonian, sparse.spmatrix],
+    n_levels: int,
+    solver: str = "auto",
+) -> Tuple[List[Number], List[List[Number]]]:
+    """
+    Compute only the n_levels lowest eigenvalues (and eigenvectors) of a Hamiltonian
+
+    Parameters
+    ----------
+    H : pennylane.ops.qubit.hamiltonian.Hamiltonian or scipy.sparse.spmatrix
+        Hamiltonian of the state
+    n_levels : int
+        Number of (lowest) energy levels desired
+    solver : str
+        Eigensolver backend:
+        > 'dense'   : jitted jnp.linalg.eigh on the (float32) dense matrix;
+        > 'lanczos' : Lanczos iterations (ARPACK, scipy.sparse.linalg.eigsh) on the CSR matrix;
+        > 'lobpcg'  : LOBPCG iterations (scipy.sparse.linalg.lobpcg) on the CSR matrix, at most
+                      LOBPCG_MAX_ITER of them ('lanczos' if they do not converge);
+        > 'auto'    : 'dense' if the dimension is smaller than DENSE_MAX_DIM, 'lanczos' otherwise.
+
+    Returns
+    -------
+    np.ndarray
+        Array of the n_levels lowest eigenvalues (sorted)
+    np.ndarray
+        Array (dim, n_levels) of the relative eigenvectors
+    """
+    mat_H = get_sparse_H(H)
+    dim = mat_H.shape[0]
+
+    if solver == "auto":
+        solver = "dense" if dim <= DENSE_MAX_DIM else "lanczos"
+    # Iterative solvers need the number of levels to be (much) smaller than the dimension
+    if solver in ("lanczos", "lobpcg") and 5 * n_levels >= dim:
+        solver = "dense"
+
+    if solver == "dense":
+        eigvals, eigvecs = j_linalgeigh(get_mat_H(mat_H))
+        eigvals, eigvecs = np.asarray(eigvals), np.asarray(eigvecs)
+    elif solver == "lanczos":
+        # A couple of extra levels make Lanczos less prone to skip exactly degenerate
+        # levels (e.g. the ferromagnetic ground-states at h = 0)
+        k = min(n_levels + 2, dim - 2)
+        eigvals, eigvecs = sparse_linalg.eigsh(mat_H, k=k, which="SA")
+    elif solver == "lobpcg":
+        # Fixed seed for reproducible starting block
+        X = np.random.default_rng(0).standard_normal((dim, n_levels + 2))
+        eigvals, eigvecs = sparse_linalg.lobpcg(
+            mat_H, X, largest=False, tol=1e-8, maxiter=LOBPCG_MAX_ITER
+        )
+        # Residuals of the requested levels
+        order = np.argsort(eigvals)[:n_levels]
+        residuals = np.linalg.norm(mat_H @ eigvecs[:, order] - eigvecs[:, order] * eigvals[order], axis=0)
+        if np.any(residuals > 1e-6 * max(1, np.max(np.abs(eigvals)))):
+            return sparse_eigh(mat_H, n_levels, "lanczos")
+    else:
+        raise ValueError("Unknown solver: {0}".format(solver))
+
+    order = np.argsort(eigvals)[:n_levels]
+
+    return eigvals[order], eigvecs[:, order]
+
+
+def cached_eigh(
+    H: Union[qml.ops.qubit.hamiltonian.Hamiltonian, sparse.spmatrix],
+    n_levels: int,
+    solver: str = "auto",
+) -> Tuple[List[Number], List[List[Number]]]:
+    """
+    Same as sparse_eigh, but the spectrum is first looked up in the
+    on-disk cache (see cache.get_cache), keyed by the content of the matrix
+
+    Parameters
+    ----------
+    H : pennylane.ops.qubit.hamiltonian.Hamiltonian or scipy.sparse.spmatrix
+        Hamiltonian of the state
+    n_levels : int
+        Number of (lowest) energy levels desired
+    solver : str
+        Eigensolver backend, see sparse_eigh
+
+    Returns
+    -------
+    np.ndarray
+        Array of the n_levels lowest eigenvalues (sorted)
+    np.ndarray
+        Array (dim, n_levels) of the relative eigenvectors
+    """
+    mat_H = get_sparse_H(H)
+    spectra = cache.get_cache()
+    if spectra is None:
+        return sparse_eigh(mat_H, n_levels, solver)
+
+    key = cache.matrix_key(mat_H)
+    cached = spectra.get(key, n_levels)
+    if cached is not None:
+        return cached[0], np.asarray(cached[1])
+
+    eigvals, eigvecs = sparse_eigh(mat_H, n_levels, solver)
+    spectra.put(key, eigvals, eigvecs)
+
+    return eigvals, eigvecs
+
+
 def geteigvals(
-    qml_H: qml.ops.qubit.hamiltonian.Hamiltonian, states: List[int]
+    qml_H: qml.ops.qubit.hamiltonian.Hamiltonian, states: List[int], solver: str = "auto"
 ) -> List[Number]:
     """
     Function for getting the energy values of an Ising Hamiltonian
-    using the jitted jnp.linalg.eigh function
+    using the selected eigensolver and the spectra cache (see cached_eigh)
         
     Parameters
     ----------
-    qml_H : pennylane.ops.qubit.hamiltonian.Hamiltonian
-        Pennylane Hamiltonian of the state
+    qml_H : pennylane.ops.qubit.hamiltonian.Hamiltonian or scipy.sparse.spmatrix
+        Pennylane Hamiltonian of the state (or its sparse matrix)
     states : list
         List of energy levels desired
+    solver : str
+        Eigensolver backend, see sparse_eigh
 
     Returns
     -------
     list
         List of energy values
     """
+    # Compute sorted eigenvalues up to the highest level needed
+    eigvals = cached_eigh(qml_H, max(states) + 1, solver)[0]
 
-    # Get the matricial for of the hamiltonian
-    # and convert it to float32
-    # This type of hamiltonians are always real
-    mat_H = np.real(qml.matrix(qml_H)).astype(np.single)
+    return [eigvals[k] for k in states]
 
-    # Compute sorted eigenvalues with jitted function
-    eigvals = jnp.sort(j_linalgeigh(mat_H)[0])
 
-    return [eigvals[k] for k in states]
+def get_sparse_H_eigval_eigvec(
+    qml_H: qml.ops.qubit.hamiltonian.Hamiltonian, en_lvl: int, solver: str = "auto"
+) -> Tuple[sparse.csr_matrix, Number, List[Number]]:
+    """
+    Same as get_H_eigval_eigvec, but the Hamiltonian is returned as a sparse matrix
+    (the dense one is never built)
+        
+    Parameters
+    ----------
+    qml_H : pennylane.ops.qubit.hamiltonian.Hamiltonian or scipy.sparse.spmatrix
+        Pennylane Hamiltonian of the state (or its sparse matrix)
+    en_lvl : int
+        Energy level desired
+    solver : str
+        Eigensolver backend, see sparse_eigh
+
+    Returns
+    -------
+    scipy.sparse.csr_matrix
+        Sparse encoding of the Hamiltonian
+    float
+        Value of the energy level
+    np.ndarray
+        Eigenstate of the energy level
+    """
+    mat_H = get_sparse_H(qml_H)
+
+    # Compute only the sorted eigenvalues up to en_lvl
+    eigvals, eigvecs = cached_eigh(mat_H, en_lvl + 1, solver)
+
+    return mat_H, eigvals[en_lvl], eigvecs[:, en_lvl]
 
 
 def get_H_eigval_eigvec(
-    qml_H: qml.ops.qubit.hamiltonian.Hamiltonian, en_lvl: int
+    qml_H: qml.ops.qubit.hamiltonian.Hamiltonian, en_lvl: int, solver: str = "auto"
 ) -> Tuple[List[List[Number]], Number, List[Number]]:
     """
     Function for getting the energy value and state of an Ising Hamiltonian
-    using the jitted jnp.linalg.eigh function
+    using the selected eigensolver and the spectra cache (see cached_eigh)
         
     Parameters
     ----------
-    qml_H : pennylane.ops.qubit.hamiltonian.Hamiltonian
-        Pennylane Hamiltonian of the state
+    qml_H : pennylane.ops.qubit.hamiltonian.Hamiltonian or scipy.sparse.spmatrix
+        Pennylane Hamiltonian of the state (or its sparse matrix)
     en_lvl : int
         Energy level desired
+    solver : str
+        Eigensolver backend, see sparse_eigh
 
     Returns
     -------
     np.ndarray
-        Matricial encoding of the Hamiltonian
+        Matricial encoding of the Hamiltonian (dense float32, see get_mat_H)
     float
         Value of the energy level
     np.ndarray
         Eigenstate of the energy level
     """
+    mat_H, en, psi = get_sparse_H_eigval_eigvec(qml_H, en_lvl, solver)
 
-    # Get the matricial for of the hamiltonian
-    # and convert it to float32
-    # This type of hamiltonians are always real
-    mat_H = np.real(qml.matrix(qml_H)).astype(np.single)
-
-    # Compute sorted eigenvalues with jitted function
-    eigvals, eigvecs = j_linalgeigh(mat_H)
-
-    psi = eigvecs[:, jnp.argsort(eigvals)[en_lvl]]
-    en = jnp.sort(eigvals)[en_lvl]
-
-    return mat_H, en, psi
+    return get_mat_H(mat_H), en, psi
 
 
 def psi_outer(psi: List[Number]) -> List[List[Number]]:
@@ -112,7 +322,7 @@ jv_psi_outer = jax.jit(jax.vmap(psi_outer))
 
 
 def get_VQE_params(
-    qml_H: qml.ops.qubit.hamiltonian.Hamiltonian,
+    qml_H: qml.ops.qubit.hamiltonian.Hamiltonian, solver: str = "auto"
 ) -> Tuple[List[List[Number]], Number]:
     """
     Function for getting all the training parameter for the VQE
@@ -120,8 +330,10 @@ def get_VQE_params(
         
     Parameters
     ----------
-    qml_H : pennylane.ops.qubit.hamiltonian.Hamiltonian
-        Pennylane Hamiltonian of the state
+    qml_H : pennylane.ops.qubit.hamiltonian.Hamiltonian or scipy.sparse.spmatrix
+        Pennylane Hamiltonian of the state (or its sparse matrix)
+    solver : str
+        Eigensolver backend, see sparse_eigh
         
     Returns
     -------
@@ -130,22 +342,15 @@ def get_VQE_params(
     float
         Ground-state energy value
     """
+    mat_H = get_sparse_H(qml_H)
 
-    # Get the matricial for of the hamiltonian
-    # and convert it to float32
-    # This type of hamiltonians are always real
-    mat_H = np.real(qml.matrix(qml_H)).astype(np.single)
-
-    # Compute sorted eigenvalues with jitted function
-    eigvals = j_linalgeigh(mat_H)[0]
-
-    en0 = jnp.sort(eigvals)[0]
+    en0 = cached_eigh(mat_H, 1, solver)[0][0]
 
-    return jnp.array([mat_H]), en0
+    return jnp.array([get_mat_H(mat_H)]), en0
 
 
 def get_VQD_params(
-    qml_H: qml.ops.qubit.hamiltonian.Hamiltonian, beta: Number
+    qml_H: qml.ops.qubit.hamiltonian.Hamiltonian, beta: Number, solver: str = "auto"
 ) -> Tuple[List[List[Number]], List[List[Number]], Number]:
     """
     Function for getting all the training parameter for the VQD
@@ -153,8 +358,12 @@ def get_VQD_params(
         
     Parameters
     ----------
-    qml_H : pennylane.ops.qubit.hamiltonian.Hamiltonian
-        Pennylane Hamiltonian of the Ising Model
+    qml_H : pennylane.ops.qubit.hamiltonian.Hamiltonian or scipy.sparse.spmatrix
+        Pennylane Hamiltonian of the Ising Model (or its sparse matrix)
+    beta : float
+        Penalty of the overlap with the ground-state
+    solver : str
+        Eigensolver backend, see sparse_eigh
         
     Returns
     -------
@@ -165,17 +374,15 @@ def get_VQD_params(
     float
         Excited-state energy value
     """
+    mat_H = get_sparse_H(qml_H)
 
-    # Get the matricial for of the hamiltonian
-    # and convert it to float32
-    # This type of hamiltonians are always real
-    mat_H = np.real(qml.matrix(qml_H)).astype(np.single)
+    # Only the ground-state and the first excited level are needed
+    eigvals, eigvecs = cached_eigh(mat_H, 2, solver)
 
-    # Compute sorted eigenvalues with jitted function
-    eigvals, eigvecs = j_linalgeigh(mat_H)
+    psi0 = eigvecs[:, 0]
+    en_ex = eigvals[1]
 
-    psi0 = eigvecs[:, jnp.argsort(eigvals)[0]]
-    en_ex = jnp.sort(eigvals)[1]
+    mat_H = get_mat_H(mat_H)
 
     return jnp.array([mat_H]), jnp.array([mat_H + beta * j_psi_outer(psi0)]), en_ex
 
@@ -1,12 +1,19 @@
 """ This module implements the base class for spin-models Hamiltonians"""
 
 from PhaseEstimation import general as qmlgen, visualization as qplt, annni_model as annni
+from PhaseEstimation import symmetries, cache, free_fermions, dmrg
 import warnings 
 from tqdm.auto import tqdm
 from typing import Callable
 import numpy as np
+import jax
+import jax.numpy as jnp
+import joblib
 ##############
 
+# Largest chain whose wavefunctions are computed by default in add_true
+STATES_MAX_N = 16
+
 
 class hamiltonian:
     N: int
@@ -42,24 +49,90 @@ class hamiltonian:
 
         self.n_states = len(self.qml_Hs)
 
-    def add_true(self):
+    def add_true(
+        self,
+        solver: str = "auto",
+        parity: bool = True,
+        momentum: bool = False,
+        n_jobs: int = -1,
+        states: bool = None,
+    ):
         """
-        Add true ground-state energy levels and true wavefunctions by diagonalizing the Hamiltonian matrices
+        Add true ground-state and first excited energy levels and true wavefunctions by diagonalizing the Hamiltonian matrices.
+        Both levels are extracted in a single pass over the grid (see diagonalize).
+        The energies of the free-fermionic points (Ising chain, kappa = 0 line of the ANNNI model)
+        are given by their exact solution (see free_fermions), together with the correlation
+        matrices of their ground states (true_G0, for the points free_indexes)
+
+        Parameters
+        ----------
+        solver : str
+            Eigensolver backend ('auto', 'dense', 'lanczos', 'lobpcg'), see general.sparse_eigh
+        parity : bool
+            if True each parity sector of the Hamiltonians is diagonalized separately
+        momentum : bool
+            (IF ring) if True each momentum and parity sector is diagonalized separately
+        n_jobs : int
+            Number of worker processes for the sparse solvers (-1: all the cores)
+        states : bool
+            if True the wavefunctions are computed, if False only the energies are: the free-fermionic
+            points take the exact solution and only the energies of the other points are computed
+            (see the states argument of diagonalize). By default they are skipped for N > STATES_MAX_N
         """
         
         # Checks wether this has already been computed
         try:
-            _,_, = self.true_e0, self.true_psi0
+            _,_,_,_, = self.true_e0, self.true_psi0, self.true_e1, self.true_psi1
         except:
-            warnings.warn("True Wavefunction and Groundstate energy levels not found, they will be not computed (this may take a while...)")
-            self.true_e0, self.true_psi0 = get_e_psi(self, 0)
+            grid = self.qml_Hs
+            free = free_fermions.is_free(grid)
+            if states is None:
+                states = grid.N <= STATES_MAX_N
 
-        # Checks wether this has already been computed
-        try:
-            _,_, = self.true_e1, self.true_psi1
-        except:
-            warnings.warn("True Wavefunction and First excited energy levels not found, they will be not computed (this may take a while...)")
-            self.true_e1, self.true_psi1 = get_e_psi(self, 1)
+            if states:
+                # The exact solution gives no wavefunctions: the free-fermionic points are diagonalized as well
+                warnings.warn("True Wavefunctions and energy levels not found, they will be now computed (this may take a while...)")
+                e, psi = diagonalize(self, 2, solver, parity, momentum, n_jobs)
+                self.true_psi0, self.true_psi1 = psi[:, :, 0], psi[:, :, 1]
+            else:
+                e = np.zeros((len(grid), 2))
+                self.true_psi0, self.true_psi1 = None, None
+                if not np.all(free):
+                    warnings.warn("True energy levels not found, they will be now computed (this may take a while...)")
+                    e[~free] = diagonalize(
+                        self, 2, solver, parity, momentum, n_jobs, indexes=np.arange(len(grid))[~free], states=False
+                    )[0]
+
+            # Exact energies of the free-fermionic points
+            self.free_indexes = np.arange(len(grid))[free]
+            e[free], self.true_G0 = free_fermions.grid_spectrum(grid, self.free_indexes)
+
+            self.true_e0, self.true_e1 = e[:, 0], e[:, 1]
+
+    def add_dmrg(self, chi_max: int = 32, n_sweeps: int = 10, tol: float = 1e-8, states: bool = False):
+        """
+        Add true ground-state energy levels of large (open) chains through DMRG (see dmrg.grid_dmrg),
+        the points are solved along the recycle rule. Free-fermionic points take the exact energy
+
+        Parameters
+        ----------
+        chi_max : int
+            Maximum bond dimension of the MPS
+        n_sweeps : int
+            Maximum number of sweeps for each point
+        tol : float
+            Tolerance on the energy
+        states : bool
+            if True the MPS of the ground states are stored as well (true_mps0)
+        """
+        grid = self.qml_Hs
+        self.true_e0, mps_list = dmrg.grid_dmrg(grid, self.recycle_rule, chi_max, n_sweeps, tol, states)
+        if states:
+            self.true_mps0 = mps_list
+
+        free = free_fermions.is_free(grid)
+        if np.any(free):
+            self.true_e0[free] = free_fermions.grid_spectrum(grid, np.arange(len(grid))[free])[0][:, 0]
 
     def show_massgap(self, **kwargs):
         """
@@ -91,7 +164,236 @@ class hamiltonian:
         else:
             raise Exception("Function not supported for this kind of Hamiltonian")
 
-def get_e_psi(Hclass, en_lvl):
+def _diagonalize_points(grid, indexes, n_levels, solver, parity, momentum, states = True):
+    """
+    Worker of diagonalize: lowest n_levels of a subset of points of the grid
+    (the states are None if not states)
+    """
+    if momentum:
+        # Sector eigenvectors are embedded in the full basis only if the states are needed
+        e, psi, _ = symmetries.momentum_grid_eigh(grid, n_levels, solver, full_basis=states, indexes=indexes)
+
+        return e, psi
+
+    e_list   = []
+    psi_list = []
+    for idx in indexes:
+        if parity:
+            e, psi, _ = symmetries.parity_eigh(grid, idx, n_levels, solver)
+        else:
+            e, psi = qmlgen.sparse_eigh(grid.sparse(idx), n_levels, solver)
+        e_list.append(e), psi_list.append(psi)
+
+    return np.array(e_list), (np.array(psi_list) if states else None)
+
+
+def point_eigh(grid, idx, n_levels, solver = "auto", parity = True):
+    """
+    Lowest n_levels energies and states of a single point of the grid, looked up in the
+    spectra cache under the same key of diagonalize (see cache.grid_key)
+
+    Parameters
+    ----------
+    grid : operators.operator_grid
+        Grid of the Hamiltonians
+    idx : int
+        Index of the point of the grid
+    n_levels : int
+        Number of (lowest) energy levels desired
+    solver : str
+        Eigensolver backend ('auto', 'dense', 'lanczos', 'lobpcg'), see general.sparse_eigh
+    parity : bool
+        if True the two blocks of the global parity are diagonalized separately, see symmetries.parity_eigh
+
+    Returns
+    -------
+    np.ndarray
+        Array of the n_levels lowest eigenvalues
+    np.ndarray
+        Array (2^N, n_levels) of the eigenvectors
+    """
+    spectra = cache.get_cache()
+    if spectra is not None:
+        key = cache.grid_key(grid, idx)
+        cached = spectra.get(key, n_levels)
+        if cached is not None:
+            return cached[0], np.asarray(cached[1])
+
+    e, psi = _diagonalize_points(grid, [idx], n_levels, solver, parity, False)
+    if spectra is not None:
+        spectra.put(key, e[0], psi[0])
+
+    return e[0], psi[0]
+
+
+def _linalgeigh_batch(mat_Hs):
+    return jax.vmap(qmlgen.linalgeigh)(mat_Hs)
+
+
+j_linalgeigh_batch = jax.jit(_linalgeigh_batch)
+
+
+def _diagonalize_dense(grid, indexes, n_levels, max_memory, parity=True, states=True):
+    """
+    Lowest n_levels of a subset of points of the grid through a jitted vmap of eigh,
+    the dense matrices are built in chunks of at most max_memory bytes.
+    If parity, the two parity blocks (see symmetries.parity_sectors) are diagonalized
+    separately and their levels are merged. The states are None if not states
+    """
+    dim = 2 ** grid.N
+    coefficients = jnp.array(grid.coefficients[indexes], dtype=np.single)
+
+    # Blocks: (basis states of the block, operator basis restricted to the block)
+    if parity:
+        blocks = [
+            (block_states, symmetries.get_parity_basis(grid.N, grid.distances, grid.ring, sector))
+            for sector, block_states in enumerate(symmetries.parity_sectors(grid.N))
+        ]
+    else:
+        blocks = [(np.arange(dim), grid.basis)]
+
+    e_blocks, psi_blocks = [], []
+    for block_states, block_basis in blocks:
+        size = len(block_states)
+        k = min(n_levels, size)
+        # Dense float32 operators, every Hamiltonian is c @ basis
+        basis = jnp.array(np.array([op.toarray() for op in block_basis], dtype=np.single))
+        # Memory of the matrices, eigenvectors and workspace of each point
+        chunk = max(1, int(max_memory // (3 * 4 * size * size)))
+
+        e_list, psi_list = [], []
+        for start in tqdm(range(0, len(indexes), chunk)):
+            mat_Hs = jnp.einsum("pt,tij->pij", coefficients[start : start + chunk], basis)
+            eigvals, eigvecs = j_linalgeigh_batch(mat_Hs)
+
+            order = jnp.argsort(eigvals, axis=1)[:, :k]
+            e_list.append(np.asarray(jnp.take_along_axis(eigvals, order, axis=1)))
+            if states:
+                psi_list.append(np.asarray(jnp.take_along_axis(eigvecs, order[:, None, :], axis=2)))
+
+        e_blocks.append(np.concatenate(e_list))
+        if states:
+            # Embed the eigenvectors of the block back into the full basis
+            block_psi = np.concatenate(psi_list)
+            psi = np.zeros((len(indexes), dim, k), dtype=block_psi.dtype)
+            psi[:, block_states, :] = block_psi
+            psi_blocks.append(psi)
+
+    # Merge the levels of the blocks
+    e = np.concatenate(e_blocks, axis=1)
+    order = np.argsort(e, axis=1, kind="stable")[:, :n_levels]
+    if not states:
+        return np.take_along_axis(e, order, axis=1), None
+
+    psi = np.concatenate(psi_blocks, axis=2)
+
+    return np.take_along_axis(e, order, axis=1), np.take_along_axis(psi, order[:, None, :], axis=2)
+
+
+def diagonalize(
+    Hclass,
+    n_levels,
+    solver = "auto",
+    parity = True,
+    momentum = False,
+    n_jobs = -1,
+    max_memory = 2 ** 30,
+    indexes = None,
+    states = True,
+):
+    """
+    Grid diagonalization engine: compute the lowest n_levels energies and states of every
+    Hamiltonian of the grid (or of the points indexes) in a single pass. Points already in the spectra cache
+    (see cache.get_cache) are not diagonalized again, new ones are stored in it (only if states).
+    > Small matrices (solver = 'dense', or 'auto' and 2^N <= general.DENSE_MAX_DIM) are built
+      in chunks bounded by max_memory and diagonalized by a jitted vmap of jnp.linalg.eigh
+      (one for each parity block if parity);
+    > Larger ones, and the momentum blocks whatever the solver, are split in chunks of points
+      which are diagonalized by the selected solver over a pool of n_jobs worker processes (joblib).
+
+    Parameters
+    ----------
+    Hclass : hamiltonians.hamiltonian
+        Custom hamiltonian class
+    n_levels : int
+        Number of (lowest) energy levels desired
+    solver : str
+        Eigensolver backend ('auto', 'dense', 'lanczos', 'lobpcg'), see general.sparse_eigh
+    parity : bool
+        if True the two blocks of the global parity are diagonalized separately, see symmetries.parity_eigh
+    momentum : bool
+        (IF ring) if True the 2N blocks of translation momentum and parity are diagonalized separately,
+        see symmetries.momentum_grid_eigh
+    n_jobs : int
+        Number of worker processes (-1: all the cores, 1: no pool)
+    max_memory : int
+        Maximum number of bytes of the dense matrices built at once
+    indexes : List[int]
+        Points of the grid to diagonalize (all of them if None)
+    states : bool
+        if False only the energies are computed: the eigenvectors of the symmetry blocks
+        are not embedded in the full 2^N basis and None is returned in place of the states
+
+    Returns
+    -------
+    np.ndarray
+        Array (n_points, n_levels) of the energies
+    np.ndarray
+        Array (n_points, 2^N, n_levels) of the state vectors (None if not states)
+    """
+    grid = Hclass.qml_Hs
+    dim = 2 ** grid.N
+    points = np.arange(len(grid)) if indexes is None else np.asarray(indexes, dtype=int)
+
+    # Look up the points already in the spectra cache
+    spectra = cache.get_cache()
+    keys = [cache.grid_key(grid, idx) for idx in points] if spectra is not None else []
+    cached = [spectra.get(key, n_levels) for key in keys] if spectra is not None else [None] * len(points)
+    missing = np.array([pos for pos, entry in enumerate(cached) if entry is None], dtype=int)
+
+    if len(missing) == 0:
+        e_missing, psi_missing = np.zeros((0, n_levels)), np.zeros((0, dim, n_levels))
+    elif not momentum and (solver == "dense" or (solver == "auto" and dim <= qmlgen.DENSE_MAX_DIM)):
+        e_missing, psi_missing = _diagonalize_dense(grid, points[missing], n_levels, max_memory, parity, states)
+    else:
+        # Split the points in a few chunks per worker, each worker process keeps the
+        # operator basis in cache between its chunks
+        n_workers = joblib.cpu_count() if n_jobs < 0 else max(1, n_jobs)
+        chunks = np.array_split(points[missing], min(len(missing), 4 * n_workers))
+
+        results = joblib.Parallel(n_jobs=n_jobs)(
+            joblib.delayed(_diagonalize_points)(grid, indexes, n_levels, solver, parity, momentum, states)
+            for indexes in tqdm(chunks)
+        )
+        e_missing = np.concatenate([e for e, _ in results])
+        psi_missing = np.concatenate([psi for _, psi in results]) if states else None
+
+    if not states:
+        # Energies only: the cache stores the states too, hence new points are not stored
+        e_list = np.zeros((len(points), n_levels))
+        for pos, entry in enumerate(cached):
+            if entry is not None:
+                e_list[pos] = entry[0]
+        e_list[missing] = e_missing
+
+        return e_list, None
+
+    # Merge computed and cached points
+    dtype = np.result_type(psi_missing, *[entry[1] for entry in cached if entry is not None])
+    e_list = np.zeros((len(points), n_levels))
+    psi_list = np.zeros((len(points), dim, n_levels), dtype=dtype)
+    for pos, entry in enumerate(cached):
+        if entry is not None:
+            e_list[pos], psi_list[pos] = entry
+    for pos, e, psi in zip(missing, e_missing, psi_missing):
+        e_list[pos], psi_list[pos] = e, psi
+        if spectra is not None:
+            spectra.put(keys[pos], e, psi)
+
+    return e_list, psi_list
+
+
+def get_e_psi(Hclass, en_lvl, solver = "auto", parity = True, momentum = False, n_jobs = -1):
     """
     Return respectively the list of the true energies and true states obtained through the diagonalization of the hamiltonian matrices
 
@@ -101,6 +403,16 @@ def get_e_psi(Hclass, en_lvl):
         Custom hamiltonian class
     en_lvl : int
         Energy level to inspect
+    solver : str
+        Eigensolver backend ('auto', 'dense', 'lanczos', 'lobpcg'), see general.sparse_eigh
+    parity : bool
+        if True the two blocks of the global parity Π sigma^i_z (which commutes with the
+        Hamiltonians) are built and diagonalized separately, see symmetries.parity_eigh
+    momentum : bool
+        (IF ring) if True the Hamiltonians are split in the 2N blocks of translation momentum
+        and parity, see symmetries.momentum_grid_eigh
+    n_jobs : int
+        Number of worker processes (-1: all the cores, 1: no pool)
 
     Returns
     -------
@@ -109,10 +421,6 @@ def get_e_psi(Hclass, en_lvl):
     List[List[Number]]
         Array of the state vectors
     """
-    e_list   = []
-    psi_list = []
-    for H in tqdm(Hclass.qml_Hs):
-        _, e, psi = qmlgen.get_H_eigval_eigvec(H, en_lvl)
-        e_list.append(e), psi_list.append(psi)
+    e, psi = diagonalize(Hclass, en_lvl + 1, solver, parity, momentum, n_jobs)
 
-    return np.array(e_list), np.array(psi_list)
+    return e[:, en_lvl], psi[:, :, en_lvl]
@@ -2,6 +2,8 @@
 import pennylane as qml
 from pennylane import numpy as np
 
+from PhaseEstimation import operators
+
 from typing import List, Tuple
 from numbers import Number
 
@@ -72,8 +74,8 @@ def build_Hs(
         
     Returns
     -------
-    np.array
-        Array of pennylane Hamiltonians
+    operators.operator_grid
+        Grid of the Hamiltonians (pennylane Hamiltonians are built on access)
     np.array
         Array of labels for analytical solutions
     np.array
@@ -86,17 +88,27 @@ def build_Hs(
     # Array of free parameters (magnetic field)
     lams = np.linspace(0, 2 * J, n_states)
 
-    Hs = []  # Array of pennylane hamiltonians
     labels = []  # Array of labels:
     #  > 0 if magnetic field <= J
     #  > 1 if magnetic field >  J
     ising_params = []  # Array of parameters [N,J,magneticfield]
 
     for lam in lams:
-        Hs.append(get_H(int(N), float(lam), float(J), ring))
         labels.append(0) if lam <= J else labels.append(1)
         ising_params.append([N, J, lam])
 
+    # Every Hamiltonian is a linear combination of the same operators:
+    #     H = -lam * Σsigma^i_z - J * Σsigma^i_x*sigma_x^{i+1}
+    # the Pennylane Hamiltonians will be built only when accessed
+    Hs = operators.operator_grid(
+        N,
+        ring,
+        distances=(1,),
+        coefficients=np.stack((-lams, -J * np.ones(n_states)), axis=1),
+        qml_func=get_H,
+        qml_params=np.stack((lams, J * np.ones(n_states)), axis=1),
+    )
+
     # Array of indices for the order of states to train through VQE
     recycle_rule = np.arange(n_states)
 
@@ -47,7 +47,7 @@ def hinge(X, Y, params, q_circuit):
     Parameters
     ----------
     X : np.ndarray
-        Array of VQE parameters (input of VQE)
+        Array of VQE states (input of the QCNN, see vqe.state_bank)
     Y : np.ndarray
         Array of labels
     params : np.ndarray
@@ -77,7 +77,7 @@ def cross_entropy1D(X, Y, params, q_circuit):
     Parameters
     ----------
     X : np.ndarray
-        Array of VQE parameters (input of VQE)
+        Array of VQE states (input of the QCNN, see vqe.state_bank)
     Y : np.ndarray
         Array of labels
     params : np.ndarray
@@ -108,7 +108,7 @@ def cross_entropy(X, Y, params, q_circuit):
     Parameters
     ----------
     X : np.ndarray
-        Array of VQE parameters (input of VQE)
+        Array of VQE states (input of the QCNN, see vqe.state_bank)
     Y : np.ndarray
         Array of labels
     params : np.ndarray
@@ -141,7 +141,7 @@ def cross_entropy_power4(X, Y, params, q_circuit):
     Parameters
     ----------
     X : np.ndarray
-        Array of VQE parameters (input of VQE)
+        Array of VQE states (input of the QCNN, see vqe.state_bank)
     Y : np.ndarray
         Array of labels
     params : np.ndarray
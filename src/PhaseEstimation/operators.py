@@ -0,0 +1,502 @@
+""" This module implements the shared sparse operator basis of the spin-chain Hamiltonians """
+import numpy as np
+import scipy.sparse as sparse
+import jax.numpy as jnp
+import functools
+import pennylane as qml
+from collections import OrderedDict
+
+from typing import Callable, List, Tuple
+from numbers import Number
+
+##############
+
+
+def bit_masks(N: int) -> np.ndarray:
+    """
+    Integer masks of the single spins in the computational basis.
+    Pennylane orders the wires from the most significant bit, hence
+    spin i corresponds to the bit 2^(N - 1 - i)
+
+    Parameters
+    ----------
+    N : int
+        Number of spins of the chain
+
+    Returns
+    -------
+    np.ndarray
+        Array of the masks of each spin
+    """
+    return np.left_shift(1, N - 1 - np.arange(N)).astype(np.int64)
+
+
+def xx_pairs(N: int, distance: int, ring: bool = False) -> List[Tuple[int, int]]:
+    """
+    Pairs of spins (i, j) coupled by a sigma^i_x*sigma^j_x interaction at a given distance
+
+    Parameters
+    ----------
+    N : int
+        Number of spins of the chain
+    distance : int
+        Distance between the coupled spins (1: neighbouring, 2: next-neighbouring)
+    ring : bool
+        If False, system has open-boundaries condition
+
+    Returns
+    -------
+    List[Tuple[int, int]]
+        List of the coupled spins
+    """
+    pairs = [(i, i + distance) for i in range(0, N - distance)]
+    # If ring == True, the 'chain' needs to be closed
+    if ring:
+        pairs += [(i, (i + distance) % N) for i in range(max(N - distance, 0), N)]
+
+    return pairs
+
+
+@functools.lru_cache(maxsize=None)
+def xx_masks(N: int, distance: int, ring: bool = False) -> np.ndarray:
+    """
+    Bit-flip masks of the sigma_x*sigma_x interactions: X_i X_j maps the basis state b
+    to b ^ mask
+
+    Parameters
+    ----------
+    N : int
+        Number of spins of the chain
+    distance : int
+        Distance between the coupled spins
+    ring : bool
+        If False, system has open-boundaries condition
+
+    Returns
+    -------
+    np.ndarray
+        Array of the bit-flip masks, one for each pair
+    """
+    masks = bit_masks(N)
+    pairs = xx_pairs(N, distance, ring)
+
+    return np.array([masks[i] ^ masks[j] for i, j in pairs], dtype=np.int64)
+
+
+@functools.lru_cache(maxsize=None)
+def z_diagonal(N: int) -> np.ndarray:
+    """
+    Diagonal of the field operator Σsigma^i_z in the computational basis
+
+    Parameters
+    ----------
+    N : int
+        Number of spins of the chain
+
+    Returns
+    -------
+    np.ndarray
+        Diagonal of the operator (length 2^N)
+    """
+    states = np.arange(2 ** N, dtype=np.int64)
+    n_ones = np.zeros(2 ** N, dtype=np.int64)
+    for mask in bit_masks(N):
+        n_ones += (states & mask) != 0
+
+    # Each spin up contributes +1, each spin down -1
+    return (N - 2 * n_ones).astype(np.float64)
+
+
+def xx_matrix(N: int, distance: int, ring: bool = False) -> sparse.csr_matrix:
+    """
+    Sparse matrix of the operator Σsigma^i_x*sigma^(i+distance)_x
+
+    Parameters
+    ----------
+    N : int
+        Number of spins of the chain
+    distance : int
+        Distance between the coupled spins
+    ring : bool
+        If False, system has open-boundaries condition
+
+    Returns
+    -------
+    scipy.sparse.csr_matrix
+        Sparse matrix of the operator
+    """
+    dim = 2 ** N
+    states = np.arange(dim, dtype=np.int64)
+    masks = xx_masks(N, distance, ring)
+
+    # No pair at this distance (e.g. next-neighbouring interaction for N = 2)
+    if len(masks) == 0:
+        return sparse.csr_matrix((dim, dim), dtype=np.float64)
+
+    rows = np.tile(states, len(masks))
+    cols = np.concatenate([states ^ mask for mask in masks])
+
+    # Duplicated entries (a mask equal to 0 for self-pairs) are summed by scipy
+    return sparse.csr_matrix(
+        (np.ones(len(rows), dtype=np.float64), (rows, cols)), shape=(dim, dim)
+    )
+
+
+@functools.lru_cache(maxsize=8)
+def get_basis(N: int, distances: Tuple[int, ...], ring: bool = False) -> List[sparse.csr_matrix]:
+    """
+    Shared operator basis of the spin-chain Hamiltonians:
+            [ Σsigma^i_z, Σsigma^i_x*sigma^(i+d)_x for d in distances ]
+    The basis is built once for each (N, distances, ring) and kept in memory
+
+    Parameters
+    ----------
+    N : int
+        Number of spins of the chain
+    distances : Tuple[int]
+        Distances of the sigma_x*sigma_x interactions
+    ring : bool
+        If False, system has open-boundaries condition
+
+    Returns
+    -------
+    List[scipy.sparse.csr_matrix]
+        List of the sparse operators
+    """
+    basis = [sparse.diags(z_diagonal(N), format="csr")]
+    for distance in distances:
+        basis.append(xx_matrix(N, distance, ring))
+
+    return basis
+
+
+@functools.lru_cache(maxsize=None)
+def get_expval_fn(N: int, distances: Tuple[int, ...], ring: bool = False) -> Callable:
+    """
+    Matrix-free expectation values of the operator basis (see get_basis) on a statevector:
+            [ <psi|Σsigma^i_z|psi>, <psi|Σsigma^i_x*sigma^(i+d)_x|psi> for d in distances ]
+    The field is a precomputed diagonal and each sigma^i_x*sigma^j_x is a flip of the
+    statevector (reshaped as a (2,)*N tensor) along the axes i and j, hence the cost is
+    O(N 2^N) and no Hamiltonian matrix is ever built.
+    The energy of a Hamiltonian of an operator_grid is expval_fn(psi) @ coefficients[idx]
+
+    Parameters
+    ----------
+    N : int
+        Number of spins of the chain
+    distances : Tuple[int]
+        Distances of the sigma_x*sigma_x interactions
+    ring : bool
+        If False, system has open-boundaries condition
+
+    Returns
+    -------
+    function
+        Function psi -> array of the expectation values (JAX-differentiable)
+    """
+    diagonal = jnp.array(z_diagonal(N))
+    pairs = [xx_pairs(N, distance, ring) for distance in distances]
+
+    def expval_fn(psi):
+        psi_tensor = jnp.reshape(psi, (2,) * N)
+        probs = jnp.real(jnp.conj(psi) * psi)
+
+        expvals = [jnp.sum(probs * diagonal)]
+        for distance_pairs in pairs:
+            expval = jnp.zeros((), dtype=probs.dtype)
+            for i, j in distance_pairs:
+                # X_i X_i is the identity
+                flipped = jnp.flip(psi_tensor, axis=(i, j)) if i != j else psi_tensor
+                expval = expval + jnp.real(jnp.vdot(psi_tensor, flipped))
+            expvals.append(expval)
+
+        return jnp.stack(expvals)
+
+    return expval_fn
+
+
+@functools.lru_cache(maxsize=None)
+def get_apply_fn(N: int, distances: Tuple[int, ...], ring: bool = False) -> Callable:
+    """
+    Matrix-free action of a Hamiltonian on a statevector:
+            H|psi> = c_0 * Σsigma^i_z|psi> + Σ_d c_d * Σsigma^i_x*sigma^(i+d)_x|psi>
+    with the same diagonal and flips of get_expval_fn, in O(N 2^N)
+
+    Parameters
+    ----------
+    N : int
+        Number of spins of the chain
+    distances : Tuple[int]
+        Distances of the sigma_x*sigma_x interactions
+    ring : bool
+        If False, system has open-boundaries condition
+
+    Returns
+    -------
+    function
+        Function (psi, coefficients) -> H|psi> (JAX-differentiable)
+    """
+    diagonal = jnp.array(z_diagonal(N))
+    pairs = [xx_pairs(N, distance, ring) for distance in distances]
+
+    def apply_fn(psi, coefficients):
+        psi_tensor = jnp.reshape(psi, (2,) * N)
+
+        H_psi = coefficients[0] * jnp.reshape(diagonal, (2,) * N) * psi_tensor
+        for coeff, distance_pairs in zip(coefficients[1:], pairs):
+            for i, j in distance_pairs:
+                flipped = jnp.flip(psi_tensor, axis=(i, j)) if i != j else psi_tensor
+                H_psi = H_psi + coeff * flipped
+
+        return jnp.reshape(H_psi, jnp.shape(psi))
+
+    return apply_fn
+
+
+class operator_grid:
+    def __init__(
+        self,
+        N: int,
+        ring: bool,
+        distances: Tuple[int, ...],
+        coefficients: List[List[Number]],
+        qml_func: Callable,
+        qml_params: List[List[Number]],
+        cache_size: int = 16,
+    ):
+        """
+        Grid of spin-chain Hamiltonians, each one written as a linear combination
+        of the shared operator basis (see get_basis):
+                H = c_0 * Σsigma^i_z + Σ_d c_d * Σsigma^i_x*sigma^(i+d)_x
+        Only the model parameters are stored: Pennylane Hamiltonians and sparse matrices
+        are built when a point is accessed and the last cache_size of them are kept
+        in a LRU cache (which is not pickled)
+
+        Parameters
+        ----------
+        N : int
+            Number of spins of the chain
+        ring : bool
+            If False, system has open-boundaries condition
+        distances : Tuple[int]
+            Distances of the sigma_x*sigma_x interactions
+        coefficients : np.ndarray
+            Array (n_states, 1 + len(distances)) of the coefficients of each Hamiltonian
+        qml_func : function
+            Function building the Pennylane Hamiltonian: qml_func(N, *qml_params[idx], ring)
+        qml_params : np.ndarray
+            Arguments of qml_func for each Hamiltonian
+        cache_size : int
+            Maximum number of operators kept in memory
+        """
+        self.N = int(N)
+        self.ring = bool(ring)
+        self.distances = tuple(int(d) for d in distances)
+        self.coefficients = np.asarray(coefficients, dtype=np.float64)
+        self.qml_func = qml_func
+        self.qml_params = np.asarray(qml_params, dtype=np.float64)
+        self.cache_size = cache_size
+        self._lru: OrderedDict = OrderedDict()
+
+    def __getstate__(self):
+        # Built operators are not saved
+        state = self.__dict__.copy()
+        state["_lru"] = OrderedDict()
+
+        return state
+
+    def __setstate__(self, state):
+        state.setdefault("cache_size", 16)
+        state.setdefault("_lru", OrderedDict())
+        self.__dict__.update(state)
+
+    def _cached(self, kind: str, idx: int, build: Callable):
+        """
+        Return the operator (kind, idx) from the LRU cache, building it if missing
+        """
+        key = (kind, int(idx))
+        if key in self._lru:
+            self._lru.move_to_end(key)
+            return self._lru[key]
+
+        op = build()
+        if self.cache_size > 0:
+            self._lru[key] = op
+            while len(self._lru) > self.cache_size:
+                self._lru.popitem(last=False)
+
+        return op
+
+    def __len__(self) -> int:
+        return len(self.coefficients)
+
+    def __getitem__(self, idx):
+        """
+        Pennylane Hamiltonian of the idx-th point of the grid
+        """
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+
+        return self._cached(
+            "qml",
+            idx,
+            lambda: self.qml_func(self.N, *[float(p) for p in self.qml_params[idx]], self.ring),
+        )
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self[idx]
+
+    @property
+    def basis(self) -> List[sparse.csr_matrix]:
+        """
+        Shared sparse operators of the grid
+        """
+        return get_basis(self.N, self.distances, self.ring)
+
+    def sparse(self, idx: int) -> sparse.csr_matrix:
+        """
+        Sparse matrix of the idx-th Hamiltonian of the grid
+
+        Parameters
+        ----------
+        idx : int
+            Index of the point of the grid
+
+        Returns
+        -------
+        scipy.sparse.csr_matrix
+            Sparse matrix of the Hamiltonian
+        """
+        def build():
+            H = self.coefficients[idx, 0] * self.basis[0]
+            for coeff, op in zip(self.coefficients[idx, 1:], self.basis[1:]):
+                H = H + coeff * op
+
+            return H.tocsr()
+
+        return self._cached("sparse", idx, build)
+
+    @property
+    def expval_fn(self) -> Callable:
+        """
+        Matrix-free expectation values of the operator basis, see get_expval_fn
+        """
+        return get_expval_fn(self.N, self.distances, self.ring)
+
+    @property
+    def apply_fn(self) -> Callable:
+        """
+        Matrix-free action of the Hamiltonians on a statevector, see get_apply_fn
+        """
+        return get_apply_fn(self.N, self.distances, self.ring)
+
+    def dense(self, idx: int) -> np.ndarray:
+        """
+        Dense matrix of the idx-th Hamiltonian of the grid
+
+        Parameters
+        ----------
+        idx : int
+            Index of the point of the grid
+
+        Returns
+        -------
+        np.ndarray
+            Matrix of the Hamiltonian
+        """
+        return self.sparse(idx).toarray()
+
+
+def basis_hamiltonian(distances: Tuple[int, ...], N: int, *params) -> qml.Hamiltonian:
+    """
+    Pennylane Hamiltonian of a linear combination of the operator basis (see get_basis),
+    qml_func of the grids of legacy Hamiltonians (see grid_from_hamiltonians)
+
+    Parameters
+    ----------
+    distances : Tuple[int]
+        Distances of the sigma_x*sigma_x interactions
+    N : int
+        Number of spins of the chain
+    *params : arguments
+        Coefficients of the basis followed by ring (if False, system has open-boundaries condition)
+
+    Returns
+    -------
+    pennylane.ops.qubit.hamiltonian.Hamiltonian
+        Hamiltonian Pennylane class
+    """
+    *coefficients, ring = params
+
+    coeffs, ops = [], []
+    for i in range(N):
+        coeffs.append(coefficients[0]), ops.append(qml.PauliZ(i))
+    for coeff, distance in zip(coefficients[1:], distances):
+        for i, j in xx_pairs(N, distance, ring):
+            coeffs.append(coeff), ops.append(qml.PauliX(i) @ qml.PauliX(j))
+
+    return qml.Hamiltonian(coeffs, ops)
+
+
+def grid_from_hamiltonians(qml_Hs: List[qml.Hamiltonian], N: int, ring: bool = False) -> operator_grid:
+    """
+    Grid of a list of Pennylane Hamiltonians, as the ones stored by the hamiltonian
+    classes saved before the operator grids. Each Hamiltonian must be a linear combination
+    of the operator basis: uniform field and sigma_x*sigma_x interactions at fixed distances
+
+    Parameters
+    ----------
+    qml_Hs : List[pennylane.ops.qubit.hamiltonian.Hamiltonian]
+        List of the Hamiltonians
+    N : int
+        Number of spins of the chain
+    ring : bool
+        If False, system has open-boundaries condition
+
+    Returns
+    -------
+    operators.operator_grid
+        Grid of the Hamiltonians
+    """
+    # Terms of each Hamiltonian grouped by operator of the basis:
+    #   > 0 for the field (sigma_z)
+    #   > d for the sigma_x*sigma_x interactions at distance d
+    points = []
+    for H in qml_Hs:
+        terms = {}
+        for coeff, op in zip(H.coeffs, H.ops):
+            names = op.name if isinstance(op.name, list) else [op.name]
+            wires = op.wires.tolist()
+            if names == ["PauliZ"]:
+                key = 0
+            elif names == ["PauliX", "PauliX"]:
+                i, j = wires
+                key = min((j - i) % N, (i - j) % N) if ring else abs(j - i)
+            else:
+                raise ValueError("Term {0} is not in the operator basis".format(op))
+            terms.setdefault(key, []).append(float(coeff))
+        points.append(terms)
+
+    distances = tuple(sorted({key for terms in points for key in terms} - {0}))
+    n_terms = [N] + [len(xx_pairs(N, distance, ring)) for distance in distances]
+
+    coefficients = np.zeros((len(points), 1 + len(distances)))
+    for idx, terms in enumerate(points):
+        for column, key in enumerate((0,) + distances):
+            values = terms.get(key, [])
+            # Missing operators have null coefficient, the others act uniformly on the chain
+            if len(values) == 0:
+                continue
+            if len(values) != n_terms[column] or not np.allclose(values, values[0]):
+                raise ValueError("Hamiltonian {0} is not a linear combination of the operator basis".format(idx))
+            coefficients[idx, column] = values[0]
+
+    return operator_grid(
+        N,
+        ring,
+        distances=distances,
+        coefficients=coefficients,
+        qml_func=functools.partial(basis_hamiltonian, distances),
+        qml_params=coefficients,
+    )
@@ -7,11 +7,11 @@ from jax.example_libraries import optimizers
 
 from matplotlib import pyplot as plt
 
-import copy, tqdm, pickle
+import tqdm, pickle, itertools
 
-from PhaseEstimation import circuits, vqe, general as qmlgen, ising_chain as ising, annni_model as annni, visualization as qplt
+from PhaseEstimation import circuits, vqe, compilation, dataloader, general as qmlgen, ising_chain as ising, annni_model as annni, visualization as qplt
 
-from typing import Tuple, List, Callable
+from typing import Tuple, List, Callable, Union
 from numbers import Number
 
 ##############
@@ -67,8 +67,105 @@ def qcnn_circuit(params: List[Number], N: int, n_outputs: int) -> Tuple[int, Lis
     return index + 1, active_wires
 
 
+def _qcnn_functions(qcnn_circuit: Callable, N: int, n_outputs: int, device) -> dict:
+    """
+    Build the qnodes and the jitted inference functions of a QCNN.
+    The VQE states and the QCNN parameters are arguments, hence the functions are compiled
+    once for each shape of the batch of states
+
+    Parameters
+    ----------
+    qcnn_circuit : function
+        Function of the QCNN circuit
+    N : int
+        Number of qubits
+    n_outputs : int
+        Output vector dimension
+    device : qml.Device
+        Device of the VQE
+
+    Returns
+    -------
+    dict
+        Dictionary of the functions, they become attributes of the QCNN class
+    """
+    circuit = lambda p: qcnn_circuit(p, N, n_outputs)
+    wires = [int(k) for k in circuit([0] * 10000)[1]]
+
+    # QCircuit: Circuit(VQE state, QCNNparams) -> probs
+    @qml.qnode(device, interface="jax")
+    def q_qcnn_probs(psi, qcnn_p):
+        qml.StatePrep(psi, wires=range(N))
+        circuit(qcnn_p)
+
+        return qml.probs(wires)
+
+    # QCircuit: Circuit(VQE state, QCNNparams) -> probs of each output wire
+    @qml.qnode(device, interface="jax")
+    def q_qcnn_marginals(psi, qcnn_p):
+        qml.StatePrep(psi, wires=range(N))
+        circuit(qcnn_p)
+
+        return [qml.probs(wires=k) for k in wires]
+
+    # Predictions on a batch of states: (n_states, 2^n_outputs) and (n_states, n_outputs, 2)
+    jv_qcnn_probs = jax.jit(jax.vmap(q_qcnn_probs, in_axes=(0, None)))
+    jv_qcnn_marginals = jax.jit(
+        jax.vmap(lambda psi, p: jnp.stack(q_qcnn_marginals(psi, p)), in_axes=(0, None))
+    )
+
+    return dict(
+        q_qcnn_probs=q_qcnn_probs,
+        jv_qcnn_probs=jv_qcnn_probs,
+        jv_qcnn_marginals=jv_qcnn_marginals,
+    )
+
+
+def _loss_functions(loss_fn: Callable, q_qcnn_probs: Callable) -> dict:
+    """
+    Build the jitted training functions of a QCNN for a loss function.
+    The data and the learning rate are arguments: nothing is compiled again when
+    train is called with another training set of the same size or another learning rate.
+    The training loss comes with the gradient (value_and_grad), the test loss is
+    evaluated by the same program when it is needed (j_step_test)
+
+    Parameters
+    ----------
+    loss_fn : function
+        Loss function, loss_fn(X, Y, params, q_circuit) (see losses)
+    q_qcnn_probs : function
+        QCircuit of the QCNN: (VQE state, QCNNparams) -> probs
+
+    Returns
+    -------
+    dict
+        Dictionary of the functions
+    """
+    j_loss = jax.jit(lambda X, Y, p: loss_fn(X, Y, p, q_qcnn_probs))
+
+    # Adam step, the learning rate is traced as the data.
+    # Returns the new state of the optimizer and the training loss before the update
+    def step(lr, opt_state, X, Y):
+        _, opt_update, get_params = optimizers.adam(lr)
+        loss, grads = jax.value_and_grad(lambda p: loss_fn(X, Y, p, q_qcnn_probs))(get_params(opt_state))
+
+        return opt_update(0, grads, opt_state), loss
+
+    # Same step, together with the test loss of the same parameters
+    def step_test(lr, opt_state, X, Y, X_test, Y_test):
+        _, _, get_params = optimizers.adam(lr)
+        test_loss = loss_fn(X_test, Y_test, get_params(opt_state), q_qcnn_probs)
+        opt_state, loss = step(lr, opt_state, X, Y)
+
+        return opt_state, loss, test_loss
+
+    return dict(j_loss=j_loss, j_step=jax.jit(step), j_step_test=jax.jit(step_test))
+
+
 class qcnn:
-    def __init__(self, vqe: vqe.vqe, qcnn_circuit: Callable, n_outputs: int = 1):
+    def __init__(
+        self, vqe: vqe.vqe, qcnn_circuit: Callable, n_outputs: int = 1, states_path: Union[str, None] = None
+    ):
         """
         Class for the QCNN algorithm
 
@@ -80,6 +177,8 @@ class qcnn:
             Function of the QCNN circuit
         n_outputs : int
             Output vector dimension
+        states_path : str
+            Directory of the memory-mapped VQE states (None: states kept in memory), see vqe.state_bank
         """
         self.vqe = vqe
         self.N = vqe.Hs.N
@@ -89,8 +188,18 @@ class qcnn:
         self.n_params, self.final_active_wires = self.qcnn_circuit_fun([0] * 10000)
         self.params = np.array(np.random.rand(self.n_params))
         self.device = vqe.device
+        # The qnodes and their jitted functions are shared by every QCNN with the same
+        # circuit, number of qubits and device (see compilation.get_compiled)
+        self._key = ("qcnn", qcnn_circuit, self.N, n_outputs, self.device)
+        functions = compilation.get_compiled(
+            self._key, lambda: _qcnn_functions(qcnn_circuit, self.N, n_outputs, self.device)
+        )
+        for name, function in functions.items():
+            setattr(self, name, function)
 
         self.vqe_params = np.array(vqe.vqe_params0)
+        # Input of the QCNN: the VQE states, simulated only once (see vqe.state_bank)
+        self.states = vqe.state_bank(states_path)
 
         self.labels = np.array(vqe.Hs.labels)
         self.loss_train: List[float] = []
@@ -107,12 +216,12 @@ class qcnn:
 
         return qml.draw(circuit_drawer)(self)
 
-    def _vqe_qcnn_circuit(self, vqe_p, qcnn_p):
+    def _vqe_qcnn_circuit(self, psi, qcnn_p):
         """
         Circuit:
-        VQE + QCNN
+        VQE + QCNN, the VQE state psi (see vqe.state_bank) is prepared directly
         """
-        self.vqe.circuit(vqe_p)
+        qml.StatePrep(psi, wires=range(self.N))
         self.qcnn_circuit_fun(qcnn_p)
 
     # Training function
@@ -124,9 +233,20 @@ class qcnn:
         loss_fn: Callable,
         circuit: bool = False,
         plot: bool = False,
+        metrics_every: int = 100,
+        batch_size: Union[int, None] = None,
+        prefetch: int = 2,
+        seed: Union[int, None] = None,
     ):
         """
         Training function for the QCNN.
+        The training and test losses are recorded every metrics_every epochs without waiting
+        for them: they are copied to the host in the background and shown by the progress bar
+        one record later.
+        If batch_size is given, the QCNN is trained on shuffled mini-batches of the training set,
+        read from the state bank (see dataloader.batch_loader) one at a time: only a few batches
+        are on the device, whatever the size of the grid. An epoch is then a pass over the
+        batches and the recorded losses are the ones of a batch of the training (and test) set
 
         Parameters
         ----------
@@ -142,34 +262,33 @@ class qcnn:
             if True -> Prints the circuit
         plot : bool
             if True -> It displays loss curve
+        metrics_every : int
+            Number of epochs between two records of the losses (loss_train, loss_test)
+        batch_size : int
+            Number of states of each mini-batch (None: full batch), at most the size of the
+            training set (and of the test set for its batches)
+        prefetch : int
+            Number of mini-batches loaded in advance
+        seed : int
+            Seed of the shuffling of the mini-batches
         """
 
         # -1 could be in the labels as [-1, -1] when training
         # ANNNI model which non-trivial cases have no solution
         if (-1 not in self.labels) and (None not in self.labels):
-            X_train, Y_train = (
-                jnp.array(self.vqe_params[train_index]),
-                jnp.array(self.labels[train_index]),
-            )
-            test_index = np.setdiff1d(np.arange(len(self.vqe_params)), train_index)
-            X_test, Y_test = (
-                jnp.array(self.vqe_params[test_index]),
-                jnp.array(self.labels[test_index]),
-            )
+            # Rows of the states in the bank
+            rows = np.arange(len(self.vqe_params))
+            Y = np.asarray(self.labels)
         else:
             # If we are traing an ANNNI model, we have to first restrict on the trivial cases:
             # L = 0, K = whatever
             # K = 0, L = whatever
-            mask = jnp.array(
-                jnp.logical_or(
-                    jnp.array(self.vqe.Hs.model_params)[:, 1] == 0,
-                    jnp.array(self.vqe.Hs.model_params)[:, 2] == 0,
-                )
+            mask = np.logical_or(
+                np.array(self.vqe.Hs.model_params)[:, 1] == 0,
+                np.array(self.vqe.Hs.model_params)[:, 2] == 0,
             )
 
-            self.vqe_params = jnp.array(self.vqe_params)
-
-            X, Y = self.vqe_params[mask], self.labels[mask, :].astype(int)
+            rows, Y = np.flatnonzero(mask), np.asarray(self.labels)[mask, :].astype(int)
             # The labels stored in the Hamiltonian class are:
             #   > [ 1, 1] for paramagnetic states
             #   > [ 0, 1] for ferromagnetic states
@@ -194,88 +313,122 @@ class qcnn:
                     Ymix.append([0, 0, 1, 0])  # Antiphase
                 elif (label == [1, 1]).all():
                     Ymix.append([0, 0, 0, 1])  # Paramagnetic
-            Y = jnp.array(Ymix)
+            Y = np.array(Ymix)
 
-            # The indexes of test are
-            # All indexes (only analitical) \ train_index
-            test_index = np.setdiff1d(np.arange(len(Y)), train_index)
-
-            X_train, Y_train = X[train_index], Y[train_index]
-            X_test, Y_test = X[test_index], Y[test_index]
+        # The indexes of test are
+        # All indexes (only analitical) \ train_index
+        test_index = np.setdiff1d(np.arange(len(Y)), train_index)
+        train_rows, Y_train = rows[train_index], Y[train_index]
+        test_rows, Y_test = rows[test_index], Y[test_index]
 
         if circuit:
             # Display the circuit
             print("+--- CIRCUIT ---+")
             print(self)
 
-        # QCircuit: Circuit(VQE, QCNNparams) -> probs
-        @qml.qnode(self.device, interface="jax")
-        def qcnn_circuit_prob(vqe_p, qcnn_p):
-            self._vqe_qcnn_circuit(vqe_p, qcnn_p)
-
-            return qml.probs([int(k) for k in self.final_active_wires])
-
-        params = copy.copy(self.params)
+        params = jnp.array(self.params)
 
-        # Gradient of the Loss function
-        jd_loss_fn = jax.jit(
-            jax.grad(lambda p: loss_fn(X_train, Y_train, p, qcnn_circuit_prob))
+        # Training step and losses, compiled once for each loss function and data shape
+        functions = compilation.get_compiled(
+            self._key + ("loss", loss_fn), lambda: _loss_functions(loss_fn, self.q_qcnn_probs)
         )
-
-        # Update function
-        # Returns updated parameters, updated state of the optimizer
-        def update(params, opt_state):
-            grads = jd_loss_fn(params)
-            opt_state = opt_update(0, grads, opt_state)
-
-            return get_params(opt_state), opt_state
-
-        # Definying following function:
-        # jitted loss function for training set loss(params)
-        train_loss_fn = jax.jit(
-            lambda p: loss_fn(X_train, Y_train, p, qcnn_circuit_prob)
-        )
-        # jitted loss function for test set loss(params)
-        test_loss_fn = jax.jit(lambda p: loss_fn(X_test, Y_test, p, qcnn_circuit_prob))
+        j_step, j_step_test = functions["j_step"], functions["j_step_test"]
+        metrics_every = max(1, metrics_every)
+        n_records = -(-n_epochs // metrics_every)
+
+        # Batches of the training and of the test set:
+        #   > full batch: the same arrays at every step
+        #   > mini-batches: streams of the loaders, one batch per step (per record for the test)
+        if batch_size is None:
+            steps_per_epoch = 1
+            train_batches = itertools.repeat((self.states[train_rows], jnp.array(Y_train)), n_epochs)
+            test_batches = itertools.repeat((self.states[test_rows], jnp.array(Y_test)), n_records)
+        else:
+            rng = np.random.default_rng(seed)
+            train_loader = dataloader.batch_loader(
+                self.states.states,
+                Y_train,
+                train_rows,
+                min(batch_size, len(train_rows)),
+                prefetch=prefetch,
+                seed=rng.integers(2**32),
+            )
+            steps_per_epoch = len(train_loader)
+            train_batches = train_loader.stream(n_epochs * steps_per_epoch)
+            test_batches = iter(())
+            if len(test_rows) > 0:
+                test_loader = dataloader.batch_loader(
+                    self.states.states,
+                    Y_test,
+                    test_rows,
+                    min(batch_size, len(test_rows)),
+                    prefetch=1,
+                    seed=rng.integers(2**32),
+                )
+                test_batches = test_loader.stream(n_records)
 
         # Initialize tqdm progress bar
         progress = tqdm.tqdm(range(n_epochs), position=0, leave=True)
 
-        # Defining an optimizer in Jax
-        opt_init, opt_update, get_params = optimizers.adam(lr)
+        # Defining an optimizer in Jax (its update is part of j_step)
+        opt_init, _, get_params = optimizers.adam(lr)
         opt_state = opt_init(params)
 
+        # Device arrays of the losses, they are read only at the end of the training
         loss_history, loss_history_test = [], []
-        # Training loop:
-        for epoch in range(n_epochs):
-            params, opt_state = update(params, opt_state)
-
-            # Every 100 iterations append the updated training (and testing) loss
-            if epoch % 100 == 0:
-                loss_history.append(train_loss_fn(params))
+        try:
+            # Training loop:
+            for step, (X_train, Y_batch) in enumerate(train_batches):
+                epoch, first = divmod(step, steps_per_epoch)
+                if first != 0 or epoch % metrics_every != 0:
+                    opt_state, _ = j_step(lr, opt_state, X_train, Y_batch)
+                    if first == steps_per_epoch - 1:
+                        progress.update(1)
+                    continue
+
+                # Record the training (and testing) loss
                 if len(Y_test) > 0:
-                    loss_history_test.append(test_loss_fn(params))
-
-            # Update progress bar
-            progress.update(1)
-            progress.set_description("Cost: {0}".format(loss_history[-1]))
+                    X_test, Y_test_batch = next(test_batches)
+                    opt_state, loss, test_loss = j_step_test(lr, opt_state, X_train, Y_batch, X_test, Y_test_batch)
+                    test_loss.copy_to_host_async()
+                    loss_history_test.append(test_loss)
+                else:
+                    opt_state, loss = j_step(lr, opt_state, X_train, Y_batch)
+                loss.copy_to_host_async()
+                loss_history.append(loss)
+
+                # Update progress bar with the previous record, already on the host
+                if len(loss_history) > 1:
+                    progress.set_description("Cost: {0}".format(float(loss_history[-2])))
+                if steps_per_epoch == 1:
+                    progress.update(1)
+        finally:
+            # Stop the loaders (if any)
+            for batches in (train_batches, test_batches):
+                if hasattr(batches, "close"):
+                    batches.close()
+
+        params = get_params(opt_state)
 
         # Update qcnn class after training
-        self.loss_train = loss_history
-        self.loss_test = loss_history_test
+        self.loss_train = [float(loss) for loss in loss_history]
+        self.loss_test = [float(loss) for loss in loss_history_test]
         self.params = params
+        if len(loss_history) > 0:
+            progress.set_description("Cost: {0}".format(self.loss_train[-1]))
+        progress.close()
 
         if plot:
             plt.figure(figsize=(15, 5))
             plt.plot(
-                np.arange(len(loss_history)) * 100,
-                np.asarray(loss_history),
+                np.arange(len(loss_history)) * metrics_every,
+                np.asarray(self.loss_train),
                 label="Training Loss",
             )
-            if len(X_test) > 0:
+            if len(Y_test) > 0:
                 plt.plot(
-                    np.arange(len(loss_history_test)) * 100,
-                    np.asarray(loss_history_test),
+                    np.arange(len(loss_history_test)) * metrics_every,
+                    np.asarray(self.loss_test),
                     label="Test Loss",
                 )
             plt.axhline(y=0, color="r", linestyle="--")
@@ -294,17 +447,7 @@ class qcnn:
         List[List[Number]]
             List of probabilities
         """
-        @qml.qnode(self.device, interface="jax")
-        def qcnn_circuit_prob(params_vqe, params):
-            self._vqe_qcnn_circuit(params_vqe, params)
-
-            return qml.probs([int(k) for k in self.final_active_wires])
-
-        vcircuit = jax.vmap(
-            lambda v: qcnn_circuit_prob(v, self.params), in_axes=(0)
-        )
-
-        predictions = np.array(vcircuit(self.vqe_params))
+        predictions = np.array(self.jv_qcnn_probs(self.states[:], jnp.array(self.params)))
 
         return predictions
 
@@ -465,19 +608,11 @@ def ANNNI_accuracy(qcnnclass: qcnn, plot: bool = False) -> float:
     float
         Accuracy : (# samples correctly classified)/(# samples) (0,1)
     """
-    circuit = qcnnclass._vqe_qcnn_circuit
     side = qcnnclass.vqe.Hs.side
 
-    @qml.qnode(qcnnclass.device, interface="jax")
-    def qcnn_circuit_prob(params_vqe, params):
-        circuit(params_vqe, params)
-
-        return [qml.probs(wires=int(k)) for k in qcnnclass.final_active_wires]
-
-    vcircuit = jax.vmap(lambda v: qcnn_circuit_prob(v, qcnnclass.params), in_axes=(0))
-
     # Get the predictions of the QCNN among all states of the VQE
-    predictions = np.array(np.argmax(vcircuit(qcnnclass.vqe_params), axis=2))
+    marginals = qcnnclass.jv_qcnn_marginals(qcnnclass.states[:], jnp.array(qcnnclass.params))
+    predictions = np.array(np.argmax(marginals, axis=2))
 
     # Compare predictions to actual states
     # applying inequalities to theoretical curves
@@ -0,0 +1,566 @@
+""" This module implements a fused-layer statevector simulator for the circuits of circuits.py """
+import pennylane as qml
+from pennylane.devices import DefaultQubit, DefaultExecutionConfig
+from pennylane.devices.qubit import apply_operation, create_initial_state, measure_final_state, simulate
+from pennylane.measurements import ProbabilityMP, StateMP
+from pennylane.tape import QuantumScript
+import numpy as np
+import jax.numpy as jnp
+import functools
+import string
+
+from typing import Dict, List, Tuple, Union
+
+##############
+
+# The circuits are made of a few kinds of layers (see circuits.py): walls of
+# single-qubit gates (Hadamard, RX, RY, RZ) and ladders of CNOTs/CZs.
+# Instead of applying the gates one by one, consecutive operations are fused into
+#   > wall: single-qubit gates of any wires, the 2x2 matrices acting on the same wire
+#           are multiplied and the whole wall is a single einsum on the (2,)*N state tensor
+#   > permutation: non-parametrized gates whose matrix is a permutation with phases
+#           (CNOT, CZ, SWAP, Toffoli, ...), the whole ladder is a single gather
+#           psi -> phases * psi[source] with source and phases precomputed in numpy
+#   > gate: any other operation (e.g. controlled rotations of the deferred mid-circuit
+#           measurements of the QCNN), applied as in default.qubit
+# When every gate of a circuit is real (e.g. circuit_ID9: Hadamard, CNOT, RY) the state
+# is kept real for the whole simulation (real-amplitude mode), halving its memory and
+# the cost of each layer
+#
+# The poolings of the QCNN measure half of the active wires and rotate their neighbours
+# depending on the outcome. Once the mid-circuit measurements are deferred, a measured wire
+# is only the control of the conditional rotations and it is never used again: it is dead.
+# The reduced-state simulation (see reduced_probs) keeps the statevector while it is smaller
+# than the density matrix of the live wires, then it switches to the density matrix and
+# traces out every wire as soon as it dies. The density matrix of n live wires has 4^n
+# entries, hence the layers following the second pooling cost less and less
+
+# Subscripts of the einsum of the walls: state axes and new axes
+_STATE_LETTERS = string.ascii_lowercase
+_NEW_LETTERS = string.ascii_uppercase
+
+
+# Parametrized gates whose matrix is real for any value of the parameter
+REAL_GATES = (qml.RY, qml.CRY)
+
+
+def is_real(operations: List[qml.operation.Operator]) -> bool:
+    """
+    Whether the matrices of all the operations are real
+
+    Parameters
+    ----------
+    operations : List[qml.operation.Operator]
+        Operations of the circuit
+
+    Returns
+    -------
+    bool
+        True if the circuit can be simulated with real amplitudes
+    """
+    for op in operations:
+        if isinstance(op, qml.Barrier) or isinstance(op, qml.Identity):
+            continue
+        if op.num_params > 0:
+            if not isinstance(op, REAL_GATES):
+                return False
+        elif not op.has_matrix or np.any(np.imag(qml.matrix(op)) != 0):
+            return False
+
+    return True
+
+
+def _is_permutation(matrix: np.ndarray) -> bool:
+    return bool(np.all(np.count_nonzero(matrix, axis=1) == 1))
+
+
+def fuse(operations: List[qml.operation.Operator]) -> List[Tuple]:
+    """
+    Group consecutive operations in fused layers
+
+    Parameters
+    ----------
+    operations : List[qml.operation.Operator]
+        Operations of the circuit (on standard wires 0, ..., n - 1)
+
+    Returns
+    -------
+    List[Tuple]
+        List of the layers ('wall', {wire: [ops]}), ('permutation', [ops]) or ('gate', op)
+    """
+    layers = []
+    for op in operations:
+        if isinstance(op, qml.Barrier) or isinstance(op, qml.Identity):
+            continue
+
+        if len(op.wires) == 1 and op.has_matrix:
+            kind = "wall"
+        elif op.num_params == 0 and op.has_matrix and _is_permutation(qml.matrix(op)):
+            kind = "permutation"
+        else:
+            kind = "gate"
+
+        if layers and layers[-1][0] == kind == "wall":
+            layers[-1][1].setdefault(int(op.wires[0]), []).append(op)
+        elif layers and layers[-1][0] == kind == "permutation":
+            layers[-1][1].append(op)
+        elif kind == "wall":
+            layers.append(("wall", {int(op.wires[0]): [op]}))
+        elif kind == "permutation":
+            layers.append(("permutation", [op]))
+        else:
+            layers.append(("gate", op))
+
+    return layers
+
+
+def permutation(operations: List[qml.operation.Operator], n_wires: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Index permutation and phases of a sequence of permutation gates:
+            psi_new = phases * psi[source]
+
+    Parameters
+    ----------
+    operations : List[qml.operation.Operator]
+        Non-parametrized operations whose matrices are permutations with phases
+    n_wires : int
+        Number of wires of the state
+
+    Returns
+    -------
+    np.ndarray
+        Source index of each entry of the new state
+    np.ndarray
+        Phase of each entry of the new state
+    """
+    states = np.arange(2 ** n_wires)
+    source = states.copy()
+    phases = np.ones(2 ** n_wires, dtype=complex)
+    for op in operations:
+        matrix = qml.matrix(op)
+        # Wire 0 is the most significant bit
+        shifts = [n_wires - 1 - int(w) for w in op.wires]
+        rows = np.zeros(2 ** n_wires, dtype=int)
+        for shift in shifts:
+            rows = 2 * rows + ((states >> shift) & 1)
+        cols = np.argmax(matrix != 0, axis=1)[rows]
+
+        op_source = states.copy()
+        for k, shift in enumerate(shifts):
+            bit = (cols >> (len(shifts) - 1 - k)) & 1
+            op_source = (op_source & ~(1 << shift)) | (bit << shift)
+
+        # Composition with the previous gates of the layer
+        phases = matrix[rows, cols] * phases[op_source]
+        source = source[op_source]
+
+    return source, phases
+
+
+@functools.lru_cache(maxsize=None)
+def _wall_subscripts(n_wires: int, wires: Tuple[int, ...]) -> str:
+    state = _STATE_LETTERS[:n_wires]
+    new = "".join(_NEW_LETTERS[w] if w in wires else state[w] for w in range(n_wires))
+    matrices = ",".join(_NEW_LETTERS[w] + state[w] for w in wires)
+
+    return "{0},{1}->{2}".format(matrices, state, new)
+
+
+def wall_matrices(wall: dict) -> Tuple[Tuple[int, ...], List[jnp.ndarray]]:
+    """
+    Matrix of each wire of a wall of single-qubit gates (product of its gates)
+
+    Parameters
+    ----------
+    wall : dict
+        Dictionary {wire: [ops]} of the operations of each wire (in order)
+
+    Returns
+    -------
+    Tuple[int]
+        Wires of the wall (sorted)
+    List[jnp.ndarray]
+        2x2 matrix of each wire
+    """
+    wires = tuple(sorted(wall))
+    matrices = []
+    for wire in wires:
+        matrix = qml.matrix(wall[wire][0])
+        for op in wall[wire][1:]:
+            matrix = jnp.matmul(qml.matrix(op), matrix)
+        matrices.append(jnp.asarray(matrix))
+
+    return wires, matrices
+
+
+def apply_single_qubit(wires: Tuple[int, ...], matrices: List[jnp.ndarray], state: jnp.ndarray) -> jnp.ndarray:
+    """
+    Apply 2x2 matrices to distinct wires of a (2,)*n state tensor with a single einsum
+
+    Parameters
+    ----------
+    wires : Tuple[int]
+        Wires of the matrices
+    matrices : List[jnp.ndarray]
+        2x2 matrix of each wire
+    state : jnp.ndarray
+        State tensor
+
+    Returns
+    -------
+    jnp.ndarray
+        New state tensor
+    """
+    # Each matrix is contracted with the state in turn (the default search of the optimal
+    # contraction path grows factorially with the number of wires)
+    path = [(0, len(matrices) - k) for k in range(len(matrices))]
+
+    return jnp.einsum(_wall_subscripts(state.ndim, tuple(wires)), *matrices, state, optimize=path)
+
+
+def apply_wall(wall: dict, state: jnp.ndarray) -> jnp.ndarray:
+    """
+    Apply a wall of single-qubit gates to a (2,)*n state tensor with a single einsum
+
+    Parameters
+    ----------
+    wall : dict
+        Dictionary {wire: [ops]} of the operations of each wire (in order)
+    state : jnp.ndarray
+        State tensor
+
+    Returns
+    -------
+    jnp.ndarray
+        New state tensor
+    """
+    wires, matrices = wall_matrices(wall)
+    if not jnp.iscomplexobj(state):
+        # Real-amplitude mode (see fused_final_state)
+        matrices = [jnp.real(matrix) for matrix in matrices]
+
+    return apply_single_qubit(wires, matrices, state)
+
+
+def apply_permutation(operations: List[qml.operation.Operator], state: jnp.ndarray) -> jnp.ndarray:
+    """
+    Apply a sequence of permutation gates to a (2,)*n state tensor as a single gather
+
+    Parameters
+    ----------
+    operations : List[qml.operation.Operator]
+        Non-parametrized operations whose matrices are permutations with phases
+    state : jnp.ndarray
+        State tensor
+
+    Returns
+    -------
+    jnp.ndarray
+        New state tensor
+    """
+    source, phases = permutation(operations, state.ndim)
+    new_state = jnp.reshape(state, (-1,))[source]
+    if not np.all(phases == 1):
+        new_state = jnp.asarray(phases.real if np.all(phases.imag == 0) else phases) * new_state
+
+    return jnp.reshape(new_state, state.shape)
+
+
+def apply_operations(operations: List[qml.operation.Operator], state: jnp.ndarray) -> jnp.ndarray:
+    """
+    Apply a sequence of operations to a (2,)*n state tensor through the fused layers
+
+    Parameters
+    ----------
+    operations : List[qml.operation.Operator]
+        Operations (on standard wires 0, ..., n - 1)
+    state : jnp.ndarray
+        State tensor
+
+    Returns
+    -------
+    jnp.ndarray
+        New state tensor
+    """
+    for kind, layer in fuse(operations):
+        if kind == "wall":
+            state = apply_wall(layer, state)
+        elif kind == "permutation":
+            state = apply_permutation(layer, state)
+        elif jnp.iscomplexobj(state):
+            state = apply_operation(layer, state)
+        else:
+            state = jnp.real(apply_operation(layer, state))
+
+    return state
+
+
+def fused_final_state(circuit: QuantumScript) -> jnp.ndarray:
+    """
+    Final state of a circuit (on standard wires) through the fused layers.
+    The state is real if the initial state and every gate are real (see is_real), complex otherwise
+
+    Parameters
+    ----------
+    circuit : QuantumScript
+        Circuit to simulate, with wires 0, ..., n - 1
+
+    Returns
+    -------
+    jnp.ndarray
+        State tensor (2,)*n
+    """
+    n_wires = circuit.num_wires
+    operations = circuit.operations
+    prep = None
+    if len(operations) > 0 and isinstance(operations[0], qml.operation.StatePrepBase):
+        prep, operations = operations[0], operations[1:]
+
+    state = create_initial_state(range(n_wires), prep, like="jax")
+    if not is_real(operations) or jnp.iscomplexobj(state):
+        state = jnp.asarray(state, dtype=complex)
+
+    return apply_operations(operations, state)
+
+
+def _conjugate(op: qml.operation.Operator) -> qml.operation.Operator:
+    """
+    Operation whose matrix is the complex conjugate of the matrix of op
+    """
+    if is_real([op]):
+        return op
+
+    return qml.QubitUnitary(jnp.conj(qml.matrix(op)), wires=op.wires)
+
+
+def apply_operations_mixed(
+    operations: List[qml.operation.Operator], rho: jnp.ndarray, live: List[int]
+) -> jnp.ndarray:
+    """
+    Apply a sequence of operations to a density matrix: rho -> U rho U^dag
+
+    Parameters
+    ----------
+    operations : List[qml.operation.Operator]
+        Operations acting on the live wires
+    rho : jnp.ndarray
+        Density matrix tensor (2,)*2n, the first n axes are the rows of the live wires
+        and the last n their columns
+    live : List[int]
+        Wires of the density matrix
+
+    Returns
+    -------
+    jnp.ndarray
+        New density matrix tensor
+    """
+    n = len(live)
+    rows = {wire: k for k, wire in enumerate(live)}
+    cols = {wire: n + k for k, wire in enumerate(live)}
+    # The density matrix is a state of 2n wires, evolved by U (x) conj(U)
+    rho = apply_operations([op.map_wires(rows) for op in operations], rho)
+
+    return apply_operations([_conjugate(op).map_wires(cols) for op in operations], rho)
+
+
+def partial_trace(rho: jnp.ndarray, live: List[int], wires: List[int]) -> Tuple[jnp.ndarray, List[int]]:
+    """
+    Trace out some wires of a density matrix
+
+    Parameters
+    ----------
+    rho : jnp.ndarray
+        Density matrix tensor (2,)*2n (see apply_operations_mixed)
+    live : List[int]
+        Wires of the density matrix
+    wires : List[int]
+        Wires to trace out
+
+    Returns
+    -------
+    jnp.ndarray
+        Reduced density matrix tensor
+    List[int]
+        Wires of the reduced density matrix
+    """
+    for wire in wires:
+        k = live.index(wire)
+        rho = jnp.trace(rho, axis1=k, axis2=len(live) + k)
+        live = live[:k] + live[k + 1 :]
+
+    return rho, live
+
+
+def dead_wires(circuit: QuantumScript) -> Dict[int, List[int]]:
+    """
+    Wires of a circuit which are not used anymore after each operation and that are not measured,
+    e.g. the pooled wires of the QCNN once its mid-circuit measurements are deferred
+
+    Parameters
+    ----------
+    circuit : QuantumScript
+        Circuit with wires 0, ..., n - 1
+
+    Returns
+    -------
+    Dict[int, List[int]]
+        Dictionary {index of the operation: wires dying after it} (-1: wires that are never used)
+    """
+    measured = set(int(w) for mp in circuit.measurements for w in mp.wires)
+    last = {w: -1 for w in range(circuit.num_wires)}
+    for i, op in enumerate(circuit.operations):
+        if isinstance(op, qml.operation.StatePrepBase):
+            continue
+        for w in op.wires:
+            last[int(w)] = i
+
+    dead = {}
+    for w, i in last.items():
+        if w not in measured:
+            dead.setdefault(i, []).append(w)
+
+    return dead
+
+
+def is_reducible(circuit: QuantumScript) -> bool:
+    """
+    Whether the reduced-state simulation applies (see reduced_probs): only probabilities are
+    measured and at some point the density matrix of the live wires is smaller than the statevector,
+    i.e. fewer than half of the wires are live (not after the first pooling of a QCNN alone)
+    """
+    if not all(type(mp) is ProbabilityMP and mp.wires for mp in circuit.measurements):
+        return False
+    n_dead = sum(len(wires) for wires in dead_wires(circuit).values())
+
+    return 2 * (circuit.num_wires - n_dead) < circuit.num_wires
+
+
+def reduced_probs(circuit: QuantumScript) -> Union[jnp.ndarray, Tuple[jnp.ndarray, ...]]:
+    """
+    Probabilities measured by a circuit (on standard wires), simulated with the statevector
+    until the density matrix of the live wires becomes smaller, then with the density matrix.
+    The dead wires (see dead_wires) are traced out of the density matrix as soon as they die.
+    The switch happens only once fewer than half of the wires are live: with n/2 live wires the
+    density matrix has as many entries as the statevector (and each gate costs twice as much on it),
+    hence the first pooling of a QCNN still runs on the full statevector and only the following
+    ones run on reduced density matrices
+
+    Parameters
+    ----------
+    circuit : QuantumScript
+        Circuit to simulate, with wires 0, ..., n - 1, measuring only probabilities
+
+    Returns
+    -------
+    jnp.ndarray or Tuple[jnp.ndarray]
+        Probabilities of each measurement
+    """
+    n_wires = circuit.num_wires
+    operations = circuit.operations
+    prep = None
+    if len(operations) > 0 and isinstance(operations[0], qml.operation.StatePrepBase):
+        prep = operations[0]
+    dead = dead_wires(circuit)
+
+    # Operation after which the density matrix of the live wires is smaller than the statevector
+    n_dead, switch = len(dead.get(-1, [])), len(operations) - 1
+    for i in range(len(operations)):
+        n_dead += len(dead.get(i, []))
+        if 2 * (n_wires - n_dead) < n_wires:
+            switch = i
+            break
+
+    # Statevector up to the switch (fused as a single sequence)
+    psi = jnp.asarray(create_initial_state(range(n_wires), prep, like="jax"), dtype=complex)
+    psi = apply_operations([op for op in operations[: switch + 1] if op is not prep], psi)
+    died = [w for i in [-1] + list(range(switch + 1)) for w in dead.get(i, [])]
+    if switch == len(operations) - 1 and 2 * (n_wires - len(died)) >= n_wires:
+        rho, live = None, list(range(n_wires))
+    else:
+        # Density matrix of the live wires: contraction over the dead ones
+        live = [w for w in range(n_wires) if w not in died]
+        rho = jnp.tensordot(psi, jnp.conj(psi), axes=(died, died))
+
+    # Density matrix after the switch, the wires are traced out as soon as they die
+    segment = []
+    for i in range(switch + 1, len(operations)):
+        segment.append(operations[i])
+        if i in dead or i == len(operations) - 1:
+            rho = apply_operations_mixed(segment, rho, live)
+            rho, live = partial_trace(rho, live, dead.get(i, []))
+            segment = []
+
+    results = []
+    for mp in circuit.measurements:
+        wires = [int(w) for w in mp.wires]
+        if rho is None:
+            probs = jnp.sum(jnp.abs(psi) ** 2, axis=tuple(w for w in range(n_wires) if w not in wires))
+            order = sorted(wires)
+        else:
+            reduced, order = partial_trace(rho, live, [w for w in live if w not in wires])
+            dim = 2 ** len(order)
+            probs = jnp.real(jnp.diagonal(jnp.reshape(reduced, (dim, dim))))
+            probs = jnp.reshape(probs, (2,) * len(order))
+        # Axes in the order of the measured wires
+        probs = jnp.transpose(probs, [order.index(w) for w in wires])
+        results.append(jnp.reshape(probs, (-1,)))
+
+    return results[0] if len(results) == 1 else tuple(results)
+
+
+class fused_qubit(DefaultQubit):
+    """
+    Statevector simulator applying the circuits by fused layers (see fuse).
+    It is a drop-in replacement of default.qubit.jax for the qnodes with the jax interface:
+    the simulation is made of jax.numpy operations, hence it can be jitted, vmapped and
+    differentiated (backpropagation). Circuits measuring probabilities whose wires die along
+    the way (QCNN) are simulated by reduced_probs. Circuits that cannot be fused (finite shots,
+    broadcasted parameters, partial state preparations, other interfaces) are
+    simulated by default.qubit
+    """
+
+    @property
+    def name(self):
+        return "fused.qubit"
+
+    def _fusable(self, circuit: QuantumScript, interface: str) -> bool:
+        if interface not in ["jax", "jax-jit"] or circuit.shots or circuit.batch_size is not None:
+            return False
+        ops = circuit.operations
+        if any(isinstance(op, qml.operation.StatePrepBase) for op in ops[1:]):
+            return False
+        if len(ops) > 0 and isinstance(ops[0], qml.operation.StatePrepBase):
+            return len(ops[0].wires) == circuit.num_wires
+
+        return True
+
+    def execute(self, circuits, execution_config=DefaultExecutionConfig):
+        is_single_circuit = isinstance(circuits, QuantumScript)
+        if is_single_circuit:
+            circuits = [circuits]
+
+        interface = (
+            execution_config.interface
+            if execution_config.gradient_method in {"backprop", None}
+            else None
+        )
+        results = []
+        for circuit in circuits:
+            if self._fusable(circuit, interface) and is_reducible(circuit.map_to_standard_wires()):
+                results.append(reduced_probs(circuit.map_to_standard_wires()))
+            elif self._fusable(circuit, interface):
+                state = fused_final_state(circuit.map_to_standard_wires())
+                measurements = circuit.measurements
+                if (
+                    len(measurements) == 1
+                    and type(measurements[0]) is StateMP
+                    and (not measurements[0].wires or measurements[0].wires == circuit.wires)
+                ):
+                    # qml.state() keeps the real amplitudes (Pennylane casts them to complex)
+                    results.append(jnp.reshape(state, (-1,)))
+                else:
+                    results.append(measure_final_state(circuit, state, False))
+            else:
+                results.append(simulate(circuit, rng=self._rng, prng_key=self._prng_key, interface=interface))
+
+        return results[0] if is_single_circuit else tuple(results)
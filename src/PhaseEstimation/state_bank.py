@@ -0,0 +1,133 @@
+""" This module implements the bank of the VQE states shared by the QCNN and the encoder """
+import numpy as np
+import jax
+import jax.numpy as jnp
+import hashlib
+import os
+import tempfile
+
+from typing import Callable, Union
+
+##############
+
+# The VQE parameters are frozen while the QCNN and the encoder are trained, hence the
+# VQE part of their circuits always prepares the same states. The bank simulates the VQE
+# circuit of every site once and the other circuits start from the stored states
+# (qml.StatePrep) instead of replaying the VQE gates at every evaluation
+
+
+def params_key(name: str, params: np.ndarray) -> str:
+    """
+    Key of the states of a set of VQE parameters
+
+    Parameters
+    ----------
+    name : str
+        Description of the VQE circuit (circuit function, number of qubits)
+    params : np.ndarray
+        Array (n_states, n_params) of the VQE parameters
+
+    Returns
+    -------
+    str
+        Key of the states
+    """
+    params = np.ascontiguousarray(np.asarray(params, dtype=np.float64))
+    h = hashlib.sha256()
+    h.update(repr(("states", name, params.shape)).encode())
+    h.update(params.tobytes())
+
+    return h.hexdigest()
+
+
+class state_bank:
+    def __init__(
+        self,
+        state_fn: Callable,
+        params: np.ndarray,
+        name: str = "",
+        path: Union[str, None] = None,
+        chunk: int = 256,
+    ):
+        """
+        Statevectors of the VQE circuit for every set of parameters, computed at the first access.
+        If path is given, the states are stored in the directory path as a .npy file named after
+        their key (see params_key) and memory-mapped: they are not kept in memory and they are
+        computed once also across different processes
+
+        Parameters
+        ----------
+        state_fn : function
+            Jitted vmap of the VQE state circuit (see vqe.jv_q_vqe_state)
+        params : np.ndarray
+            Array (n_states, n_params) of the VQE parameters
+        name : str
+            Description of the VQE circuit (circuit function, number of qubits)
+        path : str
+            Directory of the memory-mapped states (None: states kept in memory)
+        chunk : int
+            Number of states simulated at once
+        """
+        self.state_fn = state_fn
+        self.params = np.array(params)
+        self.key = params_key(name, self.params)
+        self.path = path
+        self.chunk = max(1, chunk)
+        self._states = None
+
+    def matches(self, params: np.ndarray, path: Union[str, None] = None) -> bool:
+        """
+        Whether the bank holds the states of params (stored in path)
+        """
+        return self.path == path and np.array_equal(self.params, np.asarray(params))
+
+    def _compute(self, out: np.ndarray):
+        # Every chunk has the same size (the last one is padded), one compilation only
+        n_states = len(self.params)
+        chunk = min(self.chunk, n_states)
+        for start in range(0, n_states, chunk):
+            params = self.params[start : start + chunk]
+            padded = np.concatenate((params, np.repeat(params[-1:], chunk - len(params), axis=0)))
+            out[start : start + len(params)] = np.asarray(self.state_fn(jnp.array(padded)))[: len(params)]
+
+    def _dtype_shape(self):
+        # Abstract evaluation, nothing is compiled
+        psi = jax.eval_shape(self.state_fn, jnp.array(self.params[:1]))
+
+        return np.dtype(psi.dtype), (len(self.params), psi.shape[1])
+
+    @property
+    def states(self) -> np.ndarray:
+        """
+        Array (n_states, 2^N) of the states (np.memmap if path is given)
+        """
+        if self._states is not None:
+            return self._states
+
+        if self.path is None:
+            dtype, shape = self._dtype_shape()
+            self._states = np.zeros(shape, dtype=dtype)
+            self._compute(self._states)
+            return self._states
+
+        os.makedirs(self.path, exist_ok=True)
+        filename = os.path.join(self.path, self.key + ".states.npy")
+        if not os.path.exists(filename):
+            # Written to a temporary file first, so that an interrupted bank is never read
+            dtype, shape = self._dtype_shape()
+            fd, tmp = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+            os.close(fd)
+            out = np.lib.format.open_memmap(tmp, mode="w+", dtype=dtype, shape=shape)
+            self._compute(out)
+            out.flush()
+            del out
+            os.replace(tmp, filename)
+        self._states = np.load(filename, mmap_mode="r")
+
+        return self._states
+
+    def __getitem__(self, index) -> jnp.ndarray:
+        return jnp.array(self.states[index])
+
+    def __len__(self) -> int:
+        return len(self.params)
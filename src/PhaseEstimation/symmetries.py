@@ -0,0 +1,409 @@
+""" This module implements the symmetry-sector exact diagonalization of the spin-chain Hamiltonians """
+import numpy as np
+import scipy.sparse as sparse
+import functools
+
+from PhaseEstimation import operators, general as qmlgen
+
+from typing import List, Tuple
+from numbers import Number
+
+##############
+
+
+@functools.lru_cache(maxsize=None)
+def parity_sectors(N: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Computational basis states of the two sectors of the global parity P = Π sigma^i_z.
+    Both the ANNNI and the Ising Hamiltonians commute with P, since sigma_x*sigma_x flips
+    two spins at once
+
+    Parameters
+    ----------
+    N : int
+        Number of spins of the chain
+
+    Returns
+    -------
+    np.ndarray
+        Basis states with P = +1 (even number of spins down)
+    np.ndarray
+        Basis states with P = -1 (odd number of spins down)
+    """
+    # z_diagonal = N - 2 * (number of spins down)
+    n_down = (N - operators.z_diagonal(N).astype(np.int64)) // 2
+    states = np.arange(2 ** N, dtype=np.int64)
+
+    return states[n_down % 2 == 0], states[n_down % 2 == 1]
+
+
+@functools.lru_cache(maxsize=8)
+def get_parity_basis(
+    N: int, distances: Tuple[int, ...], ring: bool, parity: int
+) -> List[sparse.csr_matrix]:
+    """
+    Shared operator basis (see operators.get_basis) restricted to a parity sector.
+    The blocks are built directly from the bit-flip masks, without the full operators
+
+    Parameters
+    ----------
+    N : int
+        Number of spins of the chain
+    distances : Tuple[int]
+        Distances of the sigma_x*sigma_x interactions
+    ring : bool
+        If False, system has open-boundaries condition
+    parity : int
+        0 for the sector P = +1, 1 for the sector P = -1
+
+    Returns
+    -------
+    List[scipy.sparse.csr_matrix]
+        List of the sparse blocks of the operators
+    """
+    states = parity_sectors(N)[parity]
+    dim = len(states)
+
+    # Position of every basis state inside its sector
+    position = np.zeros(2 ** N, dtype=np.int64)
+    for sector in parity_sectors(N):
+        position[sector] = np.arange(len(sector))
+
+    basis = [sparse.diags(operators.z_diagonal(N)[states], format="csr")]
+    for distance in distances:
+        masks = operators.xx_masks(N, distance, ring)
+        if len(masks) == 0:
+            basis.append(sparse.csr_matrix((dim, dim), dtype=np.float64))
+            continue
+        rows = np.tile(np.arange(dim), len(masks))
+        cols = np.concatenate([position[states ^ mask] for mask in masks])
+        basis.append(
+            sparse.csr_matrix(
+                (np.ones(len(rows), dtype=np.float64), (rows, cols)), shape=(dim, dim)
+            )
+        )
+
+    return basis
+
+
+def parity_block(grid: operators.operator_grid, idx: int, parity: int) -> sparse.csr_matrix:
+    """
+    Block of the idx-th Hamiltonian of the grid in a parity sector
+
+    Parameters
+    ----------
+    grid : operators.operator_grid
+        Grid of the Hamiltonians
+    idx : int
+        Index of the point of the grid
+    parity : int
+        0 for the sector P = +1, 1 for the sector P = -1
+
+    Returns
+    -------
+    scipy.sparse.csr_matrix
+        Sparse block of the Hamiltonian
+    """
+    basis = get_parity_basis(grid.N, grid.distances, grid.ring, parity)
+
+    H = grid.coefficients[idx, 0] * basis[0]
+    for coeff, op in zip(grid.coefficients[idx, 1:], basis[1:]):
+        H = H + coeff * op
+
+    return H.tocsr()
+
+
+def parity_eigh(
+    grid: operators.operator_grid, idx: int, n_levels: int, solver: str = "auto"
+) -> Tuple[List[Number], List[List[Number]], List[int]]:
+    """
+    Compute the n_levels lowest eigenvalues and eigenvectors of the idx-th Hamiltonian
+    of the grid by diagonalizing separately the two parity blocks (half the dimension each)
+
+    Parameters
+    ----------
+    grid : operators.operator_grid
+        Grid of the Hamiltonians
+    idx : int
+        Index of the point of the grid
+    n_levels : int
+        Number of (lowest) energy levels desired
+    solver : str
+        Eigensolver backend, see general.sparse_eigh
+
+    Returns
+    -------
+    np.ndarray
+        Array of the n_levels lowest eigenvalues (sorted)
+    np.ndarray
+        Array (2^N, n_levels) of the eigenvectors in the full computational basis
+    np.ndarray
+        Parity sector of each level (0: P = +1, 1: P = -1)
+    """
+    eigvals, eigvecs, parities = [], [], []
+    for parity, states in enumerate(parity_sectors(grid.N)):
+        # Each sector might hold every requested level
+        k = min(n_levels, len(states))
+        e, v = qmlgen.sparse_eigh(parity_block(grid, idx, parity), k, solver)
+
+        # Embed the eigenvectors of the sector back into the full basis
+        psi = np.zeros((2 ** grid.N, k), dtype=v.dtype)
+        psi[states, :] = v
+
+        eigvals.append(e), eigvecs.append(psi), parities.append([parity] * k)
+
+    eigvals, eigvecs, parities = (
+        np.concatenate(eigvals),
+        np.concatenate(eigvecs, axis=1),
+        np.concatenate(parities),
+    )
+    order = np.argsort(eigvals, kind="stable")[:n_levels]
+
+    return eigvals[order], eigvecs[:, order], parities[order]
+
+
+@functools.lru_cache(maxsize=2)
+def translation_orbits(N: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Orbits of the computational basis states under the translation T of a ring,
+    which shifts every spin i to i + 1 (mod N).
+    Each orbit is identified by its representative, the smallest state of the orbit
+
+    Parameters
+    ----------
+    N : int
+        Number of spins of the ring
+
+    Returns
+    -------
+    np.ndarray
+        Representative of every basis state
+    np.ndarray
+        Shift l of every basis state s, such that s = T^l representative(s)
+    np.ndarray
+        Period R of the orbit of every basis state (T^R s = s)
+    """
+    states = np.arange(2 ** N, dtype=np.int64)
+    rep = states.copy()
+    shift = np.zeros(2 ** N, dtype=np.int64)
+    period = np.zeros(2 ** N, dtype=np.int64)
+
+    rotated = states.copy()
+    for r in range(1, N + 1):
+        # Spin i -> i - 1, the most significant bit is spin 0
+        rotated = ((rotated << 1) & (2 ** N - 1)) | (rotated >> (N - 1))
+        # T^-r s is smaller than the current representative, so s = T^r (T^-r s)
+        smaller = rotated < rep
+        rep[smaller], shift[smaller] = rotated[smaller], r % N
+        # First time the orbit closes
+        closed = (rotated == states) & (period == 0)
+        period[closed] = r
+
+    return rep, shift, period
+
+
+@functools.lru_cache(maxsize=4)
+def get_momentum_basis(
+    N: int, distances: Tuple[int, ...], m: int, parity: int
+) -> Tuple[np.ndarray, List[sparse.csr_matrix]]:
+    """
+    Shared operator basis (see operators.get_basis) of a ring, restricted to the sector
+    of momentum k = 2πm/N and parity P (see parity_sectors). The momentum states are:
+            |a(k)> = 1/sqrt(R_a) Σ_{r=0}^{R_a-1} e^{-ikr} T^r|a>
+    for every representative a of period R_a such that k*R_a is a multiple of 2π.
+    Since every term maps a basis state into another (b' = T^l b), the matrix elements are:
+            <b(k)|H|a(k)> = Σ_terms c * e^{ikl} sqrt(R_a/R_b)
+
+    Parameters
+    ----------
+    N : int
+        Number of spins of the ring
+    distances : Tuple[int]
+        Distances of the sigma_x*sigma_x interactions
+    m : int
+        Index of the momentum k = 2πm/N
+    parity : int
+        0 for the sector P = +1, 1 for the sector P = -1
+
+    Returns
+    -------
+    np.ndarray
+        Representatives of the momentum states of the sector
+    List[scipy.sparse.csr_matrix]
+        List of the sparse blocks of the operators
+    """
+    rep, shift, period = translation_orbits(N)
+    states = parity_sectors(N)[parity]
+
+    # Representatives of the orbits that are compatible with the momentum
+    reps = states[(rep[states] == states) & ((m * period[states]) % N == 0)]
+    dim = len(reps)
+
+    position = np.full(2 ** N, -1, dtype=np.int64)
+    position[reps] = np.arange(dim)
+
+    k = 2 * np.pi * m / N
+    # Blocks are real for k = 0, π
+    dtype = np.float64 if (2 * m) % N == 0 else np.complex128
+
+    basis = [sparse.diags(operators.z_diagonal(N)[reps].astype(dtype), format="csr")]
+    for distance in distances:
+        rows, cols, vals = [], [], []
+        for mask in operators.xx_masks(N, distance, ring=True):
+            flipped = reps ^ mask
+            b = position[rep[flipped]]
+            # Terms ending in orbits not compatible with k vanish
+            allowed = b >= 0
+            phases = np.exp(1j * k * shift[flipped[allowed]])
+            if dtype == np.float64:
+                phases = np.real(phases)
+            rows.append(b[allowed])
+            cols.append(np.arange(dim)[allowed])
+            vals.append(
+                phases * np.sqrt(period[reps[allowed]] / period[rep[flipped[allowed]]])
+            )
+        rows = np.concatenate(rows) if len(rows) > 0 else np.zeros(0, dtype=np.int64)
+        cols = np.concatenate(cols) if len(cols) > 0 else np.zeros(0, dtype=np.int64)
+        vals = np.concatenate(vals) if len(vals) > 0 else np.zeros(0, dtype=dtype)
+        basis.append(sparse.csr_matrix((vals.astype(dtype), (rows, cols)), shape=(dim, dim)))
+
+    return reps, basis
+
+
+def momentum_block(
+    grid: operators.operator_grid, idx: int, m: int, parity: int
+) -> Tuple[np.ndarray, sparse.csr_matrix]:
+    """
+    Block of the idx-th Hamiltonian of a grid of rings in the sector (k = 2πm/N, P)
+
+    Parameters
+    ----------
+    grid : operators.operator_grid
+        Grid of the Hamiltonians (ring = True)
+    idx : int
+        Index of the point of the grid
+    m : int
+        Index of the momentum k = 2πm/N
+    parity : int
+        0 for the sector P = +1, 1 for the sector P = -1
+
+    Returns
+    -------
+    np.ndarray
+        Representatives of the momentum states of the sector
+    scipy.sparse.csr_matrix
+        Sparse block of the Hamiltonian
+    """
+    if not grid.ring:
+        raise ValueError("Momentum sectors are only defined for ring = True")
+
+    reps, basis = get_momentum_basis(grid.N, grid.distances, m, parity)
+
+    H = grid.coefficients[idx, 0] * basis[0]
+    for coeff, op in zip(grid.coefficients[idx, 1:], basis[1:]):
+        H = H + coeff * op
+
+    return reps, H.tocsr()
+
+
+def momentum_embed(N: int, m: int, reps: np.ndarray, vecs: List[List[Number]]) -> np.ndarray:
+    """
+    Write eigenvectors of a momentum sector in the full computational basis:
+            <s|psi> = v_a e^{-ikl}/sqrt(R_a)    where s = T^l a
+
+    Parameters
+    ----------
+    N : int
+        Number of spins of the ring
+    m : int
+        Index of the momentum k = 2πm/N
+    reps : np.ndarray
+        Representatives of the momentum states of the sector
+    vecs : np.ndarray
+        Array (len(reps), n) of the eigenvectors in the momentum basis
+
+    Returns
+    -------
+    np.ndarray
+        Array (2^N, n) of the eigenvectors in the full basis
+    """
+    rep, shift, period = translation_orbits(N)
+
+    position = np.full(2 ** N, -1, dtype=np.int64)
+    position[reps] = np.arange(len(reps))
+
+    states = np.arange(2 ** N)[position[rep] >= 0]
+    amplitudes = np.exp(-2j * np.pi * m * shift[states] / N) / np.sqrt(period[states])
+
+    psi = np.zeros((2 ** N, vecs.shape[1]), dtype=np.complex128)
+    psi[states, :] = vecs[position[rep[states]], :] * amplitudes[:, None]
+
+    return psi
+
+
+def momentum_grid_eigh(
+    grid: operators.operator_grid,
+    n_levels: int,
+    solver: str = "auto",
+    full_basis: bool = True,
+    indexes: List[int] = None,
+) -> Tuple[List[List[Number]], List[List[List[Number]]], List[List[Tuple[int, int]]]]:
+    """
+    Compute the n_levels lowest eigenvalues (and eigenvectors) of the Hamiltonians of a grid
+    of rings, diagonalizing separately the 2N blocks of momentum k = 2πm/N and parity P.
+    The loop goes over the sectors first, so that each block basis is built only once
+    for the whole grid
+
+    Parameters
+    ----------
+    grid : operators.operator_grid
+        Grid of the Hamiltonians (ring = True)
+    n_levels : int
+        Number of (lowest) energy levels desired
+    solver : str
+        Eigensolver backend, see general.sparse_eigh
+    full_basis : bool
+        if True the eigenvectors are written in the full computational basis (2^N),
+        if False they are not returned
+    indexes : List[int]
+        Points of the grid to diagonalize, all of them if None
+
+    Returns
+    -------
+    np.ndarray
+        Array (n_points, n_levels) of the lowest eigenvalues (sorted)
+    np.ndarray or None
+        Array (n_points, 2^N, n_levels) of the eigenvectors in the full basis
+    np.ndarray
+        Array (n_points, n_levels, 2) of the sector (m, P) of each level
+    """
+    if not grid.ring:
+        raise ValueError("Momentum sectors are only defined for ring = True")
+
+    N = grid.N
+    if indexes is None:
+        indexes = np.arange(len(grid))
+
+    eigvals = np.full((len(indexes), n_levels), np.inf)
+    sectors = np.zeros((len(indexes), n_levels, 2), dtype=np.int64)
+    eigvecs = np.zeros((len(indexes), 2 ** N, n_levels), dtype=np.complex128) if full_basis else None
+
+    for m in range(N):
+        for parity in [0, 1]:
+            for i, idx in enumerate(indexes):
+                reps, H = momentum_block(grid, idx, m, parity)
+                if len(reps) == 0:
+                    continue
+                k = min(n_levels, len(reps))
+                e, v = qmlgen.sparse_eigh(H, k, solver)
+
+                # Merge with the levels of the sectors already diagonalized
+                merged_e = np.concatenate((eigvals[i], e))
+                order = np.argsort(merged_e, kind="stable")[:n_levels]
+                eigvals[i] = merged_e[order]
+                sectors[i] = np.concatenate((sectors[i], [[m, parity]] * k))[order]
+                if full_basis:
+                    merged_v = np.concatenate((eigvecs[i], momentum_embed(N, m, reps, v)), axis=1)
+                    eigvecs[i] = merged_v[:, order]
+
+    return eigvals, eigvecs, sectors
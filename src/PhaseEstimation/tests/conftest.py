@@ -0,0 +1,12 @@
+"""Shared fixtures of the tests."""
+import pytest
+
+from PhaseEstimation import cache
+
+
+@pytest.fixture(autouse=True)
+def spectra_cache(tmp_path, monkeypatch):
+    # Every test starts from an empty cache of the exact spectra in its temporary
+    # directory, instead of the one of the user (see cache.default_path)
+    monkeypatch.setenv("PHASEESTIMATION_CACHE", str(tmp_path / "cache"))
+    monkeypatch.setattr(cache, "active_cache", cache._UNSET)
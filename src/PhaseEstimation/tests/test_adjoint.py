@@ -0,0 +1,25 @@
+"""Test the adjoint-method gradients against backpropagation."""
+import numpy as np
+import jax
+import jax.numpy as jnp
+
+from PhaseEstimation import annni_model as annni, adjoint, vqe
+
+
+def test_energy_gradient():
+    N = 4
+    grid = annni.build_Hs(N, 2, 2, ring=True)[0]
+    params = jnp.array(np.random.uniform(-np.pi, np.pi, size=(3, vqe.circuit_ising3(N, [0] * 1000))))
+    coefficients = jnp.array(grid.coefficients[:3])
+
+    energy = jax.vmap(adjoint.get_energy_fn(vqe.circuit_ising3, N, grid.expval_fn, grid.apply_fn))
+    reference = vqe._vqe_functions(vqe.circuit_ising3, N, grid.expval_fn, grid.apply_fn, "fused.qubit", "backprop")["v_energy"]
+
+    loss = lambda fn: jax.grad(lambda p, c: jnp.sum(fn(p, c)), argnums=(0, 1))(params, coefficients)
+    assert np.allclose(energy(params, coefficients), reference(params, coefficients), atol=1e-5)
+    for grad, reference_grad in zip(loss(energy), loss(reference)):
+        assert np.allclose(grad, reference_grad, atol=1e-4)
+
+
+if __name__ == "__main__":
+    test_energy_gradient()
@@ -0,0 +1,56 @@
+"""Test the on-disk cache of the exact spectra."""
+import numpy as np
+
+from PhaseEstimation import annni_model as annni, cache, hamiltonians
+
+
+def test_spectra_cache(tmp_path):
+    spectra = cache.spectra_cache(str(tmp_path), max_bytes=2 ** 20)
+    grid = annni.build_Hs(4, 2, 2)[0]
+    key = cache.grid_key(grid, 1)
+
+    assert spectra.get(key, 1) is None
+    e, psi = np.linalg.eigh(grid.dense(1))
+    spectra.put(key, e[:2], psi[:, :2])
+
+    cached_e, cached_psi = spectra.get(key, 2)
+    assert np.allclose(cached_e, e[:2]) and np.allclose(cached_psi, psi[:, :2])
+    # Less levels than requested
+    assert spectra.get(key, 3) is None
+    # Same Hamiltonian, same key
+    assert cache.matrix_key(grid.sparse(1)) == cache.matrix_key(grid.sparse(1).tocoo())
+    assert cache.grid_key(grid, 1) != cache.grid_key(grid, 2)
+
+
+def test_eviction(tmp_path):
+    spectra = cache.spectra_cache(str(tmp_path), max_bytes=4000)
+    for key in range(10):
+        spectra.put(str(key), np.zeros(2), np.zeros((32, 2)))
+
+    assert spectra.size() <= 4000
+    assert spectra.get("9", 2) is not None
+
+
+def test_point_eigh(tmp_path):
+    previous = cache.active_cache
+    try:
+        spectra = cache.set_cache(str(tmp_path))
+        grid = annni.build_Hs(4, 2, 2)[0]
+
+        # Entries of single points share the keys of the whole grid (see hamiltonians.diagonalize)
+        spectra.put(cache.grid_key(grid, 3), np.array([-1.0]), np.zeros((16, 1)))
+        assert hamiltonians.point_eigh(grid, 3, 1)[0][0] == -1.0
+
+        e = hamiltonians.point_eigh(grid, 2, 1)[0]
+        assert np.allclose(e, np.linalg.eigvalsh(grid.dense(2))[:1])
+        assert np.allclose(spectra.get(cache.grid_key(grid, 2), 1)[0], e)
+    finally:
+        cache.active_cache = previous
+
+
+if __name__ == "__main__":
+    import tempfile
+
+    test_spectra_cache(tempfile.mkdtemp())
+    test_eviction(tempfile.mkdtemp())
+    test_point_eigh(tempfile.mkdtemp())
@@ -0,0 +1,55 @@
+"""Test the checkpoints of the VQE sweeps."""
+import numpy as np
+import pytest
+
+from PhaseEstimation import hamiltonians, annni_model as annni, checkpoint, vqe
+
+
+def test_torn_frame(tmp_path):
+    filename = str(tmp_path / "sweep.ckpt")
+    log = checkpoint.checkpoint(filename, every=2)
+    log.start(dict(n_states=3))
+    for position in range(3):
+        log.append(position=position, sites=np.array([position]))
+    # The third step is still buffered
+    assert len(log.read()[1]) == 2
+
+    log.flush()
+    with open(filename, "ab") as f:
+        f.write(b"\x10\x00\x00")
+    header, records = checkpoint.checkpoint(filename).read()
+    assert header == dict(n_states=3) and [r["position"] for r in records] == [0, 1, 2]
+
+
+def test_resume(tmp_path):
+    filename = str(tmp_path / "sweep.ckpt")
+    Hs = hamiltonians.hamiltonian(annni.build_Hs, N=4, n_hs=2, n_kappas=2)
+    reference = vqe.vqe(Hs, vqe.circuit_ising_real)
+    reference.train(0.1, 2, checkpoint_file=filename, checkpoint_every=3)
+
+    # Interrupted after two sites
+    log = checkpoint.checkpoint(filename)
+    header, records = log.read()
+    log.start(header)
+    for record in records[:2]:
+        log.append(**record)
+
+    resumed = vqe.vqe(Hs, vqe.circuit_ising_real)
+    resumed.train(0.1, 2, checkpoint_file=filename, resume=True)
+    restored = Hs.recycle_rule[:2]
+    assert np.allclose(resumed.vqe_params0[restored], reference.vqe_params0[restored])
+    assert np.all(resumed.vqe_epochs == reference.vqe_epochs)
+    assert len(checkpoint.checkpoint(filename).read()[1]) == Hs.n_states
+
+    # A different learning rate, tolerance or Hamiltonian is a different sweep
+    other = hamiltonians.hamiltonian(annni.build_Hs, N=4, n_hs=2, n_kappas=2, h_max=1)
+    for Hs_resumed, kwargs in ((Hs, dict(lr=0.2)), (Hs, dict(lr=0.1, tol=1e-3)), (other, dict(lr=0.1))):
+        with pytest.raises(ValueError, match="different sweep"):
+            vqe.vqe(Hs_resumed, vqe.circuit_ising_real).train(n_epochs=2, checkpoint_file=filename, resume=True, **kwargs)
+
+
+if __name__ == "__main__":
+    import tempfile, pathlib
+
+    test_torn_frame(pathlib.Path(tempfile.mkdtemp()))
+    test_resume(pathlib.Path(tempfile.mkdtemp()))
@@ -0,0 +1,43 @@
+"""Test the mini-batch loader of the QCNN."""
+import numpy as np
+import pytest
+
+from PhaseEstimation import dataloader
+
+
+def test_batch_loader(tmp_path):
+    filename = str(tmp_path / "states.npy")
+    np.save(filename, np.arange(20.0).reshape(10, 2))
+    source = np.load(filename, mmap_mode="r")
+    rows = np.array([1, 3, 4, 6, 7, 9, 2])
+
+    loader = dataloader.batch_loader(source, rows * 10, rows, batch_size=3, seed=0)
+    assert len(loader) == 2
+    batches = list(loader.stream(4))
+    assert all(X.shape == (3, 2) for X, _ in batches)
+    for X, Y in batches:
+        assert np.allclose(X[:, 0], np.asarray(Y) / 5)
+
+    # Every pass visits distinct rows (the last incomplete batch is dropped)
+    for first, second in (batches[0:2], batches[2:4]):
+        seen = np.concatenate((first[1], second[1])) // 10
+        assert len(set(seen.tolist())) == 6 and set(seen.tolist()) <= set(rows.tolist())
+
+    # Rows are read in increasing order
+    for X, _ in batches:
+        assert np.all(np.diff(np.asarray(X[:, 0])) > 0)
+
+    # Fewer rows than one batch
+    with pytest.raises(ValueError):
+        dataloader.batch_loader(source, rows * 10, rows, batch_size=8)
+
+    # Stopping early does not leave the loader thread running
+    stream = loader.stream(100)
+    next(stream)
+    stream.close()
+
+
+if __name__ == "__main__":
+    import tempfile, pathlib
+
+    test_batch_loader(pathlib.Path(tempfile.mkdtemp()))
@@ -0,0 +1,19 @@
+"""Test the DMRG ground states against exact diagonalization."""
+import numpy as np
+
+from PhaseEstimation import annni_model as annni, dmrg
+
+
+def test_grid_dmrg():
+    grid, _, recycle_rule = annni.build_Hs(8, 3, 3)[:3]
+    energies, mps_list = dmrg.grid_dmrg(grid, recycle_rule, chi_max=16, states=True)
+    for idx in range(len(grid)):
+        mat_H = grid.dense(idx)
+        assert np.isclose(energies[idx], np.linalg.eigvalsh(mat_H)[0])
+
+        psi = dmrg.mps_state(mps_list[idx])
+        assert np.isclose(psi @ mat_H @ psi, energies[idx])
+
+
+if __name__ == "__main__":
+    test_grid_dmrg()
@@ -0,0 +1,43 @@
+"""Test the free-fermion solution against exact diagonalization."""
+import numpy as np
+
+from PhaseEstimation import hamiltonians, annni_model as annni, ising_chain as ising, free_fermions
+
+
+def test_grid_spectrum():
+    grids = [ising.build_Hs(6, 1, 5)[0], ising.build_Hs(5, 1, 5, ring=True)[0], annni.build_Hs(6, 3, 3)[0]]
+    for grid in grids:
+        free = free_fermions.is_free(grid)
+        e, _ = free_fermions.grid_spectrum(grid)
+        for k, idx in enumerate(np.arange(len(grid))[free]):
+            assert np.allclose(e[k], np.linalg.eigvalsh(grid.dense(idx))[:2])
+
+
+def test_correlators():
+    # Non-degenerate ground states (lam > 0)
+    grid = ising.build_Hs(6, 1, 5)[0]
+    _, G = free_fermions.grid_spectrum(grid, [1, 2, 3, 4])
+    psi = [np.linalg.eigh(grid.dense(idx))[1][:, 0] for idx in [1, 2, 3, 4]]
+    for k in range(1, 4):
+        assert np.isclose(free_fermions.fidelity(G[0], G[k]), np.abs(psi[0] @ psi[k]))
+
+    # <sigma^0_x*sigma^5_x> as the expectation value of the operator
+    state = np.arange(2 ** 6)
+    xx_05 = psi[2][state ^ (2 ** 5 + 1)] @ psi[2]
+    assert np.isclose(free_fermions.xx_correlation(G[2], 0, 5), xx_05)
+
+
+def test_add_true_energies():
+    # Only the energies: the free-fermionic points are not diagonalized
+    Hs = hamiltonians.hamiltonian(annni.build_Hs, N=5, n_hs=3, n_kappas=3)
+    Hs.add_true(states=False)
+    assert Hs.true_psi0 is None
+    for idx in range(Hs.n_states):
+        e = np.linalg.eigvalsh(Hs.qml_Hs.dense(idx))[:2]
+        assert np.allclose([Hs.true_e0[idx], Hs.true_e1[idx]], e)
+
+
+if __name__ == "__main__":
+    test_grid_spectrum()
+    test_correlators()
+    test_add_true_energies()
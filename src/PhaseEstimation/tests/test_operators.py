@@ -0,0 +1,56 @@
+"""Test that the operator basis matches the Pennylane Hamiltonians."""
+import pickle
+import numpy as np
+import pennylane as qml
+
+from PhaseEstimation import annni_model as annni, ising_chain as ising, operators
+
+
+def test_annni_grid():
+    psi = np.random.normal(size=2 ** 4)
+    for ring in [False, True]:
+        Hs = annni.build_Hs(4, 3, 3, ring=ring)[0]
+        for idx in range(len(Hs)):
+            mat_H = qml.matrix(Hs[idx], wire_order=range(4))
+            assert np.allclose(mat_H, Hs.dense(idx))
+            assert np.allclose(Hs.apply_fn(psi, Hs.coefficients[idx]), mat_H @ psi, atol=1e-5)
+
+
+def test_ising_grid():
+    for ring in [False, True]:
+        Hs = ising.build_Hs(5, 1, 4, ring=ring)[0]
+        for idx in range(len(Hs)):
+            mat_H = qml.matrix(Hs[idx], wire_order=range(5))
+            assert np.allclose(mat_H, Hs.dense(idx))
+
+
+def test_grid_lru():
+    Hs = annni.build_Hs(4, 3, 3)[0]
+    Hs.cache_size = 4
+    for idx in range(len(Hs)):
+        Hs.sparse(idx)
+    assert len(Hs._lru) == 4
+    assert Hs.sparse(8) is Hs.sparse(8)
+
+    # Built operators are not pickled
+    loaded = pickle.loads(pickle.dumps(Hs))
+    assert len(loaded._lru) == 0
+    assert np.allclose(loaded.dense(8), Hs.dense(8))
+
+
+def test_grid_from_hamiltonians():
+    for ring in [False, True]:
+        Hs = annni.build_Hs(5, 3, 3, ring=ring)[0]
+        grid = operators.grid_from_hamiltonians(list(Hs), 5, ring)
+        assert grid.distances == (1, 2) and np.allclose(grid.coefficients, Hs.coefficients)
+        assert np.allclose(qml.matrix(grid[4], wire_order=range(5)), Hs.dense(4))
+
+        # Pickled with the rest of the grid
+        assert np.allclose(pickle.loads(pickle.dumps(grid))[4].sparse_matrix(wire_order=range(5)).toarray(), Hs.dense(4))
+
+
+if __name__ == "__main__":
+    test_annni_grid()
+    test_ising_grid()
+    test_grid_lru()
+    test_grid_from_hamiltonians()
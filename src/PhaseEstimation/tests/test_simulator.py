@@ -0,0 +1,80 @@
+"""Test the fused-layer simulator against default.qubit."""
+import numpy as np
+import pennylane as qml
+import jax
+
+from PhaseEstimation import simulator, vqe, qcnn
+
+
+def _circuits(device, N):
+    @qml.qnode(device, interface="jax")
+    def state(params):
+        vqe.circuit_ising(N, params)
+        qml.CZ(wires=[0, 2])
+        qml.SWAP(wires=[1, 3])
+
+        return qml.state()
+
+    @qml.qnode(device, interface="jax")
+    def energy(params):
+        vqe.circuit_ising(N, params)
+
+        return qml.expval(qml.PauliZ(0) @ qml.PauliZ(1) + qml.PauliX(2))
+
+    return jax.jit(jax.vmap(state)), jax.jit(jax.grad(energy))
+
+
+def test_fused_qubit():
+    N = 4
+    params = np.random.uniform(-np.pi, np.pi, size=(3, vqe.circuit_ising(N, [0] * 1000)))
+    state, grad = _circuits(qml.device("default.qubit.jax", wires=N), N)
+    fused_state, fused_grad = _circuits(simulator.fused_qubit(wires=N), N)
+
+    assert np.allclose(state(params), fused_state(params), atol=1e-5)
+    assert np.allclose(grad(params[0]), fused_grad(params[0]), atol=1e-5)
+
+
+def test_real_amplitudes():
+    N = 4
+    params = np.random.uniform(-np.pi, np.pi, size=vqe.circuit_ising_real(N, [0] * 1000))
+    states = []
+    for device in [qml.device("default.qubit.jax", wires=N), simulator.fused_qubit(wires=N)]:
+
+        @qml.qnode(device, interface="jax")
+        def state(params):
+            vqe.circuit_ising_real(N, params)
+
+            return qml.state()
+
+        states.append(state(params))
+
+    assert not np.iscomplexobj(states[1])
+    assert np.allclose(states[0], states[1], atol=1e-5)
+
+
+def test_reduced_qcnn():
+    N = 6
+    n_params, active_wires = qcnn.qcnn_circuit([0] * 1000, N, 2)
+    params = np.random.uniform(-np.pi, np.pi, size=n_params)
+    psi = np.random.normal(size=2 ** N) + 1j * np.random.normal(size=2 ** N)
+    probs, grads = [], []
+    for device in [qml.device("default.qubit.jax", wires=N), simulator.fused_qubit(wires=N)]:
+
+        @qml.qnode(device, interface="jax")
+        def circuit(params):
+            qml.StatePrep(psi / np.linalg.norm(psi), wires=range(N))
+            qcnn.qcnn_circuit(params, N, 2)
+
+            return [qml.probs(wires=int(k)) for k in active_wires]
+
+        probs.append(np.array(circuit(params)))
+        grads.append(jax.grad(lambda p: circuit(p)[0][1])(params))
+
+    assert np.allclose(probs[0], probs[1], atol=1e-5)
+    assert np.allclose(grads[0], grads[1], atol=1e-5)
+
+
+if __name__ == "__main__":
+    test_fused_qubit()
+    test_real_amplitudes()
+    test_reduced_qcnn()
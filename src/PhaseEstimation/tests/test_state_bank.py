@@ -0,0 +1,30 @@
+"""Test the bank of the VQE states."""
+import numpy as np
+import jax.numpy as jnp
+
+from PhaseEstimation import hamiltonians, annni_model as annni, vqe
+
+
+def test_state_bank(tmp_path):
+    Hs = hamiltonians.hamiltonian(annni.build_Hs, N=4, n_hs=3, n_kappas=2)
+    vqeclass = vqe.vqe(Hs, vqe.circuit_ising)
+    states = np.asarray(vqeclass.jv_q_vqe_state(jnp.array(vqeclass.vqe_params0)))
+
+    bank = vqeclass.state_bank()
+    assert np.allclose(bank.states, states, atol=1e-6)
+    assert vqeclass.state_bank() is bank
+
+    # Memory-mapped states, reused by a new bank of the same parameters
+    mapped = vqeclass.state_bank(str(tmp_path))
+    assert isinstance(mapped.states, np.memmap) and np.allclose(mapped[2:4], states[2:4], atol=1e-6)
+    assert len(list(tmp_path.glob("*.states.npy"))) == 1
+
+    # New parameters, new states
+    vqeclass.vqe_params0 = np.zeros_like(vqeclass.vqe_params0)
+    assert vqeclass.state_bank() is not bank
+
+
+if __name__ == "__main__":
+    import tempfile, pathlib
+
+    test_state_bank(pathlib.Path(tempfile.mkdtemp()))
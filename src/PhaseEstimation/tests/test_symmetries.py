@@ -0,0 +1,55 @@
+"""Test that the symmetry-sector diagonalization matches the full one."""
+import numpy as np
+
+from PhaseEstimation import annni_model as annni, ising_chain as ising, symmetries, hamiltonians
+
+
+def test_parity_eigh():
+    grids = [annni.build_Hs(6, 3, 3)[0], ising.build_Hs(6, 1, 3, ring=True)[0]]
+    for grid in grids:
+        for idx in range(len(grid)):
+            mat_H = grid.dense(idx)
+            eigvals = np.linalg.eigvalsh(mat_H)[:3]
+
+            e, psi, _ = symmetries.parity_eigh(grid, idx, 3)
+            assert np.allclose(e, eigvals, atol=1e-4)
+            assert np.allclose(mat_H @ psi, psi * e, atol=1e-4)
+
+
+def test_momentum_eigh():
+    for grid in [annni.build_Hs(6, 2, 2, ring=True)[0], ising.build_Hs(5, 1, 3, ring=True)[0]]:
+        e, psi, _ = symmetries.momentum_grid_eigh(grid, 3)
+        for idx in range(len(grid)):
+            mat_H = grid.dense(idx)
+            eigvals = np.linalg.eigvalsh(mat_H)[:3]
+
+            assert np.allclose(e[idx], eigvals, atol=1e-4)
+            assert np.allclose(mat_H @ psi[idx], psi[idx] * e[idx], atol=1e-4)
+
+
+def test_dense_blocks():
+    Hs = hamiltonians.hamiltonian(annni.build_Hs, N=6, n_hs=2, n_kappas=2, ring=True)
+    for options in [dict(parity=True), dict(momentum=True)]:
+        e, psi = hamiltonians.diagonalize(Hs, 3, solver="dense", n_jobs=1, **options)
+        for idx in range(len(e)):
+            mat_H = Hs.qml_Hs.dense(idx)
+            eigvals = np.linalg.eigvalsh(mat_H)[:3]
+
+            assert np.allclose(e[idx], eigvals, atol=1e-4)
+            assert np.allclose(mat_H @ psi[idx], psi[idx] * e[idx], atol=1e-4)
+
+
+def test_energies_only():
+    Hs = hamiltonians.hamiltonian(annni.build_Hs, N=6, n_hs=2, n_kappas=2, ring=True)
+    for options in [dict(solver="dense"), dict(solver="lanczos"), dict(solver="lanczos", momentum=True)]:
+        e, psi = hamiltonians.diagonalize(Hs, 3, n_jobs=1, states=False, **options)
+        assert psi is None
+        for idx in range(len(e)):
+            assert np.allclose(e[idx], np.linalg.eigvalsh(Hs.qml_Hs.dense(idx))[:3], atol=1e-4)
+
+
+if __name__ == "__main__":
+    test_parity_eigh()
+    test_momentum_eigh()
+    test_dense_blocks()
+    test_energies_only()
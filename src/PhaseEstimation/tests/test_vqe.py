@@ -0,0 +1,37 @@
+"""Test the VQE training modes and the VQE files shipped with the repository."""
+import os
+import numpy as np
+import jax.numpy as jnp
+
+from PhaseEstimation import hamiltonians, annni_model as annni, operators, vqe
+
+DATA = os.path.join(os.path.dirname(__file__), "..", "..", "..", "data", "vqes")
+
+
+def test_load_legacy():
+    # Saved before the operator grids: the Hamiltonians are a list of Pennylane Hamiltonians
+    loaded = vqe.load_vqe(os.path.join(DATA, "standard", "N8n100"))
+    grid = loaded.Hs.qml_Hs
+    assert isinstance(grid, operators.operator_grid) and grid.distances == (1,)
+
+    # Energies of the stored parameters
+    sites = np.array([0, 37, 99])
+    psi = np.asarray(loaded.jv_q_vqe_state(jnp.array(loaded.vqe_params0[sites])))
+    e = [np.real(np.vdot(p, grid.sparse(site) @ p)) for p, site in zip(psi, sites)]
+    assert np.allclose(e, np.asarray(loaded.vqe_e0)[sites], atol=1e-4)
+
+    # Training restarts from the loaded parameters
+    loaded.train_sites(1e-3, 2, sites)
+    assert np.all(np.isfinite(np.asarray(loaded.vqe_e0)[sites]))
+
+
+def test_batched_true_e0():
+    Hs = hamiltonians.hamiltonian(annni.build_Hs, N=4, n_hs=2, n_kappas=2)
+    vqeclass = vqe.vqe(Hs, vqe.circuit_ising_real)
+    vqeclass.train_batched(0.1, 2, batch_size=3)
+    assert np.allclose(vqeclass.true_e0, Hs.true_e0) and np.all(vqeclass.true_e0 < 0)
+
+
+if __name__ == "__main__":
+    test_load_legacy()
+    test_batched_true_e0()
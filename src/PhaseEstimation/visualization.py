@@ -13,7 +13,7 @@ import plotly.graph_objects as go
 from tqdm.auto import tqdm
 
 from PhaseEstimation import general as qmlgen
-from PhaseEstimation import losses
+from PhaseEstimation import free_fermions
 
 from typing import List, Callable
 
@@ -221,8 +221,8 @@ def VQE_show_isingchain(vqeclass):
     vqeclass : vqe.vqe
         Custom VQE class after being trained
     """
-    # Exit if the VQE was not trained for excited states
-    true_e = vqeclass.true_e0
+    # Exact energies of the chain (free fermions)
+    true_e = free_fermions.grid_spectrum(vqeclass.Hs.qml_Hs)[0][:, 0]
     vqe_e = vqeclass.vqe_e0
     title = "Ground States of Ising Hamiltonian ({0}-spins), J = {1}"
 
@@ -342,17 +342,9 @@ def VQE_psi_truepsi_fidelity(vqeclass, phase_lines = False, pe_line = False):
     sidex = vqeclass.Hs.n_kappas
     sidey = vqeclass.Hs.n_hs
 
-    # Prepare the quantum circuit to output the state
-    @qml.qnode(vqeclass.device, interface="jax")
-    def q_vqe_state(vqe_params):
-        vqeclass.circuit(vqe_params)
-
-        return qml.state()
-
-    # Jit and vmapped function to compute the fidelity
-    jv_fidelity = jax.jit(lambda true, pars: losses.vqe_fidelities(true, pars, q_vqe_state))
-    
-    fidelity_map = jv_fidelity(vqeclass.Hs.true_psi0, vqeclass.vqe_params0) 
+    # VQE states from the state bank (see vqe.state_bank)
+    psi = jnp.array(vqeclass.state_bank().states)
+    fidelity_map = jnp.square(jnp.abs(jnp.sum(jnp.conj(psi) * vqeclass.Hs.true_psi0, axis=1)))
     fidelity_map = np.reshape(fidelity_map, (sidex, sidey))
 
     plot_layout(vqeclass.Hs, phase_lines=phase_lines, pe_line=pe_line, title=r"Fidelities,     $N = {0}$".format(str(vqeclass.Hs.N)))
@@ -459,14 +451,8 @@ def VQE_fidelity_slice(vqeclass, slice_value, axis = 0, truestates = False):
             vqeclass.Hs.add_true()
         confusion = create_confusion_matrix(np.array(vqeclass.Hs.true_psi0)[indexes])
     else:
-        # Quantum circuit for computing the states from the parameters
-        @qml.qnode(vqeclass.device, interface="jax")
-        def q_vqe_state(vqe_params):
-            vqeclass.circuit(vqe_params)
-
-            return qml.state()
-
-        vqe_psi0 = jax.jit(jax.vmap(q_vqe_state, in_axes=(0)))(vqeclass.vqe_params0[indexes])
+        # VQE states from the state bank (see vqe.state_bank)
+        vqe_psi0 = vqeclass.state_bank()[indexes]
         confusion = create_confusion_matrix(vqe_psi0)
 
     leg = plt.legend(
@@ -504,15 +490,8 @@ def QCNN_classification_ising(qcnnclass, train_index):
         List of the indexes of the training set. On displaying they will be marked with a different colour
     """
 
-    # Quantum Circuit to output the probabilities
-    @qml.qnode(qcnnclass.device, interface="jax")
-    def qcnn_circuit_prob(params_vqe, params):
-        qcnnclass._vqe_qcnn_circuit(params_vqe, params)
-
-        return qml.probs(wires=qcnnclass.N - 1)
-
-    vcircuit = jax.vmap(lambda v: qcnn_circuit_prob(v, qcnnclass.params), in_axes=(0))
-    predictions = vcircuit(qcnnclass.vqe_params)[:, 1]
+    # Probabilities of the output wire (N - 1), see qcnn.qcnn.jv_qcnn_probs
+    predictions = qcnnclass.jv_qcnn_probs(qcnnclass.states[:], jnp.array(qcnnclass.params))[:, 1]
     
     # The test index is the set difference of the whole dataset and the training set
     test_index = np.setdiff1d(np.arange(len(qcnnclass.vqe_params)), train_index)
@@ -600,30 +579,25 @@ def QCNN_classification_ANNNI_marginal(qcnnclass):
         Custom QCNN class after being trained
     """
 
-    @qml.qnode(qcnnclass.device, interface="jax")
-    def qcnn_circuit_prob(params_vqe, params):
-        qcnnclass._vqe_qcnn_circuit(params_vqe, params)
-
-        return [qml.probs(wires=int(k)) for k in qcnnclass.final_active_wires]
-
     # Subset of the states on the two axes
     mask1 = jnp.array(qcnnclass.vqe.Hs.model_params)[:, 1] == 0
     mask2 = jnp.array(qcnnclass.vqe.Hs.model_params)[:, 2] == 0
     
     ising_1, label_1, x1 = (
-        qcnnclass.vqe_params[mask1],
+        qcnnclass.states[np.array(mask1)],
         qcnnclass.labels[mask1, :].astype(int),
         np.arange( len(mask1[mask1 == True]) )
     )
     ising_2, label_2, x2 = (
-        qcnnclass.vqe_params[mask2],
+        qcnnclass.states[np.array(mask2)],
         qcnnclass.labels[mask2, :].astype(int),
         np.arange( len(mask2[mask2 == True]) )
     )
 
-    vcircuit = jax.vmap(lambda v: qcnn_circuit_prob(v, qcnnclass.params), in_axes=(0))
-    predictions1 = vcircuit(ising_1)
-    predictions2 = vcircuit(ising_2)
+    # Probabilities of each output wire, see qcnn.qcnn.jv_qcnn_marginals
+    params = jnp.array(qcnnclass.params)
+    predictions1 = qcnnclass.jv_qcnn_marginals(ising_1, params)
+    predictions2 = qcnnclass.jv_qcnn_marginals(ising_2, params)
 
     out1_p1, out2_p1, c1 = [], [], []
     for idx, pred in enumerate(predictions1):
@@ -795,15 +769,15 @@ def ENC_show_compression_ANNNI(encclass, trainingpoint=False, label=False, plot3
     x = np.linspace(-max_x, 0, sidex)
     y = np.linspace(0, max_y, sidey)
 
-    X = jnp.array(encclass.vqe_params0)
+    X = encclass.states[:]
 
     @qml.qnode(encclass.device, interface="jax")
-    def encoder_circuit(vqe_params, params):
-        encclass._vqe_enc_circuit(vqe_params, params)
+    def encoder_circuit(psi, params):
+        encclass._vqe_enc_circuit(psi, params)
 
         return [qml.expval(qml.PauliZ(int(k))) for k in encclass.wires_trash]
 
-    v_encoder_circuit = jax.vmap(lambda p: encoder_circuit(p, encclass.params))
+    v_encoder_circuit = jax.vmap(lambda p: jnp.stack(encoder_circuit(p, encclass.params)))
 
     exps = (1 - np.sum(v_encoder_circuit(X), axis=1) / 4) / 2
 
@@ -6,6 +6,7 @@ import jax.numpy as jnp
 from jax.example_libraries import optimizers
 
 import copy
+import threading
 from tqdm.auto import tqdm
 import pickle  # Writing and loading
 
@@ -16,16 +17,19 @@ warnings.filterwarnings(
     message="For Hamiltonians, the eigenvalues will be computed numerically. This may be computationally intensive for a large number of wires.Consider using a sparse representation of the Hamiltonian with qml.SparseHamiltonian.",
 )
 
-from PhaseEstimation import circuits, losses, hamiltonians
-from PhaseEstimation import general as qmlgen
+from PhaseEstimation import circuits, losses, hamiltonians, free_fermions, compilation, simulator, adjoint
+from PhaseEstimation import checkpoint as ckpt, state_bank as sbank, operators, cache
 from PhaseEstimation import annni_model as annni, ising_chain as ising
 from PhaseEstimation import visualization as qplt
 
-from typing import List, Callable
+from typing import List, Callable, Tuple, Union
 from numbers import Number
 
 ##############
 
+# Maximum budget of a site in the adaptive training, in units of n_epochs
+MAX_BUDGET_FACTOR = 4
+
 
 def circuit_ising(N: int, params: List[Number]) -> int:
     """
@@ -124,8 +128,237 @@ def circuit_ising3(N: int, params: List[Number]) -> int:
     return index
 
 
+def circuit_ising_real(N: int, params: List[Number]) -> int:
+    """
+    Real version of circuit_ising, without the final RX rotations.
+    Every gate (Hadamard, CNOT, RY) is real, as the ground states of the ANNNI
+    and Ising Hamiltonians, hence the circuit is simulated with real amplitudes
+    (see simulator.is_real)
+    Number of parameters (gates): 6*N
+
+    Parameters
+    ----------
+    N : int
+        Number of qubits
+    params: np.ndarray
+        Array of parameters/rotation for the circuit
+
+    Returns
+    -------
+    int
+        Total number of parameters needed to build this circuit
+    """
+    active_wires = np.arange(N)
+    index = 0
+    qml.Barrier()
+    for _ in range(6):
+        index = circuits.circuit_ID9(active_wires, params, index)
+        qml.Barrier()
+
+    return index
+
+
+def get_device(device: str, N: int) -> Union[qml.Device, simulator.fused_qubit]:
+    """
+    Statevector simulator of N qubits
+
+    Parameters
+    ----------
+    device : str
+        'fused.qubit' (see simulator.fused_qubit) or the name of a Pennylane device (e.g. 'default.qubit.jax')
+    N : int
+        Number of qubits
+
+    Returns
+    -------
+    Pennylane device
+        Device of the circuits
+    """
+    if device == "fused.qubit":
+        return simulator.fused_qubit(wires=N)
+
+    return qml.device(device, wires=N, shots=None)
+
+
+def _vqe_functions(
+    circuit_fun: Callable, N: int, expval_fn: Callable, apply_fn: Callable, device: str, diff_method: str
+) -> dict:
+    """
+    Build the device, the qnodes and the jitted functions of a VQE
+
+    Parameters
+    ----------
+    circuit_fun : function
+        Function of the VQE circuit
+    N : int
+        Number of qubits
+    expval_fn : function
+        Matrix-free expectation values of the operator basis (see operators.get_expval_fn)
+    apply_fn : function
+        Matrix-free action of the Hamiltonians (see operators.get_apply_fn)
+    device : str
+        Name of the simulator (see get_device)
+    diff_method : str
+        Gradients of the energies: 'backprop' (reverse mode through the simulation)
+        or 'adjoint' (see adjoint.get_energy_fn)
+
+    Returns
+    -------
+    dict
+        Dictionary of the functions, they become attributes of the VQE class
+    """
+    device = get_device(device, N)
+    circuit = lambda p: circuit_fun(N, p)
+
+    ### STATES FUNCTIONS ###
+    # QCircuit: CIRCUIT(params) -> PSI
+    @qml.qnode(device, interface="jax")
+    def q_vqe_state(vqe_params):
+        circuit(vqe_params)
+
+        return qml.state()
+
+    v_q_vqe_state = jax.vmap(
+        lambda v: q_vqe_state(v), in_axes=(0)
+    )  # vmap of the state circuit
+    jv_q_vqe_state = jax.jit(
+        v_q_vqe_state
+    )  # jitted vmap of the state circuit
+    j_q_vqe_state = jax.jit(lambda p: q_vqe_state(p))  # jitted state circuit
+
+    # For updating progress bar on fidelity between true states and vqe states
+    jv_fidelties = jax.jit(
+        lambda true, pars: losses.vqe_fidelities(true, pars, q_vqe_state)
+    )
+
+    ### ENERGY FUNCTIONS ###
+    # Computes <psi|H|psi> directly on the statevector, where the Hamiltonian
+    # is given by its coefficients on the operator basis of the grid
+    # (see operators.get_expval_fn), no Hamiltonian matrix is needed
+    def compute_vqe_E(state, H_coeffs):
+        return jnp.dot(expval_fn(state), H_coeffs)
+
+    j_compute_vqe_E = jax.jit(compute_vqe_E)
+    v_compute_vqe_E = jax.vmap(compute_vqe_E, in_axes=(0, 0))
+    jv_compute_vqe_E = jax.jit(v_compute_vqe_E)
+
+    # Energies of a batch of sites, the function differentiated by the training:
+    # > backprop: every intermediate state of the simulation is kept for the gradient
+    # > adjoint: the gradient walks the circuit backwards gate by gate, the memory
+    #            does not grow with the depth of the circuit (see adjoint)
+    if diff_method == "backprop":
+        # Cast as real because energies are supposed to be it
+        v_energy = lambda params, Hs: jnp.real(v_compute_vqe_E(v_q_vqe_state(params), Hs))
+    elif diff_method == "adjoint":
+        v_energy = jax.vmap(adjoint.get_energy_fn(circuit_fun, N, expval_fn, apply_fn))
+    else:
+        raise ValueError("Unknown diff_method: {0}".format(diff_method))
+
+    # Loss function: LOSS = 1/n_states SUM_i ( ENERGY(psi_i) )
+    # Hs is the batch of the coefficients of the Hamiltonians
+    def loss(params, Hs):
+        return jnp.mean(v_energy(params, Hs))
+
+    # Grad function, used in updating the parameters
+    jd_loss = jax.jit(jax.grad(loss))
+
+    # Whole optimization of a batch of sites compiled in a single XLA program:
+    # the epochs are a lax.while_loop carrying the Adam state and the history of the loss.
+    # Each site stops (its parameters are frozen) as soon as one of the tolerances
+    # tols = [energy change, gradient norm, relative error wrt true_e] is met, the loop
+    # ends when every site stopped or after n_epochs.
+    # n_epochs is traced, only the length of the history buffer is static
+    def optimize(params, Hs, true_e, lr, n_epochs, tols, history):
+        opt_init, opt_update, get_params = optimizers.adam(lr)
+        tol, grad_tol, acc_tol = tols[0], tols[1], tols[2]
+
+        def energies(params):
+            vqe_e = v_energy(params, Hs)
+
+            return jnp.sum(vqe_e), vqe_e
+
+        def cond(carry):
+            epoch, _, _, _, active, _ = carry
+
+            return (epoch < n_epochs) & jnp.any(active)
+
+        def body(carry):
+            epoch, opt_state, losses, prev_e, active, site_epochs = carry
+            (_, vqe_e), grads = jax.value_and_grad(energies, has_aux=True)(get_params(opt_state))
+
+            converged = (
+                (jnp.abs(vqe_e - prev_e) < tol)
+                | (jnp.linalg.norm(grads, axis=1) < grad_tol)
+                | (jnp.abs((vqe_e - true_e) / true_e) < acc_tol)
+            )
+            active = active & jnp.logical_not(converged)
+
+            # Only the active sites are updated
+            new_state = opt_update(0, grads, opt_state)
+            opt_state = jax.tree_util.tree_map(
+                lambda new, old: jnp.where(active[:, None], new, old), new_state, opt_state
+            )
+            losses = losses.at[jnp.minimum(epoch, history - 1)].set(jnp.mean(vqe_e))
+
+            return epoch + 1, opt_state, losses, vqe_e, active, site_epochs + active
+
+        n_sites = params.shape[0]
+        carry = (
+            0,
+            opt_init(params),
+            jnp.full((history,), jnp.nan),
+            jnp.full((n_sites,), jnp.inf),
+            jnp.ones((n_sites,), dtype=bool),
+            jnp.zeros((n_sites,), dtype=int),
+        )
+        epoch, opt_state, losses, _, _, site_epochs = jax.lax.while_loop(cond, body, carry)
+
+        return get_params(opt_state), losses, epoch, site_epochs
+
+    j_optimize = jax.jit(optimize, static_argnums=6)
+
+    # Adam step of train_batched on a batch of sites, with the coupling
+    #       smoothness * Σ_(i,j) Σ_k (1 - cos(params_i[k] - params_j[k]))
+    # of the neighbouring pairs of the batch. lr and smoothness are traced
+    def batched_step(lr, smoothness, epoch, opt_state, Hs, pairs):
+        _, opt_update, get_params = optimizers.adam(lr)
+
+        def batch_loss(params):
+            coupling = jnp.sum(1 - jnp.cos(params[pairs[:, 0]] - params[pairs[:, 1]]))
+
+            # Sum, not mean, so that the gradient of each site does not depend on the batch
+            return jnp.sum(v_energy(params, Hs)) + smoothness * coupling
+
+        grads = jax.grad(batch_loss)(get_params(opt_state))
+
+        return opt_update(epoch, grads, opt_state)
+
+    j_batched_step = jax.jit(batched_step)
+
+    return dict(
+        device=device,
+        v_q_vqe_state=v_q_vqe_state,
+        jv_q_vqe_state=jv_q_vqe_state,
+        j_q_vqe_state=j_q_vqe_state,
+        jv_fidelties=jv_fidelties,
+        j_compute_vqe_E=j_compute_vqe_E,
+        v_compute_vqe_E=v_compute_vqe_E,
+        jv_compute_vqe_E=jv_compute_vqe_E,
+        v_energy=v_energy,
+        jd_loss=jd_loss,
+        j_optimize=j_optimize,
+        j_batched_step=j_batched_step,
+    )
+
+
 class vqe:
-    def __init__(self, Hs: hamiltonians.hamiltonian, circuit: Callable):
+    def __init__(
+        self,
+        Hs: hamiltonians.hamiltonian,
+        circuit: Callable,
+        device: str = "default.qubit.jax",
+        diff_method: str = "backprop",
+    ):
         """
         Class for the VQE algorithm
 
@@ -135,6 +368,11 @@ class vqe:
             Custom Hamiltonian class
         circuit : function
             Function of the VQE circuit
+        device : str
+            Statevector simulator, shared with the QCNN and the encoder (see get_device):
+            'default.qubit.jax' or 'fused.qubit' (fused layers, reduced-state QCNN, see simulator)
+        diff_method : str
+            Gradients of the energies, 'backprop' or 'adjoint' (less memory for deep circuits and large N)
         """
         self.Hs = Hs
         self.circuit = lambda p: circuit(self.Hs.N, p)
@@ -146,48 +384,18 @@ class vqe:
         self.vqe_params0 = jnp.array(
             np.random.uniform(-np.pi, np.pi, size=(self.Hs.n_states, self.n_params))
         )
-        self.device = qml.device("default.qubit.jax", wires=self.Hs.N, shots=None)
-
-        ### STATES FUNCTIONS ###
-        # QCircuit: CIRCUIT(params) -> PSI
-        @qml.qnode(self.device, interface="jax")
-        def q_vqe_state(vqe_params):
-            self.circuit(vqe_params)
-
-            return qml.state()
-
-        self.v_q_vqe_state = jax.vmap(
-            lambda v: q_vqe_state(v), in_axes=(0)
-        )  # vmap of the state circuit
-        self.jv_q_vqe_state = jax.jit(
-            self.v_q_vqe_state
-        )  # jitted vmap of the state circuit
-        self.j_q_vqe_state = jax.jit(lambda p: q_vqe_state(p))  # jitted state circuit
-
-        # For updating progress bar on fidelity between true states and vqe states
-        self.jv_fidelties = jax.jit(
-            lambda true, pars: losses.vqe_fidelities(true, pars, q_vqe_state)
+        # The circuits and their jitted functions are shared by every VQE with the same
+        # circuit, number of spins and operator basis (see compilation.get_compiled)
+        grid = self.Hs.qml_Hs
+        key = ("vqe", circuit, self.Hs.N, grid.distances, grid.ring, device, diff_method)
+        functions = compilation.get_compiled(
+            key,
+            lambda: _vqe_functions(
+                circuit, self.Hs.N, grid.expval_fn, grid.apply_fn, device, diff_method
+            ),
         )
-
-        ### ENERGY FUNCTIONS ###
-        # Computes <psi|H|psi>
-        def compute_vqe_E(state, Hmat):
-            return jnp.real(jnp.conj(state) @ Hmat @ state)
-
-        self.j_compute_vqe_E = jax.jit(compute_vqe_E)
-        self.v_compute_vqe_E = jax.vmap(compute_vqe_E, in_axes=(0, 0))
-        self.jv_compute_vqe_E = jax.jit(self.v_compute_vqe_E)
-
-        # Loss function: LOSS = 1/n_states SUM_i ( ENERGY(psi_i) )
-        def loss(params, Hs):
-            pred_states = self.v_q_vqe_state(params)
-            vqe_e = self.v_compute_vqe_E(pred_states, Hs)
-
-            # Cast as real because energies are supposed to be it
-            return jnp.mean(jnp.real(vqe_e))
-
-        # Grad function, used in updating the parameters
-        self.jd_loss = jax.jit(jax.grad(loss))
+        for name, function in functions.items():
+            setattr(self, name, function)
 
     def __repr__(self):
         # QCircuit just for printing it
@@ -200,11 +408,28 @@ class vqe:
 
         return qml.draw(vqe_state)(self)
 
-    def _update(self, params, Hs_batch, opt_state, opt_update, get_params):
-        grads = self.jd_loss(params, Hs_batch)
-        opt_state = opt_update(0, grads, opt_state)
+    def state_bank(self, path: Union[str, None] = None) -> sbank.state_bank:
+        """
+        Bank of the VQE states of every site (see state_bank.state_bank), the input of the
+        QCNN and the encoder. The bank is built again only when vqe_params0 changes
+
+        Parameters
+        ----------
+        path : str
+            Directory of the memory-mapped states (None: states kept in memory)
+
+        Returns
+        -------
+        state_bank.state_bank
+            Bank of the states
+        """
+        bank = getattr(self, "_state_bank", None)
+        if bank is None or not bank.matches(self.vqe_params0, path):
+            name = repr((self.circuit_fun.__module__, self.circuit_fun.__name__, self.Hs.N))
+            bank = sbank.state_bank(self.jv_q_vqe_state, self.vqe_params0, name, path)
+            self._state_bank = bank
 
-        return get_params(opt_state), opt_state
+        return bank
 
     def _get_neighbours(self, idx: int) -> List[Number]:
         """
@@ -242,47 +467,337 @@ class vqe:
             Neighbouring indexes
         """
 
-        side_x = self.Hs.n_kappas
+        neighbours = self._neighbours_table()[idx]
+
+        return neighbours[neighbours >= 0]
+
+    def _neighbours_table(self) -> np.ndarray:
+        """
+        Neighbouring indexes (up, down, left, right) of every state of the grid,
+        see _get_neighbours. Missing neighbours (borders of the grid, sites outside the
+        recycle rule) are -1
+
+        Returns
+        -------
+        np.ndarray
+            Array (n_states, 4) of the neighbouring indexes
+        """
         side_y = self.Hs.n_hs
+        idx = np.arange(self.Hs.n_states)
 
-        neighbours = np.array([idx + 1, idx - 1, idx + side_y, idx - side_y])
-        neighbours = np.delete(
-            neighbours, np.logical_not(np.isin(neighbours, self.Hs.recycle_rule))
-        )
+        neighbours = np.stack((idx + 1, idx - 1, idx + side_y, idx - side_y), axis=1)
+        missing = np.logical_not(np.isin(neighbours, self.Hs.recycle_rule))
+        # Up and down only inside the same column
+        missing[:, 0] |= (idx + 1) % side_y == 0
+        missing[:, 1] |= idx % side_y == 0
 
-        if (idx + 1) % side_y == 0 and idx != self.Hs.n_states - 1:
-            neighbours = np.delete(neighbours, 0)
-        if (idx) % side_y == 0 and idx != 0:
-            neighbours = np.delete(neighbours, 1)
+        return np.where(missing, -1, neighbours)
 
-        return neighbours
+    def warm_up(
+        self, n_epochs: int, batch_sizes: List[int] = [1], background: bool = True
+    ) -> Union[threading.Thread, None]:
+        """
+        Compile the training functions ahead of their use (see compilation.warm_up),
+        e.g. while the true energies are computed
 
-    def train_site(self, lr: Number, n_epochs: int, site: int):
+        Parameters
+        ----------
+        n_epochs : int
+            Number of epochs of the training (the first site is trained for 10 * n_epochs)
+        batch_sizes : List[int]
+            Numbers of sites trained together (1 for train, number of columns for the column-parallel mode)
+        background : bool
+            if True the functions are compiled by a separate thread
+
+        Returns
+        -------
+        threading.Thread or None
+            Thread of the compilation (if background)
+        """
+        n_coeffs = self.Hs.qml_Hs.coefficients.shape[1]
+        calls = []
+        for batch_size in batch_sizes:
+            params = jnp.zeros((batch_size, self.n_params))
+            H = jnp.zeros((batch_size, n_coeffs))
+            for epochs in set([n_epochs, 10 * n_epochs]):
+                # Same arguments of train_sites, with no epoch to run
+                history = 2 ** int(np.ceil(np.log2(max(epochs, 1))))
+                calls.append(
+                    (self.j_optimize, (params, H, jnp.ones(batch_size), 0.1, 0, jnp.zeros(3, dtype=float), history))
+                )
+            calls.append((lambda p, H: self.jv_compute_vqe_E(self.jv_q_vqe_state(p), H), (params, H)))
+
+        # The training waits for the thread instead of compiling the same functions twice
+        self._warming = compilation.warm_up(calls, background)
+
+        return self._warming
+
+    def _wait_warm_up(self):
+        """
+        Wait for the compilation started by warm_up (if any)
+        """
+        warming = getattr(self, "_warming", None)
+        if warming is not None:
+            warming.join()
+            self._warming = None
+
+    def _add_true_e0(self, sites: List[int]):
+        """
+        Ground-state energies of the sites (free fermions or exact diagonalization),
+        only the ones still missing (null) in Hs.true_e0 are computed
+        """
+        if getattr(self.Hs, "true_e0", None) is None:
+            self.Hs.true_e0 = np.zeros((self.Hs.n_states,))
+
+        free = free_fermions.is_free(self.Hs.qml_Hs)
+        for site in sites:
+            if self.Hs.true_e0[site] != 0:
+                continue
+            if free[site]:
+                self.Hs.true_e0[site] = free_fermions.grid_spectrum(self.Hs.qml_Hs, [site])[0][0, 0]
+            else:
+                # Same cache entries of hamiltonians.diagonalize (add_true)
+                self.Hs.true_e0[site] = hamiltonians.point_eigh(self.Hs.qml_Hs, site, 1)[0][0]
+
+    def train_site(
+        self,
+        lr: Number,
+        n_epochs: int,
+        site: int,
+        tol: Number = 0,
+        grad_tol: Number = 0,
+        acc_tol: Number = 0,
+    ) -> np.ndarray:
         """
         Minimize <psi|H|psi> for a single site
         
         """
-        # Get all the necessary training parameters for the VQD algorithm
-        # > H: Hamiltonian of the model
-        # > H_eff: Effective Hamiltonian for the model (H +|psi><psi|)
+        return self.train_sites(lr, n_epochs, [site], tol, grad_tol, acc_tol)
+
+    def train_sites(
+        self,
+        lr: Number,
+        n_epochs: int,
+        sites: List[int],
+        tol: Number = 0,
+        grad_tol: Number = 0,
+        acc_tol: Number = 0,
+    ) -> np.ndarray:
+        """
+        Minimize <psi|H|psi> for a batch of sites at once: the states of all the sites
+        are simulated by the same vmapped circuit and each parameter has its own Adam state,
+        hence every site is optimized independently.
+        The whole optimization runs as a single compiled loop, every site stops as soon as
+        one of the tolerances is met (0: never). The epochs spent on each site are recorded
+        in vqe_epochs
+
+        Parameters
+        ----------
+        lr : float
+            Learning rate to be multiplied in the circuit-gradient output
+        n_epochs : int
+            Maximum number of epochs
+        sites : List[int]
+            Indexes of the sites to train
+        tol : float
+            Tolerance on the change of the energy between two epochs
+        grad_tol : float
+            Tolerance on the norm of the gradient
+        acc_tol : float
+            Tolerance on the relative error wrt the true ground-state energy
+
+        Returns
+        -------
+        np.ndarray
+            Loss (mean energy of the sites) of each epoch run
+        """
+        sites = np.array(sites, dtype=int)
+        # Get all the necessary training parameters for the VQE algorithm
+        # > H: Coefficients of the Hamiltonians of the model on the operator basis
+        # > true_e0: Ground-state energy (free fermions or exact diagonalization)
         # > site: index for (L,K) combination
-        H, self.Hs.true_e0[site] = qmlgen.get_VQE_params(self.Hs.qml_Hs[site])
+        H = jnp.array(self.Hs.qml_Hs.coefficients[sites])
+        self._add_true_e0(sites)
+        self.true_e0[sites] = self.Hs.true_e0[sites]
+        self._wait_warm_up()
+
+        # History buffers are rounded to powers of 2 to limit recompilations
+        history = 2 ** int(np.ceil(np.log2(max(n_epochs, 1))))
+        param, losses, epochs, site_epochs = self.j_optimize(
+            jnp.array(self.vqe_params0[sites]),
+            H,
+            jnp.array(self.Hs.true_e0[sites]),
+            lr,
+            n_epochs,
+            jnp.array([tol, grad_tol, acc_tol], dtype=float),
+            history,
+        )
 
-        index = [site]
-        param = copy.copy(self.vqe_params0[index])
+        self.vqe_e0[sites] = self.jv_compute_vqe_E(self.jv_q_vqe_state(param), H)
+        self.vqe_params0[sites] = param
+        try:
+            self.vqe_epochs[sites] += np.asarray(site_epochs)
+        except AttributeError:
+            self.vqe_epochs = np.zeros((self.Hs.n_states,), dtype=int)
+            self.vqe_epochs[sites] = np.asarray(site_epochs)
+
+        return np.asarray(losses[: int(epochs)])
+
+    def _train_columns(
+        self,
+        lr: Number,
+        n_epochs: int,
+        n_columns: Union[int, None] = None,
+        log: Union[ckpt.checkpoint, None] = None,
+        start: int = 0,
+        **stop
+    ):
+        """
+        Column-parallel training (see train):
+        > the kappa = 0 column is trained along h, as in the snake;
+        > the h = 0 row is trained along kappa, every site starting from its h = 0 neighbour;
+        > the other columns advance along h together, n_columns of them in a single batch
+          (see train_sites), every site starting from the previous site of its column.
 
-        opt_init, opt_update, get_params = optimizers.adam(lr)
-        opt_state = opt_init(param)
+        Parameters
+        ----------
+        lr : float
+            Learning rate to be multiplied in the circuit-gradient output
+        n_epochs : int
+            Total number of epochs for each learning
+        n_columns : int
+            Number of columns trained in the same batch (all of them if None)
+        log : checkpoint.checkpoint
+            Checkpoint of the sweep (None: no checkpoint)
+        start : int
+            Position of the first step to train (the previous ones are restored from the checkpoint)
+        **stop : arguments
+            Tolerances of the early stopping (tol, grad_tol, acc_tol), see train_sites
+        """
+        # Indexes of the grid: sites[kappa, h]
+        sites = np.arange(self.Hs.n_states).reshape(self.Hs.n_kappas, self.Hs.n_hs)
+
+        # Steps of the sweep: (sites the parameters are copied from, sites, epochs)
+        # > First site starts from a random configuration of parameters
+        steps = [(None, sites[:1, 0], 10 * n_epochs)]
+        # > kappa = 0 column and h = 0 row
+        for site, pred_site in zip(
+            np.concatenate((sites[0, 1:], sites[1:, 0])),
+            np.concatenate((sites[0, :-1], sites[:-1, 0])),
+        ):
+            steps.append((np.array([pred_site]), np.array([site]), n_epochs))
+        # > Remaining columns, advancing together along h
+        columns = np.arange(1, self.Hs.n_kappas)
+        n_columns = len(columns) if n_columns is None else n_columns
+        for first in range(0, len(columns), max(1, n_columns)):
+            batch = columns[first : first + max(1, n_columns)]
+            for h in range(1, self.Hs.n_hs):
+                steps.append((sites[batch, h - 1], sites[batch, h], n_epochs))
+
+        progress = tqdm(
+            total=self.Hs.n_states,
+            initial=sum(len(step_sites) for _, step_sites, _ in steps[:start]),
+            position=0,
+            leave=True,
+        )
+        for position, (pred_sites, step_sites, epochs) in enumerate(steps[start:], start):
+            if pred_sites is None:
+                self.vqe_params0[step_sites] = jnp.array(
+                    np.random.uniform(-np.pi, np.pi, size=(len(step_sites), self.n_params))
+                )
+            else:
+                self.vqe_params0[step_sites] = copy.copy(self.vqe_params0[pred_sites])
+            self.train_sites(lr, epochs, step_sites, **stop)
+            self._checkpoint_step(log, position, step_sites)
+            progress.update(len(step_sites))
+
+    def _open_checkpoint(
+        self, filename: Union[str, None], every: int, resume: bool, header: dict
+    ) -> Tuple[Union[ckpt.checkpoint, None], int, int]:
+        """
+        Checkpoint of a sweep of train. If resume, the results of the steps already
+        in the checkpoint are restored, otherwise a new checkpoint is started
 
-        for _ in range(n_epochs):
-            param, opt_state = self._update(param, H, opt_state, opt_update, get_params)
+        Parameters
+        ----------
+        filename : str
+            File of the checkpoint (None: no checkpoint)
+        every : int
+            Number of steps between two writes of the checkpoint
+        resume : bool
+            if True the sweep continues from the checkpoint
+        header : dict
+            Description of the sweep, it must match the one of a resumed checkpoint
 
-        self.vqe_e0[site] = self.jv_compute_vqe_E(self.jv_q_vqe_state(param), H)
-        self.vqe_params0[site] = param
+        Returns
+        -------
+        checkpoint.checkpoint or None
+            Checkpoint of the sweep
+        int
+            Position of the first step to train
+        int
+            Epochs left unused by the completed steps (adaptive training)
+        """
+        if filename is None:
+            if resume:
+                raise ValueError("A checkpoint file is needed to resume the training")
+            return None, 0, 0
+
+        log = ckpt.checkpoint(filename, every)
+        old_header, records = log.read() if resume else (None, [])
+        if old_header is None:
+            log.start(header)
+            return log, 0, 0
+        if old_header != header:
+            raise ValueError("The checkpoint {0} belongs to a different sweep".format(filename))
+
+        for record in records:
+            sites = record["sites"]
+            self.vqe_params0[sites] = record["vqe_params0"]
+            self.vqe_e0[sites] = record["vqe_e0"]
+            self.vqe_epochs[sites] = record["vqe_epochs"]
+            self.Hs.true_e0[sites] = self.true_e0[sites] = record["true_e0"]
+        if not records:
+            return log, 0, 0
+
+        return log, records[-1]["position"] + 1, records[-1]["saved"]
+
+    def _checkpoint_step(self, log: Union[ckpt.checkpoint, None], position: int, sites: List[int], saved: int = 0):
+        """
+        Append the results of a step of the sweep to its checkpoint (if any)
+        """
+        if log is None:
+            return
+        sites = np.array(sites, dtype=int)
+        log.append(
+            position=position,
+            sites=sites,
+            vqe_params0=self.vqe_params0[sites],
+            vqe_e0=self.vqe_e0[sites],
+            true_e0=self.Hs.true_e0[sites],
+            vqe_epochs=self.vqe_epochs[sites],
+            saved=saved,
+        )
 
-    def train(self, lr: Number, n_epochs: int, circuit: bool = False):
+    def train(
+        self,
+        lr: Number,
+        n_epochs: int,
+        circuit: bool = False,
+        columns: bool = False,
+        n_columns: Union[int, None] = None,
+        tol: Number = 0,
+        grad_tol: Number = 0,
+        acc_tol: Number = 0,
+        adaptive: bool = False,
+        checkpoint_file: Union[str, None] = None,
+        checkpoint_every: int = 10,
+        resume: bool = False,
+    ):
         """
         Training function for the VQE.
+        Every site is trained until one of the tolerances is met (see train_sites) or for n_epochs,
+        the epochs spent on each site are recorded in vqe_epochs
 
         Parameters
         ----------
@@ -292,8 +807,32 @@ class vqe:
             Total number of epochs for each learning
         circuit : bool
             if True -> Prints the circuit
+        columns : bool
+            (IF ANNNI) if True, instead of following the recycle rule site by site, the kappa = 0
+            column and the h = 0 row are trained first and then all the other columns are trained
+            concurrently as a single batch
+        n_columns : int
+            (IF columns) Number of columns trained in the same batch (all of them if None)
+        tol : float
+            Tolerance on the change of the energy between two epochs (0: never stop)
+        grad_tol : float
+            Tolerance on the norm of the gradient (0: never stop)
+        acc_tol : float
+            Tolerance on the relative error wrt the true ground-state energy (0: never stop)
+        adaptive : bool
+            if True the epochs left unused by the sites that stopped early are given to the
+            following sites of the recycle rule (up to MAX_BUDGET_FACTOR * n_epochs per site)
+        checkpoint_file : str
+            if given, the results of the sites (vqe_params0, vqe_e0, true_e0, vqe_epochs) and the
+            position in the sweep are appended to this file as the training goes (see checkpoint)
+        checkpoint_every : int
+            Number of steps of the sweep (sites, or batches of columns) between two writes of the checkpoint
+        resume : bool
+            if True the sites already in checkpoint_file are restored and the sweep continues
+            from the first step missing. The circuit, the Hamiltonians (see cache.grid_key), the
+            learning rate, the tolerances and the other arguments must be the same of the interrupted run
         """
-        pred_site: int
+        stop = dict(tol=tol, grad_tol=grad_tol, acc_tol=acc_tol)
 
         if circuit:
             # Display the circuit
@@ -308,13 +847,79 @@ class vqe:
             np.zeros((self.Hs.n_states, self.n_params)),
             np.zeros((self.Hs.n_states,)),
         )
+        self.vqe_epochs = np.zeros((self.Hs.n_states,), dtype=int)
+
+        # Compile the training step while the first true energies are computed
+        self.warm_up(n_epochs, [1] if not columns else [1, max(1, self.Hs.n_kappas - 1)])
 
         try:
             self.Hs.true_e0
         except:
             self.Hs.true_e0 = np.array([0.]*len(self.Hs.recycle_rule))
 
-        progress = tqdm(self.Hs.recycle_rule, position=0, leave=True)
+        header = dict(
+            N=self.Hs.N,
+            n_states=self.Hs.n_states,
+            n_params=self.n_params,
+            circuit=self.circuit_fun.__name__,
+            recycle_rule=[int(site) for site in self.Hs.recycle_rule],
+            n_epochs=n_epochs,
+            columns=columns,
+            n_columns=n_columns if columns else None,
+            adaptive=adaptive,
+            lr=float(lr),
+            **{name: float(value) for name, value in stop.items()},
+            hamiltonians=[cache.grid_key(self.Hs.qml_Hs, site) for site in range(self.Hs.n_states)],
+        )
+        log, start, saved = self._open_checkpoint(checkpoint_file, checkpoint_every, resume, header)
+
+        try:
+            if columns:
+                self._train_columns(lr, n_epochs, n_columns, log, start, **stop)
+            else:
+                self._train_snake(lr, n_epochs, adaptive, log, start, saved, **stop)
+        finally:
+            # Steps still buffered (e.g. KeyboardInterrupt)
+            if log is not None:
+                log.flush()
+
+    def _train_snake(
+        self,
+        lr: Number,
+        n_epochs: int,
+        adaptive: bool = False,
+        log: Union[ckpt.checkpoint, None] = None,
+        start: int = 0,
+        saved: int = 0,
+        **stop
+    ):
+        """
+        Site-by-site training following the recycle rule (see train)
+
+        Parameters
+        ----------
+        lr : float
+            Learning rate to be multiplied in the circuit-gradient output
+        n_epochs : int
+            Total number of epochs for each learning
+        adaptive : bool
+            if True the epochs left unused are given to the following sites
+        log : checkpoint.checkpoint
+            Checkpoint of the sweep (None: no checkpoint)
+        start : int
+            Position in the recycle rule of the first site to train
+        saved : int
+            Epochs left unused by the sites before start
+        **stop : arguments
+            Tolerances of the early stopping (tol, grad_tol, acc_tol), see train_sites
+        """
+        pred_site: int
+        recycle_rule = self.Hs.recycle_rule
+        progress = tqdm(
+            recycle_rule[start:], total=len(recycle_rule), initial=start, position=0, leave=True
+        )
+        if start > 0:
+            pred_site = recycle_rule[start - 1]
         # Site will follow the order of Hs.recycle rule:
         # For ANNI Model:
         #     INDICES              RECYCLE RULE
@@ -331,7 +936,7 @@ class vqe:
         # +------------ -        +------------ -
         # | 0 | 1 | 2 |     ==>  | 0 | 1 | 2 |
         # +------------ -        +------------ -
-        for site in progress:
+        for position, site in enumerate(progress, start):
             # First site will be trained more since it starts from a
             # random configuration of parameters
             if site == 0:
@@ -345,14 +950,107 @@ class vqe:
                 # Initial state is the final state of last site trained
                 self.vqe_params0[site] = copy.copy(self.vqe_params0[pred_site])
 
-            self.train_site(lr, epochs, int(site))
+            budget = epochs
+            if adaptive:
+                budget += min(saved, (MAX_BUDGET_FACTOR - 1) * epochs)
+            used = len(self.train_site(lr, budget, int(site), **stop))
+            saved += epochs - used  # Epochs left unused by the previous sites
             pred_site = site  # Previous site for next training
+            self._checkpoint_step(log, position, [site], saved)
+
+    def _grid_pairs(self) -> np.ndarray:
+        """
+        Pairs of neighbouring sites of the grid (along h and along kappa)
+        """
+        sites = np.arange(self.Hs.n_states).reshape(self.Hs.n_kappas, self.Hs.n_hs)
+
+        return np.concatenate(
+            (
+                np.stack((sites[:, :-1].flatten(), sites[:, 1:].flatten()), axis=1),
+                np.stack((sites[:-1].flatten(), sites[1:].flatten()), axis=1),
+            )
+        )
+
+    def train_batched(
+        self,
+        lr: Number,
+        n_epochs: int,
+        batch_size: Union[int, None] = None,
+        smoothness: Number = 0.0,
+        restart: bool = True,
+    ):
+        """
+        Training function for the VQE optimizing many sites at once: each step (energies of
+        the whole batch, gradients and Adam update) is a single jitted function and every
+        site has its own Adam state.
+        The snake of train transfers the parameters from a site to the next one, here the
+        optional term
+                smoothness * Σ_(i,j neighbours) Σ_k (1 - cos(params_i[k] - params_j[k]))
+        keeps the parameters of neighbouring sites close instead
+
+        Parameters
+        ----------
+        lr : float
+            Learning rate to be multiplied in the circuit-gradient output
+        n_epochs : int
+            Total number of epochs for each batch
+        batch_size : int
+            Number of sites optimized together (all of them if None), the batches are
+            ranges of consecutive site indexes (in the order of the flattened grid),
+            hence a batch may end in the middle of a column
+        smoothness : float
+            Strength of the coupling between neighbouring sites of the same batch
+        restart : bool
+            if True every site starts from the same random parameters,
+            otherwise from the current vqe_params0
+        """
+        n_states = self.Hs.n_states
+        if restart:
+            params = np.random.uniform(-np.pi, np.pi, size=(self.n_params))
+            self.vqe_params0 = np.tile(params, (n_states, 1))
+        else:
+            self.vqe_params0 = np.array(self.vqe_params0)
+        self.vqe_e0, self.true_e0 = np.zeros((n_states,)), np.zeros((n_states,))
+        try:
+            self.Hs.true_e0
+        except:
+            self.Hs.true_e0 = np.array([0.]*n_states)
+
+        # The step is shared by the VQEs of the same circuit (see _vqe_functions)
+        opt_init, _, get_params = optimizers.adam(lr)
+
+        batch_size = n_states if batch_size is None else batch_size
+        pairs = self._grid_pairs()
+        for start in tqdm(range(0, n_states, batch_size), position=0, leave=True):
+            sites = np.arange(start, min(start + batch_size, n_states))
+            # Pairs inside the batch, in local indexes
+            local = pairs[np.all((pairs >= sites[0]) & (pairs <= sites[-1]), axis=1)] - sites[0]
+            local = jnp.array(local, dtype=int)
+
+            H = jnp.array(self.Hs.qml_Hs.coefficients[sites])
+            opt_state = opt_init(jnp.array(self.vqe_params0[sites]))
+            for epoch in range(n_epochs):
+                opt_state = self.j_batched_step(lr, smoothness, epoch, opt_state, H, local)
+            params = get_params(opt_state)
+
+            self.vqe_e0[sites] = self.jv_compute_vqe_E(self.jv_q_vqe_state(params), H)
+            self.vqe_params0[sites] = params
+            self._add_true_e0(sites)
+            self.true_e0[sites] = self.Hs.true_e0[sites]
 
     def train_refine(
-        self, lr: Number, n_epochs: int, acc_thr: Number, assist: bool = False
+        self,
+        lr: Number,
+        n_epochs: int,
+        acc_thr: Number,
+        assist: bool = False,
+        batch_size: Union[int, None] = None,
+        **stop
     ):
         """
-        Training only the sites that have an accuracy score worse (higher) than acc_thr
+        Training only the sites that have an accuracy score worse (higher) than acc_thr.
+        The sites are selected all at once and they are trained together as batches
+        of the vmapped optimization (see train_sites)
 
         Parameters
         ----------
@@ -364,35 +1062,40 @@ class vqe:
             Accuracy threshold for which selecting the sites to train
         assist : bool
             if True -> Each site that will be trained will start from the neighbouring site
-            that has the better accuracy
+            that has the better accuracy (before the refinement)
+        batch_size : int
+            Number of sites trained together (all of them if None)
+        **stop : arguments
+            Tolerances of the early stopping (tol, grad_tol, acc_tol), see train_sites
         """
-        progress = tqdm(range(self.Hs.n_states), position=0, leave=True)
-
-        # Select the sites to train based on their accuracy score
-        for site in self.Hs.recycle_rule:
-            # Accuracy value of the given site
-            accuracy = np.abs(
-                (self.vqe_e0[site] - self.true_e0[site]) / self.true_e0[site]
-            )
-
-            if accuracy > acc_thr:  # If the accuracy is bad (higher than threshold)...
-                # if assist we copy the state from the best neighbouring site and
-                # starting training from there
-                if assist:
-                    # Array of indexes of neighbouring sites
-                    neighbours = np.array(self._get_neighbours(site))
-                    # Array of their respective accuracies
-                    neighbours_accuracies = np.abs(
-                        (self.vqe_e0[neighbours] - self.true_e0[neighbours])
-                        / self.true_e0[neighbours]
-                    )
-                    # Select the index of the neighbour with the best (lowest) accuracy score
-                    best_neighbour = neighbours[np.argmin(neighbours_accuracies)]
-                    self.vqe_params0[site] = copy.copy(self.vqe_params0[best_neighbour])
-                # Start training the site
-                self.train_site(lr, n_epochs, int(site))
-
-            progress.update(1)
+        self.vqe_params0 = np.array(self.vqe_params0)
+        self.vqe_e0 = np.array(self.vqe_e0)
+
+        # Accuracy score of every site
+        accuracy = np.abs((self.vqe_e0 - self.true_e0) / self.true_e0)
+        # Sites to train (if the accuracy is bad, higher than threshold), in the order of the recycle rule
+        recycle_rule = np.array(self.Hs.recycle_rule, dtype=int)
+        sites = recycle_rule[accuracy[recycle_rule] > acc_thr]
+        if len(sites) == 0:
+            return
+
+        # if assist we copy the state from the best neighbouring site and
+        # starting training from there
+        if assist:
+            neighbours = self._neighbours_table()[sites]
+            # Accuracies of the neighbours, missing neighbours are never the best
+            neighbours_accuracies = np.where(neighbours >= 0, accuracy[neighbours], np.inf)
+            best = np.argmin(neighbours_accuracies, axis=1)
+            has_neighbours = np.isfinite(neighbours_accuracies[np.arange(len(sites)), best])
+            best_neighbours = neighbours[np.arange(len(sites)), best]
+            self.vqe_params0[sites[has_neighbours]] = self.vqe_params0[best_neighbours[has_neighbours]]
+
+        batch_size = len(sites) if batch_size is None else max(1, batch_size)
+        progress = tqdm(total=len(sites), position=0, leave=True)
+        for start in range(0, len(sites), batch_size):
+            batch = sites[start : start + batch_size]
+            self.train_sites(lr, n_epochs, batch, **stop)
+            progress.update(len(batch))
 
     def show(self, **kwargs):
         """
@@ -507,6 +1210,11 @@ def load_vqe(filename: str) -> vqe:
     with open(filename, "rb") as f:
         things_to_load = pickle.load(f)
 
+    Hs = things_to_load[0]
+    # Hamiltonian classes saved before the operator grids store a list of Pennylane Hamiltonians
+    if not isinstance(Hs.qml_Hs, operators.operator_grid):
+        Hs.qml_Hs = operators.grid_from_hamiltonians(Hs.qml_Hs, Hs.N, getattr(Hs, "ring", False))
+
     if len(things_to_load) == 5:
         Hs, vqe_params, vqe_e, true_e, circuit_fun = things_to_load
         loaded_vqe = vqe(Hs, circuit_fun)
@@ -531,5 +1239,8 @@ def load_vqe(filename: str) -> vqe:
     loaded_vqe.vqe_params0 = vqe_params
     loaded_vqe.vqe_e0 = vqe_e
     loaded_vqe.true_e0 = true_e
+    # Legacy Hamiltonian classes keep no true energies, the ones of the VQE are used
+    if not hasattr(Hs, "true_e0"):
+        Hs.true_e0 = np.array(true_e)
 
     return loaded_vqe